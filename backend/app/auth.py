@@ -1,11 +1,15 @@
+import hashlib
 import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 import jwt
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from .config import config
+from . import metrics
 
 
 class LoginRequest(BaseModel):
@@ -19,11 +23,76 @@ class LoginResponse(BaseModel):
     expires_in: int
 
 
+class TokenCache:
+    """LRU cache of verified access tokens, keyed by the SHA-256 digest of the token.
+
+    Only tokens that passed verification are stored, with the user they belong
+    to. An entry is dropped at the token's `exp`, or `ttl_seconds` after it was
+    verified if that comes first. Raw tokens are never kept in memory.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # digest -> (user, expires at as a unix timestamp), least recently used first
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        """The cached user for a token digest, counting the hit or miss"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: bytes, user: str, exp: Optional[float]) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self._entries[key] = (user, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+
 class AuthService:
     def __init__(self):
         self.secret = config.AUTH_SECRET
         self.expires_minutes = 60
         self.algorithm = "HS256"
+        self.token_cache = TokenCache(config.AUTH_TOKEN_CACHE_MAX_ENTRIES, config.AUTH_TOKEN_CACHE_TTL_SECONDS)
+        self.verifications = 0
+        self.verify_seconds = 0.0
         
         # Demo credentials - hardcoded for assignment
         self.demo_email = "test@example.com"
@@ -48,20 +117,48 @@ class AuthService:
         return token, self.expires_minutes * 60
 
     def verify_token(self, token: str) -> Optional[str]:
-        """Verify JWT token and return user email if valid"""
+        """Verify JWT token and return user email if valid (HTTP and WebSocket auth both use this)"""
+        key = self.token_cache.make_key(token)
+        email = self.token_cache.get(key)
+        if email is not None:
+            metrics.token_verifications_total.labels("cache_hit").inc()
+            return email
+
+        started = time.perf_counter()
+        email, exp = self._decode(token)
+        elapsed = time.perf_counter() - started
+        self.verifications += 1
+        self.verify_seconds += elapsed
+        metrics.token_verify_seconds.observe(elapsed)
+        metrics.token_verifications_total.labels("valid" if email else "invalid").inc()
+
+        if email is not None:
+            self.token_cache.put(key, email, exp)
+        return email
+
+    def _decode(self, token: str) -> Tuple[Optional[str], Optional[float]]:
+        """Check a token's signature and claims; returns (email, exp) or (None, None)"""
         try:
             payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
             email = payload.get("sub")
             token_type = payload.get("type")
             
             if email is None or token_type != "access":
-                return None
+                return None, None
                 
-            return email
+            return email, payload.get("exp")
         except jwt.ExpiredSignatureError:
-            return None
+            return None, None
         except jwt.InvalidTokenError:
-            return None
+            return None, None
+
+    def stats(self) -> dict:
+        return {
+            "token_cache": self.token_cache.stats(),
+            "verifications": self.verifications,
+            "verify_ms_total": round(self.verify_seconds * 1000, 3),
+            "verify_ms_mean": round(self.verify_seconds * 1000 / self.verifications, 4) if self.verifications else 0.0,
+        }
 
     async def login(self, request: LoginRequest) -> LoginResponse:
         """Handle login and return access token"""
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from .config import config
+
+
+class PromptCache:
+    """LRU cache of generated image URLs keyed by everything that determines the image.
+
+    Identical requests that arrive while a generation is in flight share that
+    generation (single-flight) instead of starting their own. Entries expire
+    with the delivery URL, using the URL's own `Expires` parameter when it has
+    one and `url_ttl_seconds` otherwise. A URL is only served if it stays
+    valid for at least `min_remaining_seconds`, so the client has time to load it.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        url_ttl_seconds: float = 3600,
+        min_remaining_seconds: float = 300,
+        enabled: bool = True,
+    ):
+        self.max_entries = max_entries
+        self.url_ttl_seconds = url_ttl_seconds
+        self.min_remaining_seconds = min_remaining_seconds
+        self.enabled = enabled
+        # key -> (url, expires at as a unix timestamp), least recently used first
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, version: str, prompt: str, params: dict, variant: str) -> str:
+        """Cache key for one image; `variant` tells apart the images of one request"""
+        raw = json.dumps([model, version, prompt, params, variant], sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Look up a URL, counting the hit or miss"""
+        url = self._lookup(key)
+        if url is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return url
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        url, expires_at = entry
+        if expires_at - time.time() < self.min_remaining_seconds:
+            del self._entries[key]
+            self.expired += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return url
+
+    def put(self, key: str, url: str) -> None:
+        if not self.enabled:
+            return
+        self._entries[key] = (url, self._expires_at(url))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_generate(self, key: str, generate: Callable[[], Awaitable[str]], bypass: bool = False) -> str:
+        """Return a cached URL, join an identical in-flight generation, or run `generate`"""
+        if not self.enabled:
+            return await generate()
+
+        if not bypass:
+            while True:
+                url = self._lookup(key)
+                if url is not None:
+                    self.hits += 1
+                    return url
+
+                leader = self._in_flight.get(key)
+                if leader is None:
+                    break
+
+                self.coalesced += 1
+                try:
+                    return await asyncio.shield(leader)
+                except asyncio.CancelledError:
+                    if leader.cancelled():
+                        # The generation we joined was cancelled, not us - try again
+                        continue
+                    raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Errors are re-raised to the leader; don't warn when nobody joined
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        try:
+            url = await generate()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            self.put(key, url)
+            future.set_result(url)
+            return url
+        finally:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+    def _expires_at(self, url: str) -> float:
+        expires = parse_qs(urlparse(url).query).get("Expires")
+        if expires:
+            try:
+                return float(expires[0])
+            except ValueError:
+                pass
+        return time.time() + self.url_ttl_seconds
+
+
+prompt_cache = PromptCache(
+    max_entries=config.PROMPT_CACHE_MAX_ENTRIES,
+    url_ttl_seconds=config.PROMPT_CACHE_URL_TTL_SECONDS,
+    enabled=config.PROMPT_CACHE_ENABLED,
+)
@@ -0,0 +1,120 @@
+import time
+from collections import deque
+from typing import Deque
+
+from .config import config
+from .replicate_client import ReplicateError
+
+
+class CircuitOpenError(ReplicateError):
+    """The breaker is open, so the call was not sent upstream"""
+
+    def __init__(self):
+        super().__init__("Replicate is unavailable (circuit breaker open)")
+
+
+class CircuitBreaker:
+    """Fast-fails Replicate work while the upstream error rate is too high.
+
+    Closed: calls go through and their outcomes fill a rolling window. Once the
+    window holds at least `min_calls` outcomes and the failure rate reaches
+    `failure_rate`, the breaker opens and rejects calls for `open_seconds`.
+    It then goes half-open and lets `half_open_trials` calls through: if they
+    all succeed it closes again, and a single failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_trials: int = 2,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_trials = half_open_trials
+        self.state = self.CLOSED
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow_request(self) -> bool:
+        """Whether a new call may go upstream; pair an allowed call with record_*() or release()"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._trials_in_flight = 0
+            self._trial_successes = 0
+
+        if self.state == self.HALF_OPEN:
+            if self._trials_in_flight + self._trial_successes >= self.half_open_trials:
+                self.rejected += 1
+                return False
+            self._trials_in_flight += 1
+        return True
+
+    def record_success(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self._trials_in_flight = max(self._trials_in_flight - 1, 0)
+            self._trial_successes += 1
+            if self._trial_successes >= self.half_open_trials:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            return
+        self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self._open()
+            return
+        self._outcomes.append(False)
+        if len(self._outcomes) >= self.min_calls and self._error_rate() >= self.failure_rate:
+            self._open()
+
+    def release(self) -> None:
+        """An allowed call ended without an outcome (e.g. it was cancelled)"""
+        if self.state == self.HALF_OPEN:
+            self._trials_in_flight = max(self._trials_in_flight - 1, 0)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "error_rate": round(self._error_rate(), 3),
+            "window_calls": len(self._outcomes),
+            "failure_rate_threshold": self.failure_rate,
+            "open_for_seconds": round(max(self.open_seconds - (time.monotonic() - self._opened_at), 0), 3)
+            if self.state == self.OPEN else 0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+    def _error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._trials_in_flight = 0
+        self.times_opened += 1
+
+
+circuit_breaker = CircuitBreaker(
+    failure_rate=config.CIRCUIT_FAILURE_RATE,
+    window=config.CIRCUIT_WINDOW,
+    min_calls=config.CIRCUIT_MIN_CALLS,
+    open_seconds=config.CIRCUIT_OPEN_SECONDS,
+    half_open_trials=config.CIRCUIT_HALF_OPEN_TRIALS,
+)
@@ -24,6 +24,9 @@ class Config:
     
     # Authentication
     AUTH_SECRET: str = os.getenv("AUTH_SECRET", "your-secret-key-change-in-production")
+    # Verified tokens are cached until their exp, or at most this long (0 entries disables the cache)
+    AUTH_TOKEN_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_TOKEN_CACHE_MAX_ENTRIES", "10000"))
+    AUTH_TOKEN_CACHE_TTL_SECONDS: float = float(os.getenv("AUTH_TOKEN_CACHE_TTL_SECONDS", "300"))
     
     # Replicate API Configuration
     REPLICATE_API_TOKEN: str = os.getenv("REPLICATE_API_TOKEN", "")
@@ -32,9 +35,86 @@ class Config:
         "stability-ai/stable-diffusion"
     )
     REPLICATE_MODEL_VERSION: str = os.getenv("REPLICATE_MODEL_VERSION", "")
+    # Point at a fake Replicate server for load tests (see bench/load_test.py)
+    REPLICATE_BASE_URL: str = os.getenv("REPLICATE_BASE_URL", "https://api.replicate.com/v1")
+    # Images per prediction via the model's num_outputs input (1 disables batching)
+    REPLICATE_MAX_OUTPUTS_PER_PREDICTION: int = int(os.getenv("REPLICATE_MAX_OUTPUTS_PER_PREDICTION", "1"))
+    # Publish a running image's progress again once it has advanced this many percentage points
+    RESULT_PROGRESS_STEP: int = int(os.getenv("RESULT_PROGRESS_STEP", "10"))
+
+    # Replicate webhooks (leave REPLICATE_WEBHOOK_URL empty to poll instead)
+    REPLICATE_WEBHOOK_URL: str = os.getenv("REPLICATE_WEBHOOK_URL", "")
+    REPLICATE_WEBHOOK_SECRET: str = os.getenv("REPLICATE_WEBHOOK_SECRET", "")
+    WEBHOOK_FALLBACK_POLL_INTERVAL: float = float(os.getenv("WEBHOOK_FALLBACK_POLL_INTERVAL", "30"))
+
+    # Replicate HTTP client pool
+    HTTP2_ENABLED: bool = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "0"))
+    HTTP_KEEPALIVE_EXPIRY: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+    HTTP_READ_TIMEOUT: float = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
     
     # Job Processing Configuration
     GEN_MAX_CONCURRENCY: int = int(os.getenv("GEN_MAX_CONCURRENCY", "5"))
+    GEN_MAX_CONCURRENCY_PER_USER: int = int(os.getenv("GEN_MAX_CONCURRENCY_PER_USER", "0"))
+    # Adaptive (AIMD) concurrency: GEN_MAX_CONCURRENCY is the starting limit
+    ADAPTIVE_CONCURRENCY: bool = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+    GEN_MIN_CONCURRENCY: int = int(os.getenv("GEN_MIN_CONCURRENCY", "1"))
+    GEN_MAX_CONCURRENCY_LIMIT: int = int(os.getenv("GEN_MAX_CONCURRENCY_LIMIT", "20"))
+    AIMD_DECREASE_FACTOR: float = float(os.getenv("AIMD_DECREASE_FACTOR", "0.5"))
+    AIMD_LATENCY_SPIKE_FACTOR: float = float(os.getenv("AIMD_LATENCY_SPIKE_FACTOR", "3.0"))
+    # Most jobs one POST /api/generate/bulk may submit
+    BULK_MAX_JOBS: int = int(os.getenv("BULK_MAX_JOBS", "100"))
     RETRY_ATTEMPTS: int = int(os.getenv("RETRY_ATTEMPTS", "3"))
+    # Cancel a running job once nobody is watching its stream any more (opt-in)
+    CANCEL_ON_LAST_VIEWER_DISCONNECT: bool = os.getenv("CANCEL_ON_LAST_VIEWER_DISCONNECT", "false").lower() == "true"
+    CANCEL_ON_DISCONNECT_GRACE_SECONDS: float = float(os.getenv("CANCEL_ON_DISCONNECT_GRACE_SECONDS", "10"))
+
+    # Circuit breaker for Replicate calls
+    CIRCUIT_FAILURE_RATE: float = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+    CIRCUIT_WINDOW: int = int(os.getenv("CIRCUIT_WINDOW", "20"))
+    CIRCUIT_MIN_CALLS: int = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+    CIRCUIT_OPEN_SECONDS: float = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+    CIRCUIT_HALF_OPEN_TRIALS: int = int(os.getenv("CIRCUIT_HALF_OPEN_TRIALS", "2"))
+
+    # Prompt-result cache
+    PROMPT_CACHE_ENABLED: bool = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() == "true"
+    PROMPT_CACHE_MAX_ENTRIES: int = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "10000"))
+    PROMPT_CACHE_URL_TTL_SECONDS: int = int(os.getenv("PROMPT_CACHE_URL_TTL_SECONDS", "3600"))
+
+    # Local image mirror (copies finished images and thumbnails to disk and serves them)
+    IMAGE_MIRROR_ENABLED: bool = os.getenv("IMAGE_MIRROR_ENABLED", "false").lower() == "true"
+    IMAGE_MIRROR_DIR: str = os.getenv("IMAGE_MIRROR_DIR", "image_mirror")
+    IMAGE_MIRROR_MAX_BYTES: int = int(os.getenv("IMAGE_MIRROR_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+    IMAGE_MIRROR_CONCURRENCY: int = int(os.getenv("IMAGE_MIRROR_CONCURRENCY", "4"))
+    IMAGE_THUMBNAIL_SIZE: int = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "384"))
+
+    # Job Store Configuration ("memory" or "sqlite")
+    JOB_STORE_BACKEND: str = os.getenv("JOB_STORE_BACKEND", "memory")
+    JOB_STORE_PATH: str = os.getenv("JOB_STORE_PATH", "jobs.db")
+    STORE_BATCH_WINDOW_MS: int = int(os.getenv("STORE_BATCH_WINDOW_MS", "10"))
+
+    # Where images are generated: "local" (in the API process) or "queue" (worker processes)
+    RUNNER_MODE: str = os.getenv("RUNNER_MODE", "local")
+    WORK_QUEUE_PATH: str = os.getenv("WORK_QUEUE_PATH", "work_queue.db")
+    WORK_LEASE_SECONDS: float = float(os.getenv("WORK_LEASE_SECONDS", "60"))
+    WORK_HEARTBEAT_SECONDS: float = float(os.getenv("WORK_HEARTBEAT_SECONDS", "15"))
+    WORK_MAX_ATTEMPTS: int = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+    WORK_POLL_INTERVAL: float = float(os.getenv("WORK_POLL_INTERVAL", "0.25"))
+    WORKER_DRAIN_SECONDS: float = float(os.getenv("WORKER_DRAIN_SECONDS", "30"))
+
+    # Finished-job retention (0 disables a limit)
+    JOB_RETENTION_SECONDS: int = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+    JOB_RETENTION_MAX_FINISHED: int = int(os.getenv("JOB_RETENTION_MAX_FINISHED", "1000"))
+    JOB_RETENTION_MAX_BYTES: int = int(os.getenv("JOB_RETENTION_MAX_BYTES", str(64 * 1024 * 1024)))
+    JOB_SWEEP_INTERVAL: float = float(os.getenv("JOB_SWEEP_INTERVAL", "30"))
+
+    # Streaming Configuration
+    # Longest ?wait= a long poll of GET /api/generate/{job_id} may ask for
+    LONG_POLL_MAX_SECONDS: float = float(os.getenv("LONG_POLL_MAX_SECONDS", "30"))
+    JOB_EVENT_LOG_SIZE: int = int(os.getenv("JOB_EVENT_LOG_SIZE", "1024"))
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+    WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+    WS_MAX_SUBSCRIPTIONS: int = int(os.getenv("WS_MAX_SUBSCRIPTIONS", "100"))
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,352 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import httpx
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from .config import config
+from .store import job_store
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are skipped without Pillow
+    Image = None
+
+THUMBNAIL_SUFFIX = ".thumb.webp"
+# Content is addressed by hash, so a URL's bytes never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"RIFF", "image/webp"),
+)
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _media_type(path: Path) -> str:
+    with open(path, "rb") as f:
+        head = f.read(12)
+    for signature, media_type in _SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return "application/octet-stream"
+
+
+class ImageMirror:
+    """Content-addressed local copies of finished images, with thumbnails.
+
+    After an image completes, a background task streams it from Replicate's
+    delivery URL into `root`, naming the file by the SHA-256 of its bytes, so
+    identical outputs are stored once. A WebP thumbnail is written next to it.
+    Files are tracked least-recently-served first, and the oldest are deleted
+    once the mirror grows past `max_bytes`. Results only point at the mirror
+    while their file is still in it.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        max_bytes: int,
+        thumbnail_size: int = 384,
+        concurrency: int = 4,
+        enabled: bool = True,
+    ):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.thumbnail_size = thumbnail_size
+        self.enabled = enabled
+        # digest -> bytes on disk (image + thumbnail), least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: set = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._stats = {"mirrored": 0, "deduplicated": 0, "failed": 0, "evictions": 0}
+
+    async def start(self) -> None:
+        """Index the files already on disk (called from the app lifespan)"""
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self._load_index)
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(config.HTTP_READ_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+                follow_redirects=True,
+            )
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _load_index(self) -> None:
+        (self.root / "tmp").mkdir(parents=True, exist_ok=True)
+        found = []
+        for path in self.root.glob("*/*"):
+            if path.parent.name == "tmp" or path.name.endswith(THUMBNAIL_SUFFIX):
+                continue
+            thumbnail = path.with_name(path.name + THUMBNAIL_SUFFIX)
+            size = path.stat().st_size + (thumbnail.stat().st_size if thumbnail.exists() else 0)
+            found.append((path.stat().st_mtime, path.name, size))
+
+        self._entries.clear()
+        for _, digest, size in sorted(found):
+            self._entries[digest] = size
+        self._total_bytes = sum(self._entries.values())
+        for leftover in (self.root / "tmp").iterdir():
+            leftover.unlink(missing_ok=True)
+
+    def path(self, digest: str, thumbnail: bool = False) -> Path:
+        path = self.root / digest[:2] / digest
+        return path.with_name(digest + THUMBNAIL_SUFFIX) if thumbnail else path
+
+    def contains(self, digest: Optional[str]) -> bool:
+        return bool(digest) and digest in self._entries
+
+    def schedule(self, job_id: str, index: int, url: str) -> None:
+        """Mirror a finished image in the background"""
+        if not self.enabled or not url:
+            return
+        task = asyncio.create_task(self._mirror(job_id, index, url))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _mirror(self, job_id: str, index: int, url: str) -> None:
+        async with self._semaphore:
+            try:
+                digest = await self._download(url)
+            except (httpx.HTTPError, OSError) as e:
+                self._stats["failed"] += 1
+                logger.warning("Could not mirror image %s of job %s: %s", index, job_id, e)
+                return
+        await job_store.annotate_result(job_id, index, content_hash=digest)
+
+    async def _download(self, url: str) -> str:
+        """Stream an image to disk while hashing it; returns its digest"""
+        tmp = self.root / "tmp" / uuid.uuid4().hex
+        hasher = hashlib.sha256()
+        try:
+            async with self._client.stream("GET", url) as response:
+                response.raise_for_status()
+                # File I/O runs off the event loop, like serving does
+                f = await asyncio.to_thread(open, tmp, "wb")
+                try:
+                    async for chunk in response.aiter_bytes(64 * 1024):
+                        hasher.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+
+            digest = hasher.hexdigest()
+            if digest not in self._entries:
+                size = await asyncio.to_thread(self._install, tmp, digest)
+        finally:
+            await asyncio.to_thread(tmp.unlink, missing_ok=True)
+
+        if digest in self._entries:
+            # Already mirrored, possibly by a download of the same bytes that finished first
+            self._entries.move_to_end(digest)
+            self._stats["deduplicated"] += 1
+            return digest
+
+        self._entries[digest] = size
+        self._total_bytes += size
+        self._stats["mirrored"] += 1
+        self._enforce_quota()
+        return digest
+
+    def _install(self, tmp: Path, digest: str) -> int:
+        """Move a downloaded image into place and make its thumbnail; returns the bytes used"""
+        path = self.path(digest)
+        path.parent.mkdir(exist_ok=True)
+        os.replace(tmp, path)
+        size = path.stat().st_size
+
+        if Image is not None:
+            thumbnail = self.path(digest, thumbnail=True)
+            try:
+                with Image.open(path) as image:
+                    image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                    image.save(thumbnail, "WEBP", quality=80)
+                size += thumbnail.stat().st_size
+            except Exception as e:
+                # Pillow raises more than OSError on hostile input (DecompressionBombError,
+                # ValueError, SyntaxError...); the full image is still served without a thumbnail
+                thumbnail.unlink(missing_ok=True)
+                logger.warning("Could not make a thumbnail for %s: %s", digest, e)
+        return size
+
+    def _enforce_quota(self) -> None:
+        # Keep the newest image even if it alone is over the quota
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            digest, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._stats["evictions"] += 1
+            for path in (self.path(digest), self.path(digest, thumbnail=True)):
+                path.unlink(missing_ok=True)
+
+    def lookup(self, digest: str, thumbnail: bool = False) -> List[Tuple[Path, str]]:
+        """(path, ETag) candidates for a mirrored image or its thumbnail, best first.
+
+        Marks the image recently used. Nothing touches the disk here; the caller
+        serves the first candidate that exists.
+        """
+        if not _DIGEST_RE.match(digest) or digest not in self._entries:
+            return []
+        self._entries.move_to_end(digest)
+
+        candidates = [(self.path(digest), f'"{digest}"')]
+        if thumbnail:
+            # No Pillow, or the image couldn't be decoded: the full image stands in
+            candidates.insert(0, (self.path(digest, thumbnail=True), f'"{digest}-thumb"'))
+        return candidates
+
+    @property
+    def evictions(self) -> int:
+        return self._stats["evictions"]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "images": len(self._entries),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "in_flight": len(self._tasks),
+            "thumbnails": Image is not None,
+            **self._stats,
+        }
+
+
+class ImageFileResponse(Response):
+    """Serves a file with a strong ETag, conditional GETs and single byte ranges.
+
+    The body goes out with the ASGI zero-copy (sendfile) or path-send extension
+    when the server offers one, and in chunks read off the event loop otherwise.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, request: Request, path: Path, etag: str, media_type: str):
+        super().__init__(media_type=media_type)
+        self.path = path
+        self.file_size = path.stat().st_size
+        self.offset = 0
+        self.count = self.file_size
+
+        self.headers["ETag"] = etag
+        self.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        self.headers["Accept-Ranges"] = "bytes"
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+            self.status_code = 304
+            self.count = 0
+            del self.headers["content-type"]
+            del self.headers["content-length"]
+            return
+
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if range_header and (if_range is None or if_range == etag):
+            self._apply_range(range_header)
+        self.headers["Content-Length"] = str(self.count)
+
+    def _apply_range(self, range_header: str) -> None:
+        match = _RANGE_RE.match(range_header.strip())
+        if not match or match.groups() == ("", ""):
+            # Multiple or malformed ranges: fall back to the whole file
+            return
+
+        start, end = match.groups()
+        if start:
+            first = int(start)
+            last = min(int(end), self.file_size - 1) if end else self.file_size - 1
+        else:
+            # Suffix range: the last N bytes
+            first = max(self.file_size - int(end), 0)
+            last = self.file_size - 1
+
+        if first >= self.file_size or first > last:
+            self.status_code = 416
+            self.count = 0
+            self.headers["Content-Range"] = f"bytes */{self.file_size}"
+            return
+
+        self.status_code = 206
+        self.offset = first
+        self.count = last - first + 1
+        self.headers["Content-Range"] = f"bytes {first}-{last}/{self.file_size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend", "file": f, "offset": self.offset, "count": self.count,
+                })
+            return
+        if "http.response.pathsend" in extensions and self.count == self.file_size:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = self.count
+            while remaining:
+                chunk = await asyncio.to_thread(f.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def _file_response(request: Request, candidates: List[Tuple[Path, str]]) -> Optional[Response]:
+    for path, etag in candidates:
+        try:
+            return ImageFileResponse(request, path, etag, _media_type(path))
+        except FileNotFoundError:
+            continue
+    return None
+
+
+async def image_response(request: Request, digest: str, thumbnail: bool = False) -> Optional[Response]:
+    """Response for a mirrored image or its thumbnail, or None if it isn't in the mirror"""
+    candidates = image_mirror.lookup(digest, thumbnail)
+    if not candidates:
+        return None
+    # Building the response stats and sniffs the file; keep that off the event loop
+    return await asyncio.to_thread(_file_response, request, candidates)
+
+
+image_mirror = ImageMirror(
+    config.IMAGE_MIRROR_DIR,
+    max_bytes=config.IMAGE_MIRROR_MAX_BYTES,
+    thumbnail_size=config.IMAGE_THUMBNAIL_SIZE,
+    concurrency=config.IMAGE_MIRROR_CONCURRENCY,
+    enabled=config.IMAGE_MIRROR_ENABLED,
+)
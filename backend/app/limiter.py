@@ -0,0 +1,146 @@
+import time
+from collections import deque
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Callable, Deque, Dict, List, Optional
+
+from .config import config
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for Replicate work.
+
+    Every healthy response grows the limit by 1/limit, so it rises by about one
+    slot per round of in-flight work. A 429, a 5xx, a transport error or a
+    latency spike (a response slower than `latency_spike_factor` times the
+    running average for that request type) cuts it by `decrease_factor`. Cuts
+    are spaced at least `cooldown` seconds apart so one burst of errors only
+    counts once. A Retry-After header pauses new work until it has passed.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int = 1,
+        max_limit: int = None,
+        decrease_factor: float = 0.5,
+        latency_spike_factor: float = 3.0,
+        cooldown: float = 1.0,
+        enabled: bool = True,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit or initial, initial)
+        self.decrease_factor = decrease_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self._limit = float(initial)
+        self._latency: Dict[str, float] = {}
+        self._last_decrease = 0.0
+        self.blocked_until = 0.0
+        self.history: Deque[dict] = deque(maxlen=100)
+        self._listeners: List[Callable[[], None]] = []
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def blocked_for(self) -> float:
+        """Seconds left before Retry-After allows new work"""
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def add_listener(self, callback: Callable[[], None]) -> None:
+        """Call `callback` whenever the limit grows or a pause ends"""
+        self._listeners.append(callback)
+
+    def record_response(self, kind: str, status_code: int, latency: float, retry_after: Optional[str] = None) -> None:
+        if status_code == 429 or status_code >= 500:
+            self._block(parse_retry_after(retry_after))
+            self._decrease(f"http {status_code}")
+            return
+        if status_code >= 400:
+            # Client errors say nothing about upstream capacity
+            return
+
+        baseline = self._latency.get(kind)
+        if baseline is not None and latency > baseline * self.latency_spike_factor:
+            self._decrease(f"latency spike on {kind} ({latency * 1000:.0f}ms vs {baseline * 1000:.0f}ms)")
+            return
+
+        self._latency[kind] = latency if baseline is None else baseline * 0.9 + latency * 0.1
+        self._increase()
+
+    def record_error(self, reason: str) -> None:
+        """A request failed without a response (timeout, connection error)"""
+        self._decrease(reason)
+
+    def stats(self) -> dict:
+        return {
+            "adaptive": self.enabled,
+            "limit": self.limit,
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "blocked_for_seconds": round(self.blocked_for(), 3),
+            "latency_ms": {kind: round(value * 1000, 1) for kind, value in self._latency.items()},
+            "history": list(self.history),
+        }
+
+    def _increase(self) -> None:
+        if not self.enabled or self._limit >= self.max_limit:
+            return
+        before = self.limit
+        self._limit = min(self._limit + 1 / self._limit, float(self.max_limit))
+        if self.limit != before:
+            self._record(before, "healthy")
+            self._notify()
+
+    def _decrease(self, reason: str) -> None:
+        now = time.monotonic()
+        if not self.enabled or now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        before = self.limit
+        self._limit = max(self._limit * self.decrease_factor, float(self.min_limit))
+        if self.limit != before:
+            self._record(before, reason)
+
+    def _block(self, seconds: Optional[float]) -> None:
+        if seconds:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def _record(self, before: int, reason: str) -> None:
+        self.history.append({
+            "at": datetime.utcnow().isoformat(),
+            "from": before,
+            "to": self.limit,
+            "reason": reason,
+        })
+
+    def _notify(self) -> None:
+        for callback in self._listeners:
+            callback()
+
+
+concurrency_limiter = AdaptiveLimiter(
+    initial=config.GEN_MAX_CONCURRENCY,
+    min_limit=config.GEN_MIN_CONCURRENCY,
+    max_limit=config.GEN_MAX_CONCURRENCY_LIMIT,
+    decrease_factor=config.AIMD_DECREASE_FACTOR,
+    latency_spike_factor=config.AIMD_LATENCY_SPIKE_FACTOR,
+    enabled=config.ADAPTIVE_CONCURRENCY,
+)
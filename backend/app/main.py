@@ -1,21 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect, Query
+import asyncio
+import base64
+import binascii
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, WebSocket, WebSocketDisconnect, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from .config import config
 from .sse import sse_headers, job_progress_stream
-from .websocket import websocket_job_stream, verify_websocket_token, ws_manager
-from .models import GenerateRequest, GenerateResponse, Job
-from .store import job_store
+from .websocket import websocket_job_stream, websocket_multiplex_stream, ws_manager
+from .models import (
+    BulkGenerateRequest, BulkGenerateResponse, GenerateRequest, GenerateResponse, ImageResult, Job, JobListResponse,
+    JobStatus,
+)
+from .store import JobCursor, job_store, result_timeline
 from .runner import job_runner
 from .auth import auth_service, get_current_user, LoginRequest, LoginResponse
+from .replicate_client import replicate_client
+from .webhooks import webhook_registry
+from .circuit_breaker import circuit_breaker
+from .cache import prompt_cache
+from .image_mirror import image_mirror, image_response
+from .limiter import concurrency_limiter
+from . import metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_store.start()
+    await replicate_client.start()
+    await job_runner.start()
+    await image_mirror.start()
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    try:
+        yield
+    finally:
+        loop_monitor.cancel()
+        await job_runner.close()
+        await image_mirror.close()
+        await replicate_client.close()
+        await job_store.close()
+
 
-app = FastAPI(title="AI Image Generation API")
+app = FastAPI(title="AI Image Generation API", lifespan=lifespan)
+
+REGISTRY.register(metrics.StoreCollector(job_store))
+metrics.concurrency_limit.set_function(lambda: concurrency_limiter.limit)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=config.ALLOWED_ORIGINS,
     allow_credentials=False,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
 )
 
@@ -24,6 +63,88 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint; unauthenticated like /health, so keep it off the public network"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/stats/http-pool")
+async def http_pool_stats(current_user: str = Depends(get_current_user)):
+    """Replicate connection pool usage (open/in-use/idle, new vs reused connections)"""
+    return replicate_client.pool_stats()
+
+
+@app.get("/api/stats/store")
+async def store_stats(current_user: str = Depends(get_current_user)):
+    """Job store size, retention limits and eviction counts"""
+    return job_store.stats()
+
+
+@app.get("/api/stats/scheduler")
+async def scheduler_stats(current_user: str = Depends(get_current_user)):
+    """Generation slots in use and queued work per user"""
+    return await job_runner.stats()
+
+
+@app.get("/api/stats/concurrency")
+async def concurrency_stats(current_user: str = Depends(get_current_user)):
+    """Adaptive concurrency limit, in-flight images and recent limit adjustments"""
+    return await job_runner.concurrency_stats()
+
+
+@app.get("/api/stats/circuit-breaker")
+async def circuit_breaker_stats(current_user: str = Depends(get_current_user)):
+    """Circuit breaker state, recent upstream error rate and rejected calls"""
+    return circuit_breaker.stats()
+
+
+@app.get("/api/stats/prompt-cache")
+async def prompt_cache_stats(current_user: str = Depends(get_current_user)):
+    """Prompt-result cache size, hits, misses and coalesced in-flight requests"""
+    return prompt_cache.stats()
+
+
+@app.get("/api/stats/auth")
+async def auth_stats(current_user: str = Depends(get_current_user)):
+    """Token cache hit rate and time spent verifying token signatures"""
+    return auth_service.stats()
+
+
+@app.get("/api/stats/image-mirror")
+async def image_mirror_stats(current_user: str = Depends(get_current_user)):
+    """Local image mirror size, quota, deduplicated downloads and evictions"""
+    return image_mirror.stats()
+
+
+# No auth: <img> tags can't send a bearer token, and content hashes can't be guessed
+@app.get("/api/images/{digest}", name="get_mirrored_image")
+async def get_mirrored_image(digest: str, request: Request):
+    """A mirrored image by content hash (supports Range, ETag and long-lived caching)"""
+    response = await image_response(request, digest)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
+
+
+@app.get("/api/images/{digest}/thumbnail", name="get_mirrored_thumbnail")
+async def get_mirrored_thumbnail(digest: str, request: Request):
+    """Thumbnail of a mirrored image (the full image if no thumbnail could be made)"""
+    response = await image_response(request, digest, thumbnail=True)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
+
+
+def _mirror_urls(request: Request, result: ImageResult) -> dict:
+    if not image_mirror.contains(result.content_hash):
+        return {"mirror_url": None, "thumbnail_url": None}
+    return {
+        "mirror_url": str(request.url_for("get_mirrored_image", digest=result.content_hash)),
+        "thumbnail_url": str(request.url_for("get_mirrored_thumbnail", digest=result.content_hash)),
+    }
+
+
 @app.post("/api/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest):
     """Authenticate user and return access token"""
@@ -32,7 +153,14 @@ async def login(request: LoginRequest):
 
 @app.post("/api/generate", response_model=GenerateResponse)
 async def create_generation_job(request: GenerateRequest, current_user: str = Depends(get_current_user)):
-    job = Job(prompt=request.prompt, num_images=request.num_images)
+    job = Job(
+        prompt=request.prompt,
+        num_images=request.num_images,
+        owner=current_user,
+        priority=request.priority,
+        seed=request.seed,
+        bypass_cache=request.bypass_cache,
+    )
     await job_store.create_job(job)
     
     await job_runner.start_job(job.id)
@@ -40,19 +168,124 @@ async def create_generation_job(request: GenerateRequest, current_user: str = De
     return GenerateResponse(job_id=job.id)
 
 
+@app.post("/api/generate/bulk", response_model=BulkGenerateResponse)
+async def create_generation_jobs(request: BulkGenerateRequest, current_user: str = Depends(get_current_user)):
+    """Submit several jobs at once; they are stored together and queued as one batch"""
+    jobs = [
+        Job(
+            prompt=item.prompt,
+            num_images=item.num_images,
+            owner=current_user,
+            priority=item.priority,
+            seed=item.seed,
+            bypass_cache=item.bypass_cache,
+        )
+        for item in request.jobs
+    ]
+    await job_store.create_jobs(jobs)
+
+    job_ids = [job.id for job in jobs]
+    await job_runner.start_jobs(job_ids)
+
+    return BulkGenerateResponse(job_ids=job_ids)
+
+
+def _encode_cursor(cursor: JobCursor) -> str:
+    created_at, job_id = cursor
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{job_id}".encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> JobCursor:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, job_id = raw.split("|", 1)
+        created_at = datetime.fromisoformat(created_at)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if created_at.tzinfo is not None:
+        # Jobs are stamped with naive UTC times; an aware one can't be compared with them
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, job_id
+
+
+@app.get("/api/jobs", response_model=JobListResponse)
+async def list_jobs(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: str = Depends(get_current_user),
+):
+    """The current user's jobs, newest first; follow next_cursor for older pages"""
+    before = _decode_cursor(cursor) if cursor else None
+    jobs, next_key = await job_store.list_jobs(current_user, limit, before)
+    return JobListResponse(jobs=jobs, next_cursor=_encode_cursor(next_key) if next_key else None)
+
+
+@app.post("/api/webhooks/replicate")
+async def replicate_webhook(request: Request):
+    """Receive Replicate prediction callbacks and wake the waiting image task"""
+    body = await request.body()
+    if not webhook_registry.verify_signature(request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+
+    webhook_registry.resolve(payload)
+    return {"status": "ok"}
+
+
+@app.delete("/api/generate/{job_id}")
+async def cancel_generation_job(job_id: str, current_user: str = Depends(get_current_user)):
+    """Cancel a running job and its in-flight predictions"""
+    job = await job_store.get_job(job_id)
+    if not job or (job.owner and job.owner != current_user):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if not await job_runner.cancel_job(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.status.value}")
+
+    return {"job_id": job_id, "status": JobStatus.CANCELLED}
+
+
 @app.get("/api/generate/{job_id}/stream")
-async def stream_job_progress(job_id: str, current_user: str = Depends(get_current_user)):
+async def stream_job_progress(
+    job_id: str,
+    current_user: str = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
     job = await job_store.get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    
-    return StreamingResponse(job_progress_stream(job_id), headers=sse_headers())
+
+    resume_from = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+    return StreamingResponse(job_progress_stream(job_id, resume_from), headers=sse_headers())
+
+
+@app.websocket("/api/ws")
+async def websocket_multiplexed_progress(websocket: WebSocket, token: str = Query(...)):
+    """WebSocket endpoint that streams progress for many jobs over one connection"""
+    if auth_service.verify_token(token) is None:
+        await websocket.close(code=1008, reason="Invalid token")
+        return
+
+    connection = await ws_manager.connect_multiplexed(websocket)
+
+    try:
+        await websocket_multiplex_stream(connection)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        ws_manager.disconnect(connection)
 
 
 @app.websocket("/api/generate/{job_id}")
 async def websocket_job_progress(websocket: WebSocket, job_id: str, token: str = Query(...)):
     """WebSocket endpoint for job progress with token-based auth"""
-    if not verify_websocket_token(token):
+    if auth_service.verify_token(token) is None:
         await websocket.close(code=1008, reason="Invalid token")
         return
     
@@ -61,14 +294,14 @@ async def websocket_job_progress(websocket: WebSocket, job_id: str, token: str =
         await websocket.close(code=1000, reason="Job not found")
         return
     
-    await ws_manager.connect(websocket, job_id)
-    
+    connection = await ws_manager.connect(websocket, job_id)
+
     try:
-        await websocket_job_stream(websocket, job_id)
+        await websocket_job_stream(connection)
     except WebSocketDisconnect:
         pass
     finally:
-        ws_manager.disconnect(websocket, job_id)
+        ws_manager.disconnect(connection)
 
 
 @app.get("/api/generate/{job_id}/metrics")
@@ -82,35 +315,108 @@ async def get_job_metrics(job_id: str, current_user: str = Depends(get_current_u
         "status": job.status,
         "ttfi_ms": job.ttfi_ms,
         "total_ms": job.total_ms,
-        "completed_count": sum(1 for r in job.results if r.status == "completed"),
-        "failed_count": sum(1 for r in job.results if r.status == "failed"),
-        "total_count": len(job.results)
+        "completed_count": job.completed_count,
+        "failed_count": job.failed_count,
+        "total_count": len(job.results),
+        "stages": _stage_breakdown(job),
+        "images": [result_timeline(result) for result in job.results]
     }
 
 
+def _mean_ms(pairs) -> Optional[int]:
+    durations = [(end - start).total_seconds() * 1000 for start, end in pairs if start and end]
+    return int(sum(durations) / len(durations)) if durations else None
+
+
+def _stage_breakdown(job: Job) -> dict:
+    """Mean time per stage across a job's images: our scheduling overhead vs Replicate's queue and model time"""
+    results = job.results
+    predict_times = [r.predict_time for r in results if r.predict_time is not None]
+    return {
+        "queue_ms": _mean_ms((r.queued_at, r.slot_acquired_at) for r in results),
+        "submit_ms": _mean_ms((r.slot_acquired_at, r.prediction_created_at) for r in results),
+        "upstream_queue_ms": _mean_ms((r.prediction_created_at, r.prediction_started_at) for r in results),
+        "predict_ms": int(sum(predict_times) / len(predict_times) * 1000) if predict_times else None,
+        "end_to_end_ms": _mean_ms((r.queued_at, r.completed_at) for r in results),
+        "retried_images": sum(1 for r in results if r.attempts > 1),
+    }
+
+
+def _job_etag(job: Job) -> str:
+    # Mirror evictions turn mirror URLs back into Replicate URLs without touching the job
+    return f'W/"{job.version}.{image_mirror.evictions}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and (
+        if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+    )
+
+
 @app.get("/api/generate/{job_id}")
-async def get_job_results(job_id: str, current_user: str = Depends(get_current_user)):
-    """Polling endpoint to get current job results without SSE"""
+async def get_job_results(
+    job_id: str,
+    request: Request,
+    response: Response,
+    wait: float = Query(0, ge=0, le=config.LONG_POLL_MAX_SECONDS),
+    since_version: Optional[int] = Query(None, ge=0),
+    current_user: str = Depends(get_current_user),
+):
+    """Polling endpoint to get current job results without SSE.
+
+    Plain polls answer If-None-Match with 304. With `since_version`, only the
+    results changed after that version are returned, and `wait` holds the
+    request open (up to that many seconds) until there is a change.
+    """
     job = await job_store.get_job(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    
+
+    if wait:
+        metrics.open_streams.labels("long_poll").inc()
+        try:
+            job = await job_store.wait_for_change(
+                job_id, job.version if since_version is None else since_version, wait
+            )
+        finally:
+            metrics.open_streams.labels("long_poll").dec()
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+    if since_version is None:
+        # no-cache: clients may keep the body but must revalidate it on every poll
+        headers = {"ETag": _job_etag(job), "Cache-Control": "private, no-cache"}
+        if _etag_matches(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        response.headers.update(headers)
+        changed = enumerate(job.results)
+    else:
+        response.headers["Cache-Control"] = "no-store"
+        changed = ((index, result) for index, result in enumerate(job.results) if result.version > since_version)
+
     return {
         "job_id": job_id,
         "status": job.status,
+        "version": job.version,
         "results": [
             {
+                "index": index,
                 "id": result.id,
                 "status": result.status,
                 "url": result.url,
-                "error": result.error
+                "error": result.error,
+                "progress": result.progress,
+                "queue_wait_ms": result.queue_wait_ms,
+                "timeline": result_timeline(result),
+                **_mirror_urls(request, result)
             }
-            for result in job.results
+            for index, result in changed
         ],
         "progress": {
-            "completed": sum(1 for r in job.results if r.status == "completed"),
-            "failed": sum(1 for r in job.results if r.status == "failed"), 
-            "running": sum(1 for r in job.results if r.status == "running"),
+            "completed": job.completed_count,
+            "failed": job.failed_count,
+            "running": job.running_count,
             "total": len(job.results)
         }
     }
@@ -0,0 +1,114 @@
+"""
+Prometheus metrics for the generation pipeline.
+
+Recording is a counter bump or a bucket increment, so the hooks in JobRunner
+and ReplicateClient stay on in production. Gauges that mirror existing state
+(store size, concurrency limit) are read at scrape time instead.
+"""
+import asyncio
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+
+# Image work spends seconds to minutes in each stage
+_STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+queue_wait_seconds = Histogram(
+    "gen_queue_wait_seconds",
+    "Time an image waited in the scheduler for a generation slot",
+    buckets=_STAGE_BUCKETS,
+)
+retry_backoff_seconds = Histogram(
+    "gen_retry_backoff_seconds",
+    "Time an image slept between attempts",
+    buckets=_STAGE_BUCKETS,
+)
+retries_total = Counter(
+    "gen_retries_total",
+    "Image attempts that were retried, by reason",
+    ["reason"],
+)
+image_latency_seconds = Histogram(
+    "gen_image_latency_seconds",
+    "Time from job submission until an image finished, by outcome",
+    ["status"],
+    buckets=_STAGE_BUCKETS,
+)
+
+create_prediction_seconds = Histogram(
+    "replicate_create_prediction_seconds",
+    "Latency of the create-prediction request",
+    buckets=_STAGE_BUCKETS,
+)
+prediction_wait_seconds = Histogram(
+    "replicate_prediction_wait_seconds",
+    "Time spent waiting (polling or for the webhook) until a prediction finished",
+    ["mode"],
+    buckets=_STAGE_BUCKETS,
+)
+polls_per_prediction = Histogram(
+    "replicate_polls_per_prediction",
+    "Status requests made per prediction",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200),
+)
+predictions_in_flight = Gauge(
+    "replicate_predictions_in_flight",
+    "Predictions created and not yet finished",
+)
+
+open_streams = Gauge(
+    "gen_open_streams",
+    "Open progress streams, by transport",
+    ["transport"],
+)
+# Bound to the process's limiter with set_function()
+concurrency_limit = Gauge(
+    "gen_concurrency_limit",
+    "Current adaptive concurrency limit",
+)
+
+token_verifications_total = Counter(
+    "auth_token_verifications_total",
+    "Access token checks, by outcome (cache_hit, valid or invalid)",
+    ["result"],
+)
+token_verify_seconds = Histogram(
+    "auth_token_verify_seconds",
+    "Time to decode and verify an access token that wasn't cached",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01),
+)
+
+event_loop_lag_seconds = Histogram(
+    "process_event_loop_lag_seconds",
+    "How late the event loop woke a sleeping task",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+async def monitor_event_loop(interval: float = 0.25) -> None:
+    """Sample event loop lag until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(loop.time() - started - interval, 0))
+
+
+class StoreCollector:
+    """Exports the job store's size, read from its stats when Prometheus scrapes"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def collect(self):
+        stats = self.store.stats()
+        jobs = GaugeMetricFamily("job_store_jobs", "Jobs held in the job store, by state", labels=["state"])
+        jobs.add_metric(["running"], stats["running_jobs"])
+        jobs.add_metric(["finished"], stats["finished_jobs"])
+        yield jobs
+        yield GaugeMetricFamily(
+            "job_store_finished_bytes", "Approximate size of finished jobs in the store", value=stats["finished_bytes"]
+        )
+        yield GaugeMetricFamily(
+            "job_store_subscribers", "Stream subscriptions on the job store", value=stats["subscribers"]
+        )
@@ -1,22 +1,40 @@
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from uuid import uuid4
 
 from pydantic import BaseModel, Field, validator
 
+from .config import config
+
 
 class JobStatus(str, Enum):
     PENDING = "pending"
     RUNNING = "running"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_JOB_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
 
 
 class ResultStatus(str, Enum):
     RUNNING = "running"
+    STARTING = "starting"
+    PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_RESULT_STATUSES = (ResultStatus.COMPLETED, ResultStatus.FAILED, ResultStatus.CANCELLED)
+
+
+class Priority(str, Enum):
+    LOW = "low"
+    NORMAL = "normal"
+    HIGH = "high"
 
 
 class ImageResult(BaseModel):
@@ -24,17 +42,44 @@ class ImageResult(BaseModel):
     status: ResultStatus = ResultStatus.RUNNING
     url: Optional[str] = None
     error: Optional[str] = None
+    progress: Optional[int] = None
+    queue_wait_ms: Optional[int] = None
+    # Timeline (naive UTC); prediction_started_at and predict_time come from Replicate
+    queued_at: Optional[datetime] = None
+    slot_acquired_at: Optional[datetime] = None
+    prediction_created_at: Optional[datetime] = None
+    prediction_started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+    attempts: int = 0
+    prediction_id: Optional[str] = None
+    predict_time: Optional[float] = None
+    # SHA-256 of the image in the local mirror, once it has been copied there
+    content_hash: Optional[str] = None
+    # The job version of this result's last change
+    version: int = 0
 
 
 class Job(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid4()))
     prompt: str
     num_images: int
+    owner: Optional[str] = None
+    priority: Priority = Priority.NORMAL
+    seed: Optional[int] = None
+    bypass_cache: bool = False
     status: JobStatus = JobStatus.PENDING
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # When a runner queued the job's images (total_ms and ttfi_ms count from here)
+    started_at: Optional[datetime] = None
     results: List[ImageResult] = Field(default_factory=list)
     total_ms: Optional[int] = None
     ttfi_ms: Optional[int] = None
+    # Results per final status, kept current by the job store so reads never scan `results`
+    completed_count: int = 0
+    failed_count: int = 0
+    cancelled_count: int = 0
+    # Bumped by the job store on every change to the job or one of its results
+    version: int = 0
 
     def __init__(self, **data):
         super().__init__(**data)
@@ -44,10 +89,64 @@ class Job(BaseModel):
                 ImageResult() for _ in range(self.num_images)
             ]
 
+    @property
+    def running_count(self) -> int:
+        """Results that haven't finished yet"""
+        return len(self.results) - self.completed_count - self.failed_count - self.cancelled_count
+
+    def count_result(self, status: ResultStatus, delta: int) -> None:
+        """Adjust the counter for `status` (a no-op for unfinished statuses)"""
+        if status == ResultStatus.COMPLETED:
+            self.completed_count += delta
+        elif status == ResultStatus.FAILED:
+            self.failed_count += delta
+        elif status == ResultStatus.CANCELLED:
+            self.cancelled_count += delta
+
+    def recount(self) -> None:
+        """Rebuild the counters from `results`, e.g. after loading a job"""
+        self.completed_count = self.failed_count = self.cancelled_count = 0
+        for result in self.results:
+            self.count_result(result.status, 1)
+
+
+class JobSummary(BaseModel):
+    """A job without its results, for listings"""
+    id: str
+    prompt: str
+    num_images: int
+    status: JobStatus
+    priority: Priority = Priority.NORMAL
+    created_at: datetime
+    total_ms: Optional[int] = None
+    ttfi_ms: Optional[int] = None
+    completed_count: int = 0
+    failed_count: int = 0
+
+    @classmethod
+    def from_job(cls, job: "Job") -> "JobSummary":
+        return cls.model_validate(job.model_dump(include=set(cls.model_fields)))
+
+
+class JobEventType(str, Enum):
+    RESULT = "result"
+    DONE = "done"
+
+
+class JobEvent(BaseModel):
+    type: JobEventType
+    job_id: str
+    seq: int = 0
+    index: Optional[int] = None
+    data: Dict[str, Any] = Field(default_factory=dict)
+
 
 class GenerateRequest(BaseModel):
     prompt: str = Field(..., min_length=1)
     num_images: int = Field(..., ge=5, le=20)
+    priority: Priority = Priority.NORMAL
+    seed: Optional[int] = Field(None, ge=0)
+    bypass_cache: bool = False
 
     @validator('prompt')
     def validate_prompt(cls, v):
@@ -57,4 +156,18 @@ class GenerateRequest(BaseModel):
 
 
 class GenerateResponse(BaseModel):
-    job_id: str
\ No newline at end of file
+    job_id: str
+
+
+class BulkGenerateRequest(BaseModel):
+    jobs: List[GenerateRequest] = Field(..., min_length=1, max_length=config.BULK_MAX_JOBS)
+
+
+class BulkGenerateResponse(BaseModel):
+    job_ids: List[str]
+
+
+class JobListResponse(BaseModel):
+    jobs: List[JobSummary]
+    # Pass back as ?cursor= for the next (older) page; null on the last page
+    next_cursor: Optional[str] = None
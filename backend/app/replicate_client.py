@@ -1,14 +1,68 @@
 import asyncio
 import os
-from typing import Optional, Tuple
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
 import httpx
 import json
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 import replicate
 import os
 from .config import config
+from .webhooks import webhook_registry, TERMINAL_STATUSES
+from .limiter import concurrency_limiter, parse_retry_after
+from . import metrics
+
+# Prediction errors that will fail the same way however often they are retried
+PERMANENT_PREDICTION_ERRORS = ("nsfw", "safety", "invalid", "validation", "not allowed")
+
+# Receives each state of a prediction while it is still running
+PredictionCallback = Optional[Callable[[dict], Awaitable[None]]]
+# Receives (status, progress percentage, preview URL) as a prediction advances
+ProgressCallback = Optional[Callable[[str, Optional[int], Optional[str]], Awaitable[None]]]
+
+# tqdm-style progress lines in prediction logs, e.g. " 45%|████▌     | 23/50 [00:02<00:02]"
+_PERCENT_RE = re.compile(r"(\d{1,3})%\|")
+_STEPS_RE = re.compile(r"(\d+)/(\d+) \[")
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """A Replicate ISO 8601 timestamp as naive UTC, like the app's own timestamps"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class ReplicateError(Exception):
+    """Base class for failures talking to Replicate"""
+
+    retryable = False
+
+
+class TransientError(ReplicateError):
+    """Timeouts, connection errors, 5xx responses and flaky predictions - worth retrying"""
+
+    retryable = True
+
+
+class RateLimitedError(TransientError):
+    """Replicate answered 429; retry no sooner than `retry_after` seconds"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PermanentError(ReplicateError):
+    """Bad credentials, rejected input or content - retrying won't help"""
 
 
 class ReplicateClient:
@@ -16,55 +70,260 @@ class ReplicateClient:
         self.api_token = config.REPLICATE_API_TOKEN
         self.model = config.REPLICATE_MODEL
         self.model_version = config.REPLICATE_MODEL_VERSION
-        self.base_url = "https://api.replicate.com/v1"
-        self.timeout = httpx.Timeout(30.0, connect=10.0)
+        self.webhook_url = config.REPLICATE_WEBHOOK_URL
+        self.webhook_fallback_interval = config.WEBHOOK_FALLBACK_POLL_INTERVAL
+        self.base_url = config.REPLICATE_BASE_URL.rstrip("/")
+        self.timeout = httpx.Timeout(
+            config.HTTP_READ_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT
+        )
+        # Sized for the highest concurrency the adaptive limiter may reach, so connections
+        # opened after the limit grows are kept rather than reopened for every request
+        max_connections = max(config.GEN_MAX_CONCURRENCY, config.GEN_MAX_CONCURRENCY_LIMIT)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS or max_connections,
+            keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        self._background: set = set()
         self._initialized = False
-        
+        self._requests_total = 0
+        self._new_connections = 0
+
+    async def start(self) -> None:
+        """Open the shared connection pool (called from the app lifespan)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=config.HTTP2_ENABLED,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+
+    async def close(self) -> None:
+        """Close the shared connection pool, letting pending prediction cancels go out first"""
+        # A create that lands during shutdown queues its cancel here too
+        while self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        """httpcore trace hook - a TCP connect means the pool had nothing to reuse"""
+        if event_name == "connection.connect_tcp.complete":
+            self._new_connections += 1
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        client = await self._get_client()
+        self._requests_total += 1
+        started = time.monotonic()
+        try:
+            response = await client.request(
+                method, url, extensions={"trace": self._trace}, **kwargs
+            )
+        except httpx.TransportError as e:
+            concurrency_limiter.record_error(type(e).__name__)
+            raise
+
+        # Status polls repeat about once a second per prediction, so a healthy one says nothing new
+        # about capacity; only their failures count. Creates give one sample per round of work.
+        if method != "GET" or response.status_code == 429 or response.status_code >= 500:
+            concurrency_limiter.record_response(
+                method,
+                response.status_code,
+                time.monotonic() - started,
+                retry_after=response.headers.get("Retry-After"),
+            )
+        return response
+
+    def pool_stats(self) -> dict:
+        """Connection pool usage, for confirming connections are being reused"""
+        connections = []
+        if self._client is not None:
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []))
+
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "http2": config.HTTP2_ENABLED,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "open": len(connections),
+            "in_use": len(connections) - idle,
+            "idle": idle,
+            "requests_total": self._requests_total,
+            "new_connections": self._new_connections,
+            "reused_connections": max(self._requests_total - self._new_connections, 0),
+        }
+
     def _ensure_initialized(self):
         """Lazy initialization to check for API token only when actually needed"""
         if not self._initialized:
             if not self.api_token:
-                raise ValueError("REPLICATE_API_TOKEN environment variable is required")
+                raise PermanentError("REPLICATE_API_TOKEN environment variable is required")
             self._initialized = True
 
-    async def generate_image(self, prompt: str) -> Tuple[bool, Optional[str], Optional[str]]:
+    async def generate_image(
+        self,
+        prompt: str,
+        seed: Optional[int] = None,
+        on_progress: ProgressCallback = None,
+        on_prediction: PredictionCallback = None,
+    ) -> str:
         """
         Generate a single image using Replicate API.
-        Returns: (success, image_url, error_message)
+        Returns the image URL; raises a ReplicateError subclass on failure.
+        """
+        urls = await self.generate_images(
+            prompt, 1, seed=seed, on_progress=on_progress, on_prediction=on_prediction
+        )
+        return urls[0]
+
+    async def generate_images(
+        self,
+        prompt: str,
+        num_outputs: int,
+        seed: Optional[int] = None,
+        on_image: Optional[Callable[[int, str], Awaitable[None]]] = None,
+        on_progress: ProgressCallback = None,
+        on_prediction: PredictionCallback = None,
+    ) -> List[str]:
+        """
+        Generate up to `num_outputs` images with one prediction.
+        `on_image(position, url)` is awaited for each output as soon as it shows up.
+        `on_progress(status, percent, preview_url)` is awaited on every status
+        check while the prediction runs; with a single output, output that shows
+        up early is passed on as a preview rather than as the final image.
+        `on_prediction(prediction)` is awaited with the prediction when it is
+        created and again once it has finished (for its id, timestamps and metrics).
+        Returns the image URLs, which may be fewer than requested if the model
+        caps its outputs; raises a ReplicateError subclass on failure.
         """
         self._ensure_initialized()
-        
+
+        delivered: List[str] = []
+
+        async def deliver(output) -> None:
+            urls = self._extract_image_urls(output)[:num_outputs]
+            for position in range(len(delivered), len(urls)):
+                delivered.append(urls[position])
+                if on_image:
+                    await on_image(position, urls[position])
+
+        async def on_update(prediction: dict) -> None:
+            preview_url = None
+            if num_outputs > 1:
+                await deliver(prediction.get("output"))
+            else:
+                urls = self._extract_image_urls(prediction.get("output"))
+                preview_url = urls[-1] if urls else None
+            if on_progress:
+                await on_progress(
+                    prediction.get("status"), self._parse_progress(prediction.get("logs")), preview_url
+                )
+
         try:
-            prediction_id = await self._create_prediction(prompt)
+            # Shielded: a create cancelled mid-flight may still start a (billed) prediction upstream
+            create = asyncio.ensure_future(self._create_prediction(prompt, seed, num_outputs))
+            try:
+                with metrics.create_prediction_seconds.time():
+                    prediction = await asyncio.shield(create)
+            except asyncio.CancelledError:
+                create.add_done_callback(self._cancel_created_prediction)
+                self._background.add(create)
+                create.add_done_callback(self._background.discard)
+                raise
+            prediction_id = prediction.get("id")
             if not prediction_id:
-                return False, None, "Failed to create prediction"
-            
-            result = await self._poll_prediction(prediction_id)
-            
-            if result["status"] == "succeeded":
-                image_url = self._extract_image_url(result["output"])
-                if image_url:
-                    return True, image_url, None
-                else:
-                    return False, None, "No valid image URL in prediction output"
-            else:
-                error_msg = result.get("error", f"Prediction failed with status: {result['status']}")
-                return False, None, error_msg
-                
-        except Exception as e:
-            error_msg = str(e).replace(self.api_token or "", "[REDACTED]")
-            return False, None, f"Replicate API error: {error_msg}"
-
-    async def _create_prediction(self, prompt: str) -> Optional[str]:
-        """Create a prediction and return the prediction ID"""
-        self._ensure_initialized()
-        
-        headers = {
+                raise TransientError("Failed to create prediction")
+            if on_prediction:
+                await on_prediction(prediction)
+            if on_progress:
+                await on_progress("starting", None, None)
+
+            mode = "webhook" if self.webhook_url else "poll"
+            metrics.predictions_in_flight.inc()
+            try:
+                with metrics.prediction_wait_seconds.labels(mode).time():
+                    if self.webhook_url:
+                        result = await self._wait_for_webhook(prediction_id, on_update=on_update)
+                    else:
+                        result = await self._poll_prediction(prediction_id, on_update=on_update)
+            except asyncio.CancelledError:
+                # Stop the prediction upstream too, without holding up the cancellation
+                self._cancel_in_background(prediction_id)
+                raise
+            finally:
+                metrics.predictions_in_flight.dec()
+        except httpx.HTTPStatusError as e:
+            raise self._classify_status_error(e) from e
+        except httpx.TransportError as e:
+            raise TransientError(f"Replicate API error: {self._redact(str(e)) or type(e).__name__}") from e
+
+        if on_prediction:
+            await on_prediction(result)
+
+        if result["status"] == "succeeded":
+            await deliver(result["output"])
+            if not delivered:
+                raise PermanentError("No valid image URL in prediction output")
+            return delivered
+
+        error_msg = result.get("error") or f"Prediction failed with status: {result['status']}"
+        if result["status"] == "canceled" or any(
+            marker in str(error_msg).lower() for marker in PERMANENT_PREDICTION_ERRORS
+        ):
+            raise PermanentError(error_msg)
+        raise TransientError(error_msg)
+
+    def _cancel_in_background(self, prediction_id: str) -> None:
+        task = asyncio.create_task(self.cancel_prediction(prediction_id))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _cancel_created_prediction(self, create: asyncio.Future) -> None:
+        """Cancel the prediction a create finished making after its caller was cancelled"""
+        if create.cancelled() or create.exception() is not None:
+            return
+        prediction_id = create.result().get("id")
+        if prediction_id:
+            self._cancel_in_background(prediction_id)
+
+    def _redact(self, message: str) -> str:
+        return message.replace(self.api_token, "[REDACTED]") if self.api_token else message
+
+    def _classify_status_error(self, error: httpx.HTTPStatusError) -> ReplicateError:
+        response = error.response
+        message = f"Replicate API error: {response.status_code} {self._redact(response.text[:200])}"
+        if response.status_code == 429:
+            return RateLimitedError(message, parse_retry_after(response.headers.get("Retry-After")))
+        if response.status_code >= 500 or response.status_code == 408:
+            return TransientError(message)
+        return PermanentError(message)
+
+    def _headers(self) -> dict:
+        return {
             "Authorization": f"Token {self.api_token}",
             "Content-Type": "application/json"
         }
-        
+
+    async def _create_prediction(self, prompt: str, seed: Optional[int] = None, num_outputs: int = 1) -> dict:
+        """Create a prediction and return it as Replicate reported it"""
+        self._ensure_initialized()
+
+        headers = self._headers()
+
         input_data = {"prompt": prompt}
+        if seed is not None:
+            input_data["seed"] = seed
+        if num_outputs > 1:
+            input_data["num_outputs"] = num_outputs
         
         if self.model_version:
             url = f"{self.base_url}/predictions"
@@ -79,70 +338,144 @@ class ReplicateClient:
                 "input": input_data
             }
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            
-            result = response.json()
-            return result.get("id")
+        if self.webhook_url:
+            await self._ensure_webhook_secret()
+            payload["webhook"] = self.webhook_url
+            payload["webhook_events_filter"] = ["completed"]
+
+        response = await self._request("POST", url, headers=headers, json=payload)
+        response.raise_for_status()
+
+        return response.json()
 
-    async def _poll_prediction(self, prediction_id: str, max_wait_time: int = 300) -> dict:
-        """Poll prediction status until completion or timeout"""
+    async def _poll_prediction(
+        self, prediction_id: str, max_wait_time: int = 300, on_update: PredictionCallback = None
+    ) -> dict:
+        """Poll prediction status until completion or timeout, passing running states to `on_update`"""
         self._ensure_initialized()
-        
-        headers = {
-            "Authorization": f"Token {self.api_token}",
-            "Content-Type": "application/json"
-        }
-        
-        url = f"{self.base_url}/predictions/{prediction_id}"
+
         start_time = datetime.utcnow()
-        
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
+        polls = 0
+
+        try:
             while True:
-                response = await client.get(url, headers=headers)
-                response.raise_for_status()
-                
-                result = response.json()
-                status = result.get("status")
-                
-                if status in ["succeeded", "failed", "canceled"]:
+                result = await self._get_prediction(prediction_id)
+                polls += 1
+
+                if result.get("status") in TERMINAL_STATUSES:
                     return result
-                
+                if on_update:
+                    await on_update(result)
+
                 elapsed = (datetime.utcnow() - start_time).total_seconds()
                 if elapsed > max_wait_time:
-                    return {
-                        "status": "failed",
-                        "error": f"Prediction timed out after {max_wait_time} seconds"
-                    }
-                
+                    raise TransientError(f"Prediction timed out after {max_wait_time} seconds")
+
                 if elapsed < 30:
                     wait_time = 1.0
                 elif elapsed < 120:
                     wait_time = 2.0
                 else:
                     wait_time = 5.0
-                    
+
                 await asyncio.sleep(wait_time)
+        finally:
+            metrics.polls_per_prediction.observe(polls)
 
-    def _extract_image_url(self, output) -> Optional[str]:
-        """Extract the first valid image URL from prediction output"""
-        if not output:
+    async def _wait_for_webhook(
+        self, prediction_id: str, max_wait_time: int = 300, on_update: PredictionCallback = None
+    ) -> dict:
+        """Wait for the completion webhook, polling slowly in case a callback is missed"""
+        future = webhook_registry.register(prediction_id)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_wait_time
+        polls = 0
+
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise TransientError(f"Prediction timed out after {max_wait_time} seconds")
+
+                try:
+                    return await asyncio.wait_for(
+                        asyncio.shield(future),
+                        timeout=min(self.webhook_fallback_interval, remaining),
+                    )
+                except asyncio.TimeoutError:
+                    result = await self._get_prediction(prediction_id)
+                    polls += 1
+                    if result.get("status") in TERMINAL_STATUSES:
+                        return result
+                    if on_update:
+                        await on_update(result)
+        finally:
+            webhook_registry.discard(prediction_id)
+            metrics.polls_per_prediction.observe(polls)
+
+    async def cancel_prediction(self, prediction_id: str) -> None:
+        """Ask Replicate to stop a prediction (best effort)"""
+        try:
+            response = await self._request(
+                "POST", f"{self.base_url}/predictions/{prediction_id}/cancel", headers=self._headers()
+            )
+            response.raise_for_status()
+        except httpx.HTTPError:
+            pass
+
+    async def _get_prediction(self, prediction_id: str) -> dict:
+        """Fetch the current state of a prediction"""
+        url = f"{self.base_url}/predictions/{prediction_id}"
+        response = await self._request("GET", url, headers=self._headers())
+        response.raise_for_status()
+        return response.json()
+
+    async def _ensure_webhook_secret(self) -> None:
+        """Fetch the account's webhook signing secret if it wasn't configured"""
+        if webhook_registry.secret:
+            return
+
+        response = await self._request(
+            "GET", f"{self.base_url}/webhooks/default/secret", headers=self._headers()
+        )
+        response.raise_for_status()
+        webhook_registry.secret = response.json()["key"]
+
+    def _parse_progress(self, logs: Optional[str]) -> Optional[int]:
+        """Latest progress percentage reported in prediction logs, if any"""
+        if not logs:
             return None
-            
+
+        percents = _PERCENT_RE.findall(logs)
+        if percents:
+            return min(int(percents[-1]), 100)
+
+        steps = _STEPS_RE.findall(logs)
+        if steps:
+            done, total = (int(n) for n in steps[-1])
+            if total:
+                return min(done * 100 // total, 100)
+        return None
+
+    def _extract_image_urls(self, output) -> List[str]:
+        """Extract all valid image URLs from prediction output, in output order"""
+        if not output:
+            return []
+
         if isinstance(output, str):
-            return output if output.startswith(("http://", "https://")) else None
-        elif isinstance(output, list) and len(output) > 0:
-            first_item = output[0]
-            if isinstance(first_item, str) and first_item.startswith(("http://", "https://")):
-                return first_item
+            return [output] if output.startswith(("http://", "https://")) else []
+        elif isinstance(output, list):
+            return [
+                item for item in output
+                if isinstance(item, str) and item.startswith(("http://", "https://"))
+            ]
         elif isinstance(output, dict):
             for key in ["url", "image", "output", "result"]:
                 if key in output:
                     url = output[key]
                     if isinstance(url, str) and url.startswith(("http://", "https://")):
-                        return url
-        
-        return None
+                        return [url]
+
+        return []
 
 replicate_client = ReplicateClient()
\ No newline at end of file
@@ -1,152 +1,640 @@
 import asyncio
+import logging
 import random
-from datetime import datetime
-from typing import Dict, Any, Tuple
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Coroutine, Dict, List, Optional, Tuple
 import os
 from .config import config
 
-from .models import Job, JobStatus, ResultStatus
+from .models import FINISHED_JOB_STATUSES, FINISHED_RESULT_STATUSES, ImageResult, Job, JobStatus, ResultStatus
 from .store import job_store
-from .replicate_client import replicate_client
+from .work_queue import WorkQueue, work_queue
+from .replicate_client import parse_timestamp, replicate_client, RateLimitedError, ReplicateError
+from .webhooks import TERMINAL_STATUSES
+from .circuit_breaker import CircuitOpenError, circuit_breaker
+from .cache import prompt_cache
+from .image_mirror import image_mirror
+from .scheduler import FairScheduler, WorkItem
+from .limiter import AdaptiveLimiter, concurrency_limiter
+from . import metrics
 
 
-class JobRunner:
-    def __init__(self, max_concurrency: int = None, max_retries: int = None):
-        if max_concurrency is None:
-            max_concurrency = config.GEN_MAX_CONCURRENCY
+logger = logging.getLogger(__name__)
+
+
+class _JobState:
+    """Book-keeping for a job whose images are queued or in flight"""
+
+    def __init__(self, num_images: int, user: str):
+        self.user = user
+        self.started_at = datetime.utcnow()
+        self.remaining = num_images
+        self.first_item_finished_time: Optional[datetime] = None
+
+
+def _batch_size(job: Job, max_outputs_per_prediction: int) -> int:
+    # Seeded images keep one prediction each so every image has a reproducible seed
+    return 1 if job.seed is not None else max(max_outputs_per_prediction, 1)
+
+
+async def _close_job(
+    job_id: str, started_at: datetime, first_item_finished_time: Optional[datetime], cancelled: bool = False
+) -> None:
+    """Set a job's final status and timing metrics; cancelling also cancels its unfinished results"""
+    async with job_store.job_lock(job_id):
+        # The cached copy, so the result updates below and the final write change one object
+        job = await job_store.get_job_for_write(job_id, lock_held=True)
+        if not job or job.status in FINISHED_JOB_STATUSES:
+            return
+
+        job_end_time = datetime.utcnow()
+
+        if cancelled:
+            for index, result in enumerate(job.results):
+                if result.status not in FINISHED_RESULT_STATUSES:
+                    await job_store.update_result(job_id, index, ResultStatus.CANCELLED, error="Cancelled")
+            job.status = JobStatus.CANCELLED
+        else:
+            if job.failed_count == len(job.results):
+                job.status = JobStatus.FAILED
+            else:
+                job.status = JobStatus.COMPLETED
+
+        total_ms = int((job_end_time - started_at).total_seconds() * 1000)
+        ttfi_ms = None
+        if first_item_finished_time:
+            ttfi_ms = int((first_item_finished_time - started_at).total_seconds() * 1000)
+
+        job.total_ms = total_ms
+        job.ttfi_ms = ttfi_ms
+
+        await job_store.update_job(job)
+
+
+class ImageProcessor:
+    """Generates the images of one work item and reports every result change.
+
+    Results are written through the _annotate_result() and _update_result_*()
+    hooks, which go to the job store here and can be redirected by subclasses
+    that run outside the API process.
+    """
+
+    def __init__(self, max_retries: int = None, max_outputs_per_prediction: int = None, progress_step: int = None):
         if max_retries is None:
             max_retries = config.RETRY_ATTEMPTS
-        
-        self.semaphore = asyncio.Semaphore(max_concurrency)
+        if max_outputs_per_prediction is None:
+            max_outputs_per_prediction = config.REPLICATE_MAX_OUTPUTS_PER_PREDICTION
+        if progress_step is None:
+            progress_step = config.RESULT_PROGRESS_STEP
+
         self.max_retries = max_retries
-        self._running_jobs: Dict[str, asyncio.Task] = {}
+        self.max_outputs_per_prediction = max(max_outputs_per_prediction, 1)
+        self.progress_step = progress_step
+
+    def batch_size(self, job: Job) -> int:
+        """Images per work item for this job"""
+        return _batch_size(job, self.max_outputs_per_prediction)
+
+    async def _process_images(self, job: Job, indices: List[int]) -> datetime:
+        """Generate a work item's images, retrying only retryable failures.
+
+        A single image goes through the prompt cache's single-flight path; a
+        batch is one prediction with num_outputs, and each output is stored as
+        soon as it shows up. Only images still missing are retried. While a
+        prediction runs, its status and progress are published on its images,
+        and each prediction's id, timestamps and predict time are recorded on
+        them. Returns when the first image finished.
+        """
+        job_id = job.id
+        prompt = job.prompt
+        first_completion: Optional[datetime] = None
+
+        async def deliver(index: int, image_url: str) -> None:
+            nonlocal first_completion
+            completion_time = datetime.utcnow()
+            metrics.image_latency_seconds.labels("completed").observe(
+                (completion_time - job.created_at).total_seconds()
+            )
+            await self._update_result_success(job_id, index, completion_time, image_url)
+            if first_completion is None:
+                first_completion = completion_time
+
+        seeds = {index: job.seed + index if job.seed is not None else None for index in indices}
+        cache_keys = {index: self._cache_key(job, index, seeds[index]) for index in indices}
+        last_progress: Dict[int, Tuple[ResultStatus, Optional[int], Optional[str]]] = {}
+
+        pending = list(indices)
+        if len(indices) > 1 and not job.bypass_cache:
+            pending = []
+            for index in indices:
+                cached_url = prompt_cache.get(cache_keys[index])
+                if cached_url:
+                    await deliver(index, cached_url)
+                else:
+                    pending.append(index)
+
+        last_error = None
+        for attempt in range(self.max_retries):
+            if not pending:
+                break
+            if attempt:
+                for index in pending:
+                    await self._annotate_result(job_id, index, attempts=attempt + 1)
+
+            batch = list(pending)
+            delivered = set()
+            retryable = True
+            retry_after = None
+            reason = "short_output"
+
+            async def on_image(position: int, image_url: str) -> None:
+                index = batch[position]
+                prompt_cache.put(cache_keys[index], image_url)
+                delivered.add(index)
+                await deliver(index, image_url)
+
+            async def on_progress(status: str, percent: Optional[int], preview_url: Optional[str]) -> None:
+                result_status = ResultStatus.PROCESSING if status == "processing" else ResultStatus.STARTING
+                state = (result_status, percent, preview_url)
+                for index in batch:
+                    if index in delivered or not self._progress_changed(last_progress.get(index), state):
+                        continue
+                    last_progress[index] = state
+                    await self._update_result_progress(job_id, index, result_status, percent, preview_url)
+
+            async def on_prediction(prediction: dict) -> None:
+                if prediction.get("status") in TERMINAL_STATUSES:
+                    fields = {
+                        "prediction_started_at": parse_timestamp(prediction.get("started_at")),
+                        "predict_time": (prediction.get("metrics") or {}).get("predict_time"),
+                    }
+                else:
+                    fields = {"prediction_id": prediction.get("id"), "prediction_created_at": datetime.utcnow()}
+                for index in batch:
+                    await self._annotate_result(job_id, index, **fields)
+
+            try:
+                if len(batch) == 1:
+                    index = batch[0]
+                    image_url = await prompt_cache.get_or_generate(
+                        cache_keys[index],
+                        lambda: self._call_upstream(
+                            replicate_client.generate_image(
+                                prompt, seed=seeds[index], on_progress=on_progress, on_prediction=on_prediction
+                            )
+                        ),
+                        bypass=job.bypass_cache,
+                    )
+                    delivered.add(index)
+                    await deliver(index, image_url)
+                else:
+                    await self._call_upstream(replicate_client.generate_images(
+                        prompt, len(batch), on_image=on_image, on_progress=on_progress, on_prediction=on_prediction
+                    ))
+            except ReplicateError as e:
+                last_error = str(e) or "Unknown generation error"
+                retryable = e.retryable
+                retry_after = getattr(e, "retry_after", None)
+                reason = "rate_limited" if isinstance(e, RateLimitedError) else "transient"
+            except Exception as e:
+                last_error = f"Unexpected error: {str(e)}"
+                reason = "unexpected"
+            else:
+                last_error = "Prediction returned fewer images than requested"
+
+            pending = [index for index in batch if index not in delivered]
+            if not pending or not retryable or attempt == self.max_retries - 1:
+                break
+
+            base_delay = 2 ** attempt
+            jitter = random.uniform(0.1, 0.3)
+            delay = max(base_delay + jitter, retry_after or 0)
+            metrics.retries_total.labels(reason).inc(len(pending))
+            metrics.retry_backoff_seconds.observe(delay)
+            await asyncio.sleep(delay)
+
+        failed_after = (datetime.utcnow() - job.created_at).total_seconds()
+        for index in pending:
+            metrics.image_latency_seconds.labels("failed").observe(failed_after)
+            await self._update_result_failure(job_id, index, last_error)
+        return first_completion or datetime.utcnow()
+
+    async def _call_upstream(self, call: Coroutine[Any, Any, Any]) -> Any:
+        """Run one Replicate call through the circuit breaker, recording its outcome"""
+        if not circuit_breaker.allow_request():
+            call.close()
+            raise CircuitOpenError()
+
+        try:
+            result = await call
+        except asyncio.CancelledError:
+            circuit_breaker.release()
+            raise
+        except ReplicateError as e:
+            if e.retryable:
+                circuit_breaker.record_failure()
+            else:
+                # Upstream answered; the request itself is the problem
+                circuit_breaker.record_success()
+            raise
+        except Exception:
+            circuit_breaker.record_failure()
+            raise
+        circuit_breaker.record_success()
+        return result
+
+    @staticmethod
+    def _cache_key(job: Job, index: int, seed: Optional[int]) -> str:
+        # Without a seed the image index stands in for the sample, so a job's
+        # images stay distinct from each other but match the same job re-run
+        variant = f"seed:{seed}" if seed is not None else f"sample:{index}"
+        return prompt_cache.make_key(
+            replicate_client.model, replicate_client.model_version, job.prompt, {}, variant
+        )
+
+    def _progress_changed(self, previous: Optional[tuple], current: tuple) -> bool:
+        """Whether a progress update is worth publishing (new status or preview, or a big enough step)"""
+        if previous is None or previous[0] != current[0] or previous[2] != current[2]:
+            return True
+        if current[1] is None or current[1] == previous[1]:
+            return False
+        return previous[1] is None or current[1] - previous[1] >= self.progress_step or current[1] == 100
+
+    async def _annotate_result(self, job_id: str, index: int, **fields):
+        """Record extra details on a result"""
+        await job_store.annotate_result(job_id, index, **fields)
+
+    async def _update_result_progress(
+        self, job_id: str, index: int, status: ResultStatus, progress: Optional[int], preview_url: Optional[str]
+    ):
+        """Publish the state of a prediction that is still running"""
+        await job_store.update_result(job_id, index, status, url=preview_url, progress=progress)
+
+    async def _update_result_success(self, job_id: str, index: int, completion_time: datetime, image_url: str):
+        """Update job result for successful completion"""
+        await job_store.update_result(job_id, index, ResultStatus.COMPLETED, url=image_url, completed_at=completion_time)
+        image_mirror.schedule(job_id, index, image_url)
+
+    async def _update_result_failure(self, job_id: str, index: int, error_msg: str):
+        """Update job result for failure after all retries"""
+        await job_store.update_result(job_id, index, ResultStatus.FAILED, error=error_msg)
+
+
+class JobRunner(ImageProcessor):
+    """Runs image work items from every job through one fair scheduler.
+
+    Jobs are queued as work items of one or more images (one prediction each);
+    a task is only created when a generation slot frees up, so parked work
+    costs a queue entry rather than a task. The job is finalized when its last
+    item finishes, or straight away when it is cancelled.
+    """
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter = None,
+        max_retries: int = None,
+        max_per_user: int = None,
+        max_outputs_per_prediction: int = None,
+        progress_step: int = None,
+    ):
+        super().__init__(max_retries, max_outputs_per_prediction, progress_step)
+        if limiter is None:
+            limiter = concurrency_limiter
+        if max_per_user is None:
+            max_per_user = config.GEN_MAX_CONCURRENCY_PER_USER
+
+        self.limiter = limiter
+        self.scheduler = FairScheduler(max_per_user=max_per_user)
+        self._running_jobs: Dict[str, _JobState] = {}
+        self._in_flight: Dict[asyncio.Task, WorkItem] = {}
+        self._resume_handle: Optional[asyncio.TimerHandle] = None
+        self.limiter.add_listener(self._dispatch)
+        if config.CANCEL_ON_LAST_VIEWER_DISCONNECT:
+            job_store.add_idle_listener(self._on_last_viewer_left)
+
+    async def start(self) -> None:
+        """Start background work (called from the app lifespan)"""
+
+    async def close(self) -> None:
+        """Stop background work"""
 
     async def start_job(self, job_id: str) -> None:
-        """Start processing a job in the background"""
-        if job_id in self._running_jobs:
+        """Queue all of a job's images for processing"""
+        await self.start_jobs([job_id])
+
+    async def start_jobs(self, job_ids: List[str]) -> None:
+        """Queue several jobs' images at once, with one store write and one dispatch pass"""
+        jobs = []
+        for job_id in job_ids:
+            if job_id in self._running_jobs:
+                continue
+            job = await job_store.get_job(job_id)
+            if not job:
+                continue
+
+            state = self._running_jobs[job_id] = _JobState(job.num_images, job.owner or "anonymous")
+            job.status = JobStatus.RUNNING
+            job.started_at = state.started_at
+            jobs.append(job)
+        if not jobs:
             return
-        
-        task = asyncio.create_task(self._process_job(job_id))
-        self._running_jobs[job_id] = task
-        
-        def cleanup(task):
-            self._running_jobs.pop(job_id, None)
-        task.add_done_callback(cleanup)
-
-    async def _process_job(self, job_id: str) -> None:
-        """Process all image generation tasks for a job"""
-        job = await job_store.get_job(job_id)
-        if not job:
+
+        await job_store.update_jobs(jobs)
+        for job in jobs:
+            self.scheduler.enqueue_job(
+                job.id, self._running_jobs[job.id].user, job.priority, range(job.num_images),
+                batch_size=self.batch_size(job),
+            )
+        self._dispatch()
+
+    def is_running(self, job_id: str) -> bool:
+        return job_id in self._running_jobs
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """Cancel a running job: drop its queued images and cancel those in flight.
+
+        In-flight tasks cancel their upstream predictions, and their slots go
+        straight back to other queued work. Returns False if the job isn't running.
+        """
+        state = self._running_jobs.pop(job_id, None)
+        if state is None:
+            return False
+
+        self.scheduler.remove_job(job_id, state.user)
+        for task, item in list(self._in_flight.items()):
+            if item.job_id == job_id:
+                task.cancel()
+
+        await _close_job(job_id, state.started_at, state.first_item_finished_time, cancelled=True)
+        return True
+
+    def _on_last_viewer_left(self, job_id: str) -> None:
+        if job_id in self._running_jobs:
+            asyncio.get_running_loop().call_later(
+                config.CANCEL_ON_DISCONNECT_GRACE_SECONDS, self._cancel_if_unwatched, job_id
+            )
+
+    def _cancel_if_unwatched(self, job_id: str) -> None:
+        # Viewers get a grace period to reconnect before the job is abandoned
+        if job_id in self._running_jobs and job_store.subscriber_count(job_id) == 0:
+            asyncio.create_task(self.cancel_job(job_id))
+
+    async def stats(self) -> dict:
+        return {
+            "mode": "local",
+            "max_concurrency": self.limiter.limit,
+            "in_flight": len(self._in_flight),
+            "running_jobs": len(self._running_jobs),
+            **self.scheduler.stats(),
+        }
+
+    async def concurrency_stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), **self.limiter.stats()}
+
+    def _dispatch(self) -> None:
+        """Start work items while there are free slots"""
+        blocked_for = self.limiter.blocked_for()
+        if blocked_for > 0:
+            # Upstream asked us to back off (Retry-After); resume once it has passed
+            if self._resume_handle is None and self.scheduler.queued:
+                self._resume_handle = asyncio.get_running_loop().call_later(blocked_for, self._resume)
             return
 
-        job.status = JobStatus.RUNNING
-        job_start_time = datetime.utcnow()
-        await job_store.update_job(job)
+        while len(self._in_flight) < self.limiter.limit:
+            item = self.scheduler.next_item()
+            if item is None:
+                return
+
+            task = asyncio.create_task(self._run_item(item))
+            self._in_flight[task] = item
+            task.add_done_callback(lambda task, item=item: self._item_done(task, item))
+
+    def _resume(self) -> None:
+        self._resume_handle = None
+        self._dispatch()
 
-        first_item_finished_time = None
-        
-        tasks = []
-        for i in range(job.num_images):
-            task = asyncio.create_task(self._process_single_image(job_id, i))
-            tasks.append(task)
+    def _item_done(self, task: asyncio.Task, item: WorkItem) -> None:
+        self._in_flight.pop(task, None)
+        self.scheduler.release(item)
+        self._dispatch()
 
+    async def _run_item(self, item: WorkItem) -> None:
+        queue_wait_ms = item.queue_wait_ms
+        metrics.queue_wait_seconds.observe(queue_wait_ms / 1000)
+        slot_acquired_at = datetime.utcnow()
+        queued_at = slot_acquired_at - timedelta(milliseconds=queue_wait_ms)
+        for index in item.indices:
+            await self._annotate_result(
+                item.job_id, index, queue_wait_ms=queue_wait_ms,
+                queued_at=queued_at, slot_acquired_at=slot_acquired_at, attempts=1,
+            )
+
+        completion_time = None
         try:
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            for i, result in enumerate(results):
-                if not isinstance(result, Exception):
-                    completion_time = result
-                    if first_item_finished_time is None or completion_time < first_item_finished_time:
-                        first_item_finished_time = completion_time
+            job = await job_store.get_job(item.job_id)
+            completion_time = await self._process_images(job, item.indices) if job else datetime.utcnow()
+        finally:
+            state = self._running_jobs.get(item.job_id)
+            if state is not None:
+                state.remaining -= len(item.indices)
+                if completion_time and (
+                    state.first_item_finished_time is None or completion_time < state.first_item_finished_time
+                ):
+                    state.first_item_finished_time = completion_time
+                if state.remaining <= 0:
+                    del self._running_jobs[item.job_id]
+                    await self._finish_job(item.job_id, state)
 
-            job = await job_store.get_job(job_id)
-            if job:
-                job_end_time = datetime.utcnow()
-                
-                failed_count = sum(1 for result in job.results if result.status == ResultStatus.FAILED)
-                
-                if failed_count == len(job.results):
-                    job.status = JobStatus.FAILED
-                else:
-                    job.status = JobStatus.COMPLETED
+    async def _finish_job(self, job_id: str, state: _JobState) -> None:
+        """Set the job's final status and timing metrics"""
+        await _close_job(job_id, state.started_at, state.first_item_finished_time)
 
-                total_ms = int((job_end_time - job_start_time).total_seconds() * 1000)
-                ttfi_ms = None
-                if first_item_finished_time:
-                    ttfi_ms = int((first_item_finished_time - job_start_time).total_seconds() * 1000)
 
-                job.total_ms = total_ms
-                job.ttfi_ms = ttfi_ms
-                
-                await job_store.update_job(job)
+class QueuedJobRunner:
+    """API-side runner when images are generated by worker processes (RUNNER_MODE=queue).
 
-        except Exception as e:
-            job = await job_store.get_job(job_id)
-            if job:
-                job.status = JobStatus.FAILED
-                await job_store.update_job(job)
-
-    async def _process_single_image(self, job_id: str, index: int) -> datetime:
-        """Process a single image generation task with retry logic"""
-        async with self.semaphore:
-            last_error = None
-            
-        
+    start_job() puts a job's work items on the durable work queue. A pump reads
+    the result updates that workers report for the jobs this process enqueued
+    (or adopted from a stopped process) and applies them to the job store,
+    which publishes them to this process's streams. It finalizes a job once all
+    of its images have finished.
+    """
+
+    # An update that fails this many times is logged and skipped rather than blocking the rest
+    max_apply_attempts = 3
+    max_backoff = 5.0
+
+    def __init__(self, queue: WorkQueue = None, max_outputs_per_prediction: int = None, poll_interval: float = None):
+        if queue is None:
+            queue = work_queue
+        if max_outputs_per_prediction is None:
+            max_outputs_per_prediction = config.REPLICATE_MAX_OUTPUTS_PER_PREDICTION
+        if poll_interval is None:
+            poll_interval = config.WORK_POLL_INTERVAL
+
+        self.queue = queue
+        self.max_outputs_per_prediction = max_outputs_per_prediction
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = config.WORK_HEARTBEAT_SECONDS
+        # Work items this process enqueues carry this name, and their result updates come back to it
+        self.reader_id = f"api-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._pump: Optional[asyncio.Task] = None
+        self._last_heartbeat = 0.0
+        self._apply_failures: Dict[int, int] = {}
+        self._first_finished: Dict[str, datetime] = {}
+        if config.CANCEL_ON_LAST_VIEWER_DISCONNECT:
+            job_store.add_idle_listener(self._on_last_viewer_left)
+
+    async def start(self) -> None:
+        """Open the queue and start applying worker results (called from the app lifespan)"""
+        await self.queue.start()
+        await self.queue.heartbeat_reader(self.reader_id)
+        self._last_heartbeat = time.monotonic()
+        if self._pump is None:
+            self._pump = asyncio.create_task(self._pump_loop())
+
+    async def close(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+            await self.queue.remove_reader(self.reader_id)
+        await self.queue.close()
+
+    async def start_job(self, job_id: str) -> None:
+        """Put all of a job's images on the work queue"""
+        await self.start_jobs([job_id])
+
+    async def start_jobs(self, job_ids: List[str]) -> None:
+        """Put several jobs' images on the work queue in one transaction"""
+        jobs = []
+        for job_id in job_ids:
             job = await job_store.get_job(job_id)
-            if not job:
-                return datetime.utcnow()
-            
-            prompt = job.prompt
-            
-            for attempt in range(self.max_retries):
-                try:
-                    success, image_url, error_msg = await replicate_client.generate_image(prompt)
-                    
-                    if success and image_url:
-                        completion_time = datetime.utcnow()
-                        await self._update_result_success(job_id, index, completion_time, image_url)
-                        return completion_time
-                    else:
-                        last_error = error_msg or "Unknown generation error"
-                        
-                        if attempt == self.max_retries - 1:
-                            await self._update_result_failure(job_id, index, last_error)
-                            break
-                        
-                        base_delay = 2 ** attempt
-                        jitter = random.uniform(0.1, 0.3)
-                        delay = base_delay + jitter
-                        await asyncio.sleep(delay)
-                        
-                except Exception as e:
-                    last_error = f"Unexpected error: {str(e)}"
-                    if attempt == self.max_retries - 1:
-                        await self._update_result_failure(job_id, index, last_error)
-                        break
-                    
-                    base_delay = 2 ** attempt
-                    jitter = random.uniform(0.1, 0.3) 
-                    delay = base_delay + jitter
-                    await asyncio.sleep(delay)
-            
-            return datetime.utcnow()
+            if job and job.status == JobStatus.PENDING:
+                job.status = JobStatus.RUNNING
+                job.started_at = datetime.utcnow()
+                jobs.append(job)
+        if not jobs:
+            return
 
-    async def _update_result_success(self, job_id: str, index: int, completion_time: datetime, image_url: str):
-        """Update job result for successful completion"""
+        await job_store.update_jobs(jobs)
+        await self.queue.enqueue_jobs([(job, self._batches(job)) for job in jobs], origin=self.reader_id)
+
+    def _batches(self, job: Job) -> List[List[int]]:
+        size = _batch_size(job, self.max_outputs_per_prediction)
+        return [list(range(start, min(start + size, job.num_images))) for start in range(0, job.num_images, size)]
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """Cancel a job's queued images and tell the workers running the rest to stop.
+
+        Workers notice on their next heartbeat and cancel the upstream
+        predictions. Returns False if the job isn't running.
+        """
         job = await job_store.get_job(job_id)
-        if job and index < len(job.results):
-            job.results[index].status = ResultStatus.COMPLETED
-            job.results[index].url = image_url
-            job.results[index].error = None
-            await job_store.update_job(job)
+        if not job or job.status in FINISHED_JOB_STATUSES:
+            return False
 
-    async def _update_result_failure(self, job_id: str, index: int, error_msg: str):
-        """Update job result for failure after all retries"""
+        await self.queue.cancel_job(job_id)
+        await _close_job(
+            job_id, job.started_at or job.created_at, self._first_finished.pop(job_id, None), cancelled=True
+        )
+        return True
+
+    def _on_last_viewer_left(self, job_id: str) -> None:
+        asyncio.get_running_loop().call_later(
+            config.CANCEL_ON_DISCONNECT_GRACE_SECONDS,
+            lambda: asyncio.create_task(self._cancel_if_unwatched(job_id)),
+        )
+
+    async def _cancel_if_unwatched(self, job_id: str) -> None:
+        # Viewers get a grace period to reconnect before the job is abandoned
+        if job_store.subscriber_count(job_id) == 0:
+            await self.cancel_job(job_id)
+
+    async def stats(self) -> dict:
+        return {"mode": "queue", **await self.queue.stats()}
+
+    async def concurrency_stats(self) -> dict:
+        # Each worker process runs its own adaptive limiter
+        return {"mode": "queue", "leased": (await self.queue.stats())["leased"]}
+
+    async def _pump_loop(self) -> None:
+        backoff = self.poll_interval
+        while True:
+            try:
+                handled = await self._pump_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to apply worker results; retrying in %.2fs", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = self.poll_interval
+            if not handled:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _pump_once(self) -> int:
+        """Apply the next batch of this process's result updates; returns how many there were"""
+        if time.monotonic() - self._last_heartbeat > self.heartbeat_interval:
+            adopted = await self.queue.heartbeat_reader(self.reader_id)
+            self._last_heartbeat = time.monotonic()
+            if adopted:
+                logger.warning("Took over the jobs of %s stopped API process(es)", adopted)
+
+        updates = await self.queue.read_results(self.reader_id)
+        applied = None
+        try:
+            for seq, job_id, index, data, created_at in updates:
+                try:
+                    await self._apply(job_id, index, data, datetime.utcfromtimestamp(created_at))
+                except Exception:
+                    attempts = self._apply_failures.pop(seq, 0) + 1
+                    if attempts < self.max_apply_attempts:
+                        self._apply_failures[seq] = attempts
+                        raise
+                    logger.exception(
+                        "Skipping result update %s for job %s after %s failed attempts", seq, job_id, attempts
+                    )
+                applied = seq
+        finally:
+            if applied is not None:
+                await self.queue.ack_results(self.reader_id, applied)
+        return len(updates)
+
+    async def _apply(self, job_id: str, index: int, data: dict, reported_at: datetime) -> None:
+        """Apply one worker result update, finalizing the job when it was the last image"""
         job = await job_store.get_job(job_id)
-        if job and index < len(job.results):
-            job.results[index].status = ResultStatus.FAILED
-            job.results[index].url = None
-            job.results[index].error = error_msg
-            await job_store.update_job(job)
+        if job is None or job.status in FINISHED_JOB_STATUSES:
+            return
+
+        if "annotate" in data:
+            # Workers send fields as JSON; validate them back into their model types
+            fields = data["annotate"]
+            parsed = ImageResult.model_validate(fields).model_dump(include=set(fields))
+            await job_store.annotate_result(job_id, index, **parsed)
+            return
+
+        status = ResultStatus(data["status"])
+        job = await job_store.update_result(
+            job_id, index, status, url=data.get("url"), error=data.get("error"), progress=data.get("progress"),
+            completed_at=reported_at,
+        )
+        if job is None or status not in FINISHED_RESULT_STATUSES:
+            return
+        if status == ResultStatus.COMPLETED:
+            image_mirror.schedule(job_id, index, data.get("url"))
+
+        first_finished = self._first_finished.setdefault(job_id, reported_at)
+        if job.running_count == 0:
+            del self._first_finished[job_id]
+            await _close_job(job_id, job.started_at or job.created_at, first_finished)
+
 
-job_runner = JobRunner()
\ No newline at end of file
+job_runner = QueuedJobRunner() if config.RUNNER_MODE == "queue" else JobRunner()
\ No newline at end of file
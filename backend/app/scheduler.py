@@ -0,0 +1,145 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence
+
+from .models import Priority
+
+PRIORITY_WEIGHTS = {
+    Priority.LOW: 1,
+    Priority.NORMAL: 2,
+    Priority.HIGH: 4,
+}
+
+
+class WorkItem:
+    """One or more images of a job waiting for (or holding) a generation slot"""
+
+    def __init__(self, job_id: str, indices: Sequence[int], user: str, priority: Priority):
+        self.job_id = job_id
+        self.indices = list(indices)
+        self.user = user
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+    @property
+    def queue_wait_ms(self) -> int:
+        return int((time.monotonic() - self.enqueued_at) * 1000)
+
+
+class _JobQueue:
+    def __init__(self, weight: int, tag: float):
+        self.items: Deque[WorkItem] = deque()
+        self.weight = weight
+        self.tag = tag
+
+
+class _UserQueue:
+    def __init__(self, tag: float):
+        self.tag = tag
+        self.job_clock = 0.0
+        self.jobs: Dict[str, _JobQueue] = {}
+        self.in_flight = 0
+
+
+class FairScheduler:
+    """Weighted fair queuing of image work items, first across users, then across each user's jobs.
+
+    Every user and job carries a virtual time tag. The next item comes from
+    the user with the lowest tag (skipping users at their concurrency cap),
+    then from that user's job with the lowest tag. Each dispatch advances the
+    user's tag by its image count, so users share equally whatever priority
+    they ask for, and the job's tag by images / priority weight, so a user's
+    higher-priority jobs get a proportionally larger share of that user's
+    turns. Users and jobs that become active join at the current virtual time
+    rather than with banked credit.
+    """
+
+    def __init__(self, max_per_user: int = 0):
+        self.max_per_user = max_per_user
+        self._users: Dict[str, _UserQueue] = {}
+        self._virtual_time = 0.0
+        self.queued = 0
+
+    def enqueue_job(
+        self, job_id: str, user: str, priority: Priority, indices: Iterable[int], batch_size: int = 1
+    ) -> None:
+        """Queue a job's images as work items of up to `batch_size` images each"""
+        user_queue = self._users.get(user)
+        if user_queue is None:
+            user_queue = self._users[user] = _UserQueue(self._virtual_time)
+        elif not user_queue.jobs:
+            user_queue.tag = max(user_queue.tag, self._virtual_time)
+
+        job_queue = _JobQueue(PRIORITY_WEIGHTS[priority], user_queue.job_clock)
+        indices = list(indices)
+        for start in range(0, len(indices), max(batch_size, 1)):
+            job_queue.items.append(WorkItem(job_id, indices[start:start + batch_size], user, priority))
+
+        if job_queue.items:
+            user_queue.jobs[job_id] = job_queue
+            self.queued += len(job_queue.items)
+
+    def next_item(self) -> Optional[WorkItem]:
+        """Pop the next item to run, or None if nothing is eligible"""
+        user_queue = None
+        for candidate in self._users.values():
+            if not candidate.jobs:
+                continue
+            if self.max_per_user and candidate.in_flight >= self.max_per_user:
+                continue
+            if user_queue is None or candidate.tag < user_queue.tag:
+                user_queue = candidate
+        if user_queue is None:
+            return None
+
+        job_id, job_queue = min(user_queue.jobs.items(), key=lambda entry: entry[1].tag)
+        item = job_queue.items.popleft()
+
+        self._virtual_time = user_queue.tag
+        user_queue.job_clock = job_queue.tag
+        # Priority is chosen by the client, so it only ranks a user's own jobs
+        user_queue.tag += len(item.indices)
+        job_queue.tag += len(item.indices) / job_queue.weight
+
+        if not job_queue.items:
+            del user_queue.jobs[job_id]
+        user_queue.in_flight += 1
+        self.queued -= 1
+        return item
+
+    def remove_job(self, job_id: str, user: str) -> List[WorkItem]:
+        """Drop a job's queued items, returning them"""
+        user_queue = self._users.get(user)
+        if user_queue is None:
+            return []
+        job_queue = user_queue.jobs.pop(job_id, None)
+        if job_queue is None:
+            return []
+
+        self.queued -= len(job_queue.items)
+        if not user_queue.jobs and user_queue.in_flight <= 0:
+            del self._users[user]
+        return list(job_queue.items)
+
+    def release(self, item: WorkItem) -> None:
+        """Mark a dispatched item as finished, freeing its user's slot"""
+        user_queue = self._users.get(item.user)
+        if user_queue is None:
+            return
+        user_queue.in_flight -= 1
+        if not user_queue.jobs and user_queue.in_flight <= 0:
+            del self._users[item.user]
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "max_per_user": self.max_per_user,
+            "users": {
+                user: {
+                    "queued": sum(len(job.items) for job in user_queue.jobs.values()),
+                    "queued_jobs": len(user_queue.jobs),
+                    "in_flight": user_queue.in_flight,
+                }
+                for user, user_queue in self._users.items()
+            },
+        }
@@ -1,10 +1,12 @@
 import asyncio
 import json
-import time
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 
-from .store import job_store
-from .models import JobStatus
+from .store import job_store, result_event_data, done_event_data
+from .models import FINISHED_JOB_STATUSES, JobEvent, JobEventType, ResultStatus
+from . import metrics
+
+KEEP_ALIVE_SECONDS = 10
 
 
 def sse_headers() -> dict:
@@ -16,54 +18,79 @@ def sse_headers() -> dict:
     }
 
 
-async def job_progress_stream(job_id: str) -> AsyncGenerator[bytes, None]:
-    """Stream job progress events as items complete"""
-    # Track which results we've already reported
-    reported_results = set()
-    last_keep_alive = time.time()
-    
-    while True:
-        current_time = time.time()
-        
-        # Send keep-alive comment every 10 seconds
-        if current_time - last_keep_alive > 10:
-            yield b": keep-alive\n\n"
-            last_keep_alive = current_time
-        
-        job = await job_store.get_job(job_id)
-        if not job:
-            # Job not found - end stream
-            break
-            
-        # Check for newly completed results
-        for i, result in enumerate(job.results):
-            if i not in reported_results and result.status != "running":
-                # New completed result - send progress event
-                event_data = {
-                    "index": i,
-                    "status": result.status,
-                    "url": result.url,
-                    "error": result.error
-                }
-                
-                progress_event = f'event: progress\ndata: {json.dumps(event_data)}\n\n'
-                yield progress_event.encode()
-                reported_results.add(i)
-        
-        # Check if job is complete
-        if job.status in [JobStatus.COMPLETED, JobStatus.FAILED]:
-            # Send final done event with metrics
-            done_data = {
-                "status": job.status,
-                "total_ms": job.total_ms,
-                "ttfi_ms": job.ttfi_ms,
-                "completed_count": sum(1 for r in job.results if r.status == "completed"),
-                "failed_count": sum(1 for r in job.results if r.status == "failed")
-            }
-            
-            done_event = f'event: done\ndata: {json.dumps(done_data)}\n\n'
-            yield done_event.encode()
-            break
-        
-        # Wait a bit before checking again
-        await asyncio.sleep(0.5)
\ No newline at end of file
+def _sse_event(name: str, seq: Optional[int], data: dict) -> bytes:
+    # Events without an id leave the client's Last-Event-ID where it was
+    id_line = f'id: {seq}\n' if seq is not None else ''
+    return f'{id_line}event: {name}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+def _format_event(event: JobEvent) -> bytes:
+    name = "done" if event.type == JobEventType.DONE else "progress"
+    return _sse_event(name, event.seq, event.data)
+
+
+async def job_progress_stream(job_id: str, last_event_id: Optional[int] = None) -> AsyncGenerator[bytes, None]:
+    """Stream job progress events as items advance and complete, resuming after `last_event_id` if given"""
+    # Subscribe before reading the job so no update can slip in between
+    queue = job_store.subscribe(job_id)
+    metrics.open_streams.labels("sse").inc()
+    try:
+        # Events up to this sequence id are already covered by what we sent
+        sent_seq = last_event_id or 0
+
+        # New clients always start from a snapshot; resuming ones get the log's tail if it reaches back
+        backlog = job_store.replay(job_id, sent_seq) if last_event_id is not None else None
+        if backlog is not None:
+            # The event log covers everything the client is missing - replay just that tail
+            for event in backlog:
+                yield _format_event(event)
+                if event.type == JobEventType.DONE:
+                    return
+                sent_seq = event.seq
+
+            # A client that already had the done event (e.g. EventSource reconnecting) gets it again
+            job = await job_store.get_job(job_id)
+            if job and job.status in FINISHED_JOB_STATUSES:
+                yield _sse_event("done", sent_seq, done_event_data(job))
+                return
+        else:
+            # New client, or no log reaching back far enough (trimmed, evicted, restarted) - send a snapshot
+            sent_seq = job_store.last_seq(job_id)
+            job = await job_store.get_job(job_id)
+            if not job:
+                # Job not found - end stream
+                return
+
+            snapshot = [
+                ("progress", result_event_data(i, result))
+                for i, result in enumerate(job.results)
+                if result.status != ResultStatus.RUNNING
+            ]
+            if job.status in FINISHED_JOB_STATUSES:
+                snapshot.append(("done", done_event_data(job)))
+
+            # Only the last snapshot event carries an id: a client cut off partway
+            # through resumes from its previous id and gets the whole snapshot again
+            for position, (name, data) in enumerate(snapshot, 1):
+                yield _sse_event(name, sent_seq if position == len(snapshot) else None, data)
+
+            if job.status in FINISHED_JOB_STATUSES:
+                return
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=KEEP_ALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keep-alive\n\n"
+                continue
+
+            if event.seq <= sent_seq:
+                continue
+            if event.type == JobEventType.RESULT:
+                yield _format_event(event)
+            elif event.type == JobEventType.DONE:
+                yield _format_event(event)
+                return
+    finally:
+        metrics.open_streams.labels("sse").dec()
+        job_store.unsubscribe(job_id, queue)
@@ -1,28 +1,666 @@
 import asyncio
-from typing import Dict, Optional
+import bisect
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
 
-from .models import Job
+from .config import config
+from .models import (
+    FINISHED_JOB_STATUSES, FINISHED_RESULT_STATUSES, ImageResult, Job, JobEvent, JobEventType, JobStatus, JobSummary,
+    ResultStatus,
+)
 
+# Position in a user's job list: (created_at, job id) of the last job already returned
+JobCursor = Tuple[datetime, str]
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def result_event_data(index: int, result: ImageResult) -> dict:
+    """Payload describing the current state of a single result"""
+    return {
+        "index": index,
+        "status": result.status,
+        "progress": result.progress,
+        "url": result.url,
+        "error": result.error,
+        "started_at": _isoformat(result.slot_acquired_at),
+        "finished_at": _isoformat(result.completed_at),
+    }
+
+
+def result_timeline(result: ImageResult) -> dict:
+    """When each stage of a result happened, plus its attempts and upstream prediction"""
+    return {
+        "queued_at": _isoformat(result.queued_at),
+        "slot_acquired_at": _isoformat(result.slot_acquired_at),
+        "prediction_created_at": _isoformat(result.prediction_created_at),
+        "prediction_started_at": _isoformat(result.prediction_started_at),
+        "completed_at": _isoformat(result.completed_at),
+        "attempts": result.attempts,
+        "prediction_id": result.prediction_id,
+        "predict_time": result.predict_time,
+    }
+
+
+def done_event_data(job: Job) -> dict:
+    """Payload describing a finished job and its metrics"""
+    return {
+        "status": job.status,
+        "total_ms": job.total_ms,
+        "ttfi_ms": job.ttfi_ms,
+        "completed_count": job.completed_count,
+        "failed_count": job.failed_count,
+        "cancelled_count": job.cancelled_count,
+    }
+
+
+class JobStore(ABC):
+    """Job storage with per-job change notifications.
+
+    Jobs this process creates or writes are kept in `_jobs`; subclasses decide
+    how they are persisted. Results are written one at a time with
+    update_result(), and update_job() writes the job's own fields.
+
+    Finished jobs are evicted least-recently-used first once they exceed the
+    retention age, count or approximate memory budget. Running jobs are never
+    evicted.
+
+    All store state is touched only from the event loop thread, so reads and
+    single-step writes need no lock. Callers that read, await and then write
+    the same job take that job's lock from job_lock(), so unrelated jobs never
+    contend.
+    """
 
-class JobStore:
     def __init__(self):
         self._jobs: Dict[str, Job] = {}
-        self._lock = asyncio.Lock()
+        self._job_locks: Dict[str, asyncio.Lock] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._idle_listeners: List[Callable[[str], None]] = []
+        self._event_logs: Dict[str, Deque[JobEvent]] = {}
+        self._event_seq: Dict[str, int] = {}
+        # Set (and dropped) on a job's next version bump; long polls wait on these, not as subscribers
+        self._change_events: Dict[str, asyncio.Event] = {}
+
+        self.retention_seconds = config.JOB_RETENTION_SECONDS
+        self.max_finished_jobs = config.JOB_RETENTION_MAX_FINISHED
+        self.max_finished_bytes = config.JOB_RETENTION_MAX_BYTES
+        self.sweep_interval = config.JOB_SWEEP_INTERVAL
+        # job_id -> (finished at, approximate size in bytes), least recently used first
+        self._finished: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._finished_bytes = 0
+        self._evictions: Dict[str, int] = {"expired": 0, "max_jobs": 0, "max_bytes": 0}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Open any backing resources (called from the app lifespan)"""
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close(self) -> None:
+        """Flush pending writes and release backing resources"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    @abstractmethod
+    async def _save_job(self, job: Job, with_results: bool = False) -> None:
+        """Persist the job's fields (and all of its results when `with_results`)"""
+
+    @abstractmethod
+    async def _save_result(self, job: Job, index: int) -> None:
+        """Persist a single result row, plus the job's counters and version"""
+
+    async def _save_jobs(self, jobs: List[Job], with_results: bool = False) -> None:
+        """Persist several jobs at once"""
+        for job in jobs:
+            await self._save_job(job, with_results=with_results)
+
+    @abstractmethod
+    async def _load_job(self, job_id: str) -> Optional[Job]:
+        """Load a job this process hasn't cached, or None"""
+
+    @abstractmethod
+    async def list_jobs(
+        self, owner: str, limit: int, before: Optional[JobCursor] = None
+    ) -> Tuple[List[JobSummary], Optional[JobCursor]]:
+        """A user's jobs, newest first, starting after `before`; returns the page and the next cursor"""
+
+    async def _purge_expired(self, cutoff: datetime) -> None:
+        """Delete persisted finished jobs created before `cutoff`"""
+
+    def job_lock(self, job_id: str) -> asyncio.Lock:
+        """Lock serializing read-modify-write sequences on one job"""
+        lock = self._job_locks.get(job_id)
+        if lock is None:
+            lock = self._job_locks[job_id] = asyncio.Lock()
+        return lock
 
     async def create_job(self, job: Job) -> Job:
-        async with self._lock:
+        await self.create_jobs([job])
+        return job
+
+    async def create_jobs(self, jobs: List[Job]) -> List[Job]:
+        """Insert several new jobs in one store operation"""
+        for job in jobs:
             self._jobs[job.id] = job
-            return job
+        await self._save_jobs(jobs, with_results=True)
+        return jobs
 
     async def get_job(self, job_id: str) -> Optional[Job]:
-        async with self._lock:
-            return self._jobs.get(job_id)
+        job = self._jobs.get(job_id)
+        if job is None:
+            return await self._load_job(job_id)
+
+        if job_id in self._finished:
+            self._finished.move_to_end(job_id)
+        return job
 
     async def update_job(self, job: Job) -> Job:
-        async with self._lock:
+        await self.update_jobs([job])
+        return job
+
+    async def update_jobs(self, jobs: List[Job]) -> List[Job]:
+        """Write the fields of several jobs in one store operation"""
+        for job in jobs:
             self._jobs[job.id] = job
+            self._bump_version(job)
+            if job.status in FINISHED_JOB_STATUSES:
+                self._publish(JobEvent(type=JobEventType.DONE, job_id=job.id, data=done_event_data(job)))
+                self._mark_finished(job)
+        await self._save_jobs(jobs)
+        return jobs
+
+    async def update_result(
+        self,
+        job_id: str,
+        index: int,
+        status: ResultStatus,
+        url: Optional[str] = None,
+        error: Optional[str] = None,
+        progress: Optional[int] = None,
+        completed_at: Optional[datetime] = None,
+    ) -> Optional[Job]:
+        """Set the state of one result and notify the job's subscribers.
+
+        Intermediate states (starting, processing) never overwrite a result
+        that has already finished. A finished status stamps `completed_at`
+        (now unless given).
+        """
+        job = await self.get_job_for_write(job_id)
+        if job is None or index >= len(job.results):
+            return None
+
+        result = job.results[index]
+        if result.status in FINISHED_RESULT_STATUSES and status not in FINISHED_RESULT_STATUSES:
             return job
 
+        if result.status != status:
+            job.count_result(result.status, -1)
+            job.count_result(status, 1)
+        result.version = self._bump_version(job)
+        result.status = status
+        result.url = url
+        result.error = error
+        result.progress = 100 if status == ResultStatus.COMPLETED else progress
+        if status in FINISHED_RESULT_STATUSES:
+            result.completed_at = completed_at or datetime.utcnow()
+
+        self._publish(JobEvent(
+            type=JobEventType.RESULT,
+            job_id=job_id,
+            index=index,
+            data=result_event_data(index, result),
+        ))
+        await self._save_result(job, index)
+        return job
+
+    async def annotate_result(self, job_id: str, index: int, **fields) -> None:
+        """Record extra details on a result without notifying subscribers"""
+        job = await self.get_job_for_write(job_id)
+        if job is None or index >= len(job.results):
+            return
+
+        result = job.results[index]
+        for name, value in fields.items():
+            setattr(result, name, value)
+        result.version = self._bump_version(job)
+        await self._save_result(job, index)
+
+    def _bump_version(self, job: Job) -> int:
+        job.version += 1
+        event = self._change_events.pop(job.id, None)
+        if event is not None:
+            event.set()
+        return job.version
+
+    async def wait_for_change(self, job_id: str, since_version: int, timeout: float) -> Optional[Job]:
+        """The job once its version passes `since_version`, or as it is after `timeout` seconds.
+
+        Returns straight away if it already has, or if the job is finished.
+        Waiting doesn't subscribe to the job, so it never counts as a viewer.
+        """
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            job = await self.get_job(job_id)
+            if job is None or job.version > since_version or job.status in FINISHED_JOB_STATUSES:
+                return job
+
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return job
+            event = self._change_events.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return await self.get_job(job_id)
+
+    async def get_job_for_write(self, job_id: str, lock_held: bool = False) -> Optional[Job]:
+        """The job, cached in this process so that every writer changes the same object.
+
+        Pass `lock_held=True` from inside `job_lock(job_id)`: the lock isn't
+        re-entrant, and loading an uncached job would otherwise wait on it forever.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            if lock_held:
+                return await self._cache_loaded_job(job_id)
+            async with self.job_lock(job_id):
+                job = await self._cache_loaded_job(job_id)
+        return job
+
+    async def _cache_loaded_job(self, job_id: str) -> Optional[Job]:
+        # Written from this process from now on, so keep it cached
+        job = self._jobs.get(job_id) or await self._load_job(job_id)
+        if job is not None:
+            self._jobs[job_id] = job
+        return job
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Register for change events on a job; pair with unsubscribe()"""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+                for callback in self._idle_listeners:
+                    callback(job_id)
+
+    def subscriber_count(self, job_id: str) -> int:
+        return len(self._subscribers.get(job_id, ()))
+
+    def add_idle_listener(self, callback: Callable[[str], None]) -> None:
+        """Call `callback(job_id)` when a job's last subscriber goes away"""
+        self._idle_listeners.append(callback)
+
+    def stats(self) -> dict:
+        """Store size and eviction counts, for sizing instances"""
+        return {
+            "jobs": len(self._jobs),
+            "running_jobs": len(self._jobs) - len(self._finished),
+            "finished_jobs": len(self._finished),
+            "finished_bytes": self._finished_bytes,
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "evictions": dict(self._evictions),
+            "limits": {
+                "retention_seconds": self.retention_seconds,
+                "max_finished_jobs": self.max_finished_jobs,
+                "max_finished_bytes": self.max_finished_bytes,
+            },
+        }
+
+    def _mark_finished(self, job: Job) -> None:
+        if job.id in self._finished:
+            return
+
+        size = len(job.model_dump_json())
+        size += sum(len(json.dumps(event.data)) for event in self._event_logs.get(job.id, ()))
+        self._finished[job.id] = (time.monotonic(), size)
+        self._finished_bytes += size
+        self._enforce_limits()
+
+    def _enforce_limits(self) -> None:
+        while self.max_finished_jobs and len(self._finished) > self.max_finished_jobs:
+            self._evict(next(iter(self._finished)), "max_jobs")
+        while self.max_finished_bytes and self._finished_bytes > self.max_finished_bytes and self._finished:
+            self._evict(next(iter(self._finished)), "max_bytes")
+
+    def _evict(self, job_id: str, reason: str) -> None:
+        _, size = self._finished.pop(job_id)
+        self._finished_bytes -= size
+        self._jobs.pop(job_id, None)
+        self._job_locks.pop(job_id, None)
+        self._event_logs.pop(job_id, None)
+        self._event_seq.pop(job_id, None)
+        self._change_events.pop(job_id, None)
+        self._evictions[reason] += 1
+
+    async def sweep(self) -> None:
+        """Evict finished jobs past the retention age, then enforce the size limits"""
+        if self.retention_seconds:
+            cutoff = time.monotonic() - self.retention_seconds
+            expired = [job_id for job_id, (finished_at, _) in self._finished.items() if finished_at < cutoff]
+            for job_id in expired:
+                self._evict(job_id, "expired")
+            await self._purge_expired(datetime.utcnow() - timedelta(seconds=self.retention_seconds))
+        self._enforce_limits()
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    def last_seq(self, job_id: str) -> int:
+        """Sequence id of the most recent event published for a job"""
+        return self._event_seq.get(job_id, 0)
+
+    def replay(self, job_id: str, after_seq: int) -> Optional[List[JobEvent]]:
+        """Events published after `after_seq`, or None if the log no longer reaches back that far"""
+        if job_id not in self._event_logs:
+            # Nothing published by this process (evicted, from before a restart, or no events yet)
+            return None
+        last = self.last_seq(job_id)
+        if after_seq == last:
+            return []
+        if after_seq > last:
+            # An id we never issued (e.g. from before a restart) - can't resume from it
+            return None
+
+        log = self._event_logs.get(job_id)
+        if not log or log[0].seq > after_seq + 1:
+            return None
+        return [event for event in log if event.seq > after_seq]
+
+    def _publish(self, event: JobEvent) -> None:
+        event.seq = self._event_seq.get(event.job_id, 0) + 1
+        self._event_seq[event.job_id] = event.seq
+
+        log = self._event_logs.get(event.job_id)
+        if log is None:
+            log = self._event_logs[event.job_id] = deque(maxlen=config.JOB_EVENT_LOG_SIZE)
+        log.append(event)
+
+        for queue in self._subscribers.get(event.job_id, ()):
+            queue.put_nowait(event)
+
+
+class InMemoryJobStore(JobStore):
+    """Keeps jobs in process memory only; everything is lost on restart.
+
+    Each user's jobs are indexed by (created_at, id) in a sorted list, so
+    listing a page is a binary search rather than a scan of every job.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._owner_index: Dict[str, List[JobCursor]] = {}
+
+    async def create_jobs(self, jobs: List[Job]) -> List[Job]:
+        for job in jobs:
+            if job.owner:
+                bisect.insort(self._owner_index.setdefault(job.owner, []), (job.created_at, job.id))
+        return await super().create_jobs(jobs)
+
+    def _evict(self, job_id: str, reason: str) -> None:
+        job = self._jobs.get(job_id)
+        keys = self._owner_index.get(job.owner) if job and job.owner else None
+        if keys is not None:
+            position = bisect.bisect_left(keys, (job.created_at, job.id))
+            if position < len(keys) and keys[position][1] == job_id:
+                del keys[position]
+            if not keys:
+                del self._owner_index[job.owner]
+        super()._evict(job_id, reason)
+
+    async def list_jobs(
+        self, owner: str, limit: int, before: Optional[JobCursor] = None
+    ) -> Tuple[List[JobSummary], Optional[JobCursor]]:
+        keys = self._owner_index.get(owner, [])
+        end = bisect.bisect_left(keys, before) if before else len(keys)
+        start = max(end - limit, 0)
+        page = keys[start:end][::-1]
+
+        summaries = [JobSummary.from_job(self._jobs[job_id]) for _, job_id in page]
+        return summaries, (page[-1] if page and start > 0 else None)
+
+    async def _save_job(self, job: Job, with_results: bool = False) -> None:
+        pass
+
+    async def _save_result(self, job: Job, index: int) -> None:
+        pass
+
+    async def _load_job(self, job_id: str) -> Optional[Job]:
+        return None
+
+
+class SQLiteJobStore(JobStore):
+    """Persists jobs in SQLite (WAL mode) with one row per job and per result.
+
+    Writes are queued and committed by a single writer task. A write that finds
+    the writer idle is committed at once. When other writes are already queued
+    behind it, the writer waits up to `batch_window_ms` for more to join, and
+    commits them all in one transaction.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            owner TEXT,
+            data TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS results (
+            job_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (job_id, idx)
+        )""",
+    )
+
+    def __init__(self, path: str, batch_window_ms: int = None):
+        super().__init__()
+        self.path = path
+        if batch_window_ms is None:
+            batch_window_ms = config.STORE_BATCH_WINDOW_MS
+        self.batch_window = batch_window_ms / 1000
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        await super().start()
+        self._connect()
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def close(self) -> None:
+        await super().close()
+        if self._writer is not None:
+            self._pending.put_nowait(None)
+            await self._writer
+            self._writer = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                # Databases from before job listing
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                conn.execute("UPDATE jobs SET owner = json_extract(data, '$.owner')")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at, id)")
+            self._conn = conn
+        return self._conn
+
+    async def _save_job(self, job: Job, with_results: bool = False) -> None:
+        await self._write(self._job_statements(job, with_results))
+
+    async def _save_jobs(self, jobs: List[Job], with_results: bool = False) -> None:
+        # One batch, so the whole set is committed in a single transaction
+        await self._write([statement for job in jobs for statement in self._job_statements(job, with_results)])
+
+    def _job_statements(self, job: Job, with_results: bool) -> List[Tuple[str, tuple]]:
+        statements = [(
+            "INSERT INTO jobs (id, status, created_at, owner, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET status = excluded.status, data = excluded.data",
+            (
+                job.id, job.status.value, job.created_at.isoformat(), job.owner,
+                job.model_dump_json(exclude={"results"}),
+            ),
+        )]
+        if with_results:
+            statements.extend(
+                (
+                    "INSERT OR REPLACE INTO results (job_id, idx, status, data) VALUES (?, ?, ?, ?)",
+                    (job.id, index, result.status.value, result.model_dump_json()),
+                )
+                for index, result in enumerate(job.results)
+            )
+        return statements
+
+    async def _save_result(self, job: Job, index: int) -> None:
+        result = job.results[index]
+        await self._write([
+            (
+                "UPDATE results SET status = ?, data = ? WHERE job_id = ? AND idx = ?",
+                (result.status.value, result.model_dump_json(), job.id, index),
+            ),
+            (
+                "UPDATE jobs SET data = json_set(data, '$.version', ?, '$.completed_count', ?, "
+                "'$.failed_count', ?, '$.cancelled_count', ?) WHERE id = ?",
+                (job.version, job.completed_count, job.failed_count, job.cancelled_count, job.id),
+            ),
+        ])
+
+    async def _load_job(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._read_job, job_id)
+
+    async def _purge_expired(self, cutoff: datetime) -> None:
+        # created_at stands in for the finish time; jobs run minutes, retention is hours
+        await self._write([
+            (
+                "DELETE FROM results WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE status IN (?, ?, ?) AND created_at < ?)",
+                (*[status.value for status in FINISHED_JOB_STATUSES], cutoff.isoformat()),
+            ),
+            (
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND created_at < ?",
+                (*[status.value for status in FINISHED_JOB_STATUSES], cutoff.isoformat()),
+            ),
+        ])
+
+    async def list_jobs(
+        self, owner: str, limit: int, before: Optional[JobCursor] = None
+    ) -> Tuple[List[JobSummary], Optional[JobCursor]]:
+        rows = await asyncio.to_thread(self._read_job_page, owner, limit + 1, before)
+        summaries = [JobSummary.model_validate_json(data) for data in rows[:limit]]
+        more = len(rows) > limit
+        return summaries, ((summaries[-1].created_at, summaries[-1].id) if more else None)
+
+    def _read_job_page(self, owner: str, limit: int, before: Optional[JobCursor]) -> List[str]:
+        with self._db_lock:
+            conn = self._connect()
+            if before is None:
+                rows = conn.execute(
+                    "SELECT data FROM jobs WHERE owner = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (owner, limit),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT data FROM jobs WHERE owner = ? AND (created_at, id) < (?, ?) "
+                    "ORDER BY created_at DESC, id DESC LIMIT ?",
+                    (owner, before[0].isoformat(), before[1], limit),
+                ).fetchall()
+        return [row[0] for row in rows]
+
+    def _read_job(self, job_id: str) -> Optional[Job]:
+        with self._db_lock:
+            conn = self._connect()
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            results = conn.execute(
+                "SELECT data FROM results WHERE job_id = ? ORDER BY idx", (job_id,)
+            ).fetchall()
+
+        data = json.loads(row[0])
+        data["results"] = [json.loads(result[0]) for result in results]
+        job = Job.model_validate(data)
+        # Rows written before the counters existed don't have them
+        job.recount()
+        return job
+
+    async def _write(self, statements: List[Tuple[str, tuple]]) -> None:
+        """Queue statements for the next batch and wait until they are committed"""
+        if self._writer is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.put_nowait((statements, future))
+        await future
+
+    async def _write_loop(self) -> None:
+        closing = False
+        while not closing:
+            batch = [await self._pending.get()]
+            if batch[0] is not None and not self._pending.empty():
+                # Under load: give concurrent writers a moment to join this transaction
+                await asyncio.sleep(self.batch_window)
+            while not self._pending.empty():
+                batch.append(self._pending.get_nowait())
+
+            closing = None in batch
+            batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+
+            try:
+                await asyncio.to_thread(self._commit, [s for statements, _ in batch for s in statements])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    def _commit(self, statements: List[Tuple[str, tuple]]) -> None:
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
 
 # Global store instance
-job_store = JobStore()
\ No newline at end of file
+if config.JOB_STORE_BACKEND == "sqlite":
+    job_store: JobStore = SQLiteJobStore(config.JOB_STORE_PATH)
+else:
+    job_store: JobStore = InMemoryJobStore()
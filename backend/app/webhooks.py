@@ -0,0 +1,104 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from typing import Dict, Mapping, Optional, Tuple
+
+from .config import config
+
+TERMINAL_STATUSES = ("succeeded", "failed", "canceled")
+
+
+class WebhookRegistry:
+    """Routes Replicate webhook callbacks to the coroutine awaiting each prediction"""
+
+    def __init__(
+        self,
+        secret: str = "",
+        tolerance_seconds: int = 300,
+        max_early: int = 1000,
+        early_ttl_seconds: float = 300,
+    ):
+        self.secret = secret
+        self.tolerance_seconds = tolerance_seconds
+        self.max_early = max_early
+        self.early_ttl_seconds = early_ttl_seconds
+        self._waiters: Dict[str, asyncio.Future] = {}
+        # Callbacks that arrive before generate_image registers the prediction id,
+        # with the monotonic time they arrived; nobody claims them after the TTL
+        self._early: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    def verify_signature(self, headers: Mapping[str, str], body: bytes) -> bool:
+        """Verify the webhook-signature header against the signing secret"""
+        if not self.secret:
+            return False
+
+        webhook_id = headers.get("webhook-id")
+        timestamp = headers.get("webhook-timestamp")
+        signatures = headers.get("webhook-signature")
+        if not webhook_id or not timestamp or not signatures:
+            return False
+
+        try:
+            if abs(time.time() - int(timestamp)) > self.tolerance_seconds:
+                return False
+            key = base64.b64decode(self.secret.split("_", 1)[-1])
+        except ValueError:
+            return False
+
+        signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+        expected = base64.b64encode(
+            hmac.new(key, signed_content, hashlib.sha256).digest()
+        ).decode()
+
+        for signature in signatures.split():
+            _, _, value = signature.partition(",")
+            if hmac.compare_digest(value, expected):
+                return True
+        return False
+
+    def register(self, prediction_id: str) -> asyncio.Future:
+        """Return a future resolved with the prediction payload once it completes"""
+        future = asyncio.get_running_loop().create_future()
+        self._expire_early()
+        early = self._early.pop(prediction_id, None)
+        if early is not None:
+            future.set_result(early[1])
+        else:
+            self._waiters[prediction_id] = future
+        return future
+
+    def discard(self, prediction_id: str) -> None:
+        self._waiters.pop(prediction_id, None)
+
+    def resolve(self, payload: dict) -> bool:
+        """Hand a callback payload to its waiter; returns True if someone was waiting"""
+        prediction_id = payload.get("id")
+        if not prediction_id or payload.get("status") not in TERMINAL_STATUSES:
+            return False
+
+        future = self._waiters.pop(prediction_id, None)
+        if future is None:
+            self._expire_early()
+            self._early[prediction_id] = (time.monotonic(), payload)
+            self._early.move_to_end(prediction_id)
+            while len(self._early) > self.max_early:
+                self._early.popitem(last=False)
+            return False
+
+        if not future.done():
+            future.set_result(payload)
+        return True
+
+    def _expire_early(self) -> None:
+        cutoff = time.monotonic() - self.early_ttl_seconds
+        while self._early:
+            received_at, _ = next(iter(self._early.values()))
+            if received_at > cutoff:
+                break
+            self._early.popitem(last=False)
+
+
+webhook_registry = WebhookRegistry(secret=config.REPLICATE_WEBHOOK_SECRET)
@@ -1,119 +1,311 @@
 import asyncio
 import json
-import jwt
-from datetime import datetime
-from typing import Set
-from fastapi import WebSocket, WebSocketDisconnect, HTTPException, Query
-from .store import job_store
-from .models import JobStatus
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Set, Tuple, Union
+from fastapi import WebSocket, WebSocketDisconnect
+from .store import job_store, result_event_data, done_event_data
+from .models import FINISHED_JOB_STATUSES, FINISHED_RESULT_STATUSES, JobEventType, ResultStatus
 from .config import config
+from . import metrics
+
+
+class _Close:
+    """Queued instruction telling a connection's sender to close the socket"""
+
+    def __init__(self, code: int, reason: str):
+        self.code = code
+        self.reason = reason
+
+
+class WebSocketConnection:
+    """A viewer socket with its own bounded send queue.
+
+    A multiplexed connection follows any number of jobs and stays open as they
+    finish; a per-job connection is closed once its job is done.
+
+    Queued progress frames are keyed by (job id, result index). A newer frame
+    for the same result replaces the queued one in place, so a slow viewer
+    skips intermediate states instead of falling further behind.
+    """
+
+    def __init__(self, websocket: WebSocket, multiplexed: bool = False):
+        self.websocket = websocket
+        self.multiplexed = multiplexed
+        self.jobs: Set[str] = set()
+        # key -> (frame, droppable), oldest first
+        self.pending: "OrderedDict[Hashable, Tuple[Union[str, _Close], bool]]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item: Union[str, _Close], key: Hashable = None, droppable: bool = False):
+        """Queue an item, replacing any queued item with the same key"""
+        if key is None:
+            key = object()
+        self.pending[key] = (item, droppable)
+        self._ready.set()
+
+    def drop_oldest(self) -> bool:
+        """Drop the oldest droppable frame; False if every queued item must be kept"""
+        for key, (_, droppable) in self.pending.items():
+            if droppable:
+                del self.pending[key]
+                self.dropped += 1
+                return True
+        return False
+
+    async def send_loop(self):
+        """Drain queued frames to the socket until told to close"""
+        while True:
+            while not self.pending:
+                self._ready.clear()
+                await self._ready.wait()
+            _, (item, _) = self.pending.popitem(last=False)
+            if isinstance(item, _Close):
+                await self.websocket.close(code=item.code, reason=item.reason)
+                return
+            await self.websocket.send_text(item)
 
 
 class WebSocketManager:
-    def __init__(self):
-        self.active_connections: dict[str, Set[WebSocket]] = {}
+    """Fans job events out to WebSocket viewers.
+
+    One producer task per job turns store events into frames, serializing each
+    frame once, and offers it to every connection's send queue. Each connection
+    drains its own queue, so a slow socket never holds up the others.
+    """
+
+    def __init__(self, send_queue_size: int = None, slow_consumer_policy: str = None):
+        self.send_queue_size = send_queue_size or config.WS_SEND_QUEUE_SIZE
+        self.slow_consumer_policy = slow_consumer_policy or config.WS_SLOW_CONSUMER_POLICY
+        self.active_connections: dict[str, Set[WebSocketConnection]] = {}
+        self._producers: Dict[str, asyncio.Task] = {}
+        # Latest (frame, droppable) per result index (plus "done"), replayed to late joiners
+        self._frames: Dict[str, Dict[object, Tuple[str, bool]]] = {}
 
-    async def connect(self, websocket: WebSocket, job_id: str):
+    async def connect(self, websocket: WebSocket, job_id: str) -> WebSocketConnection:
+        """Accept a socket that follows a single job"""
         await websocket.accept()
+        metrics.open_streams.labels("websocket").inc()
+        connection = WebSocketConnection(websocket)
+        self.subscribe(connection, job_id)
+        return connection
+
+    async def connect_multiplexed(self, websocket: WebSocket) -> WebSocketConnection:
+        """Accept a socket that subscribes to jobs with client messages"""
+        await websocket.accept()
+        metrics.open_streams.labels("websocket").inc()
+        return WebSocketConnection(websocket, multiplexed=True)
+
+    def subscribe(self, connection: WebSocketConnection, job_id: str):
+        if job_id in connection.jobs:
+            return
+
+        frames = self._frames.get(job_id, {})
+        for key, (frame, droppable) in frames.items():
+            self._offer(connection, frame, (job_id, key), droppable)
+
+        if "done" in frames:
+            # Job already finished and its producer has exited
+            self._job_finished(connection, job_id)
+            return
+
+        connection.jobs.add(job_id)
         if job_id not in self.active_connections:
             self.active_connections[job_id] = set()
-        self.active_connections[job_id].add(websocket)
+        self.active_connections[job_id].add(connection)
+
+        if job_id not in self._producers:
+            self._producers[job_id] = asyncio.create_task(self._produce(job_id))
 
-    def disconnect(self, websocket: WebSocket, job_id: str):
+    def unsubscribe(self, connection: WebSocketConnection, job_id: str):
+        connection.jobs.discard(job_id)
         if job_id in self.active_connections:
-            self.active_connections[job_id].discard(websocket)
+            self.active_connections[job_id].discard(connection)
             if not self.active_connections[job_id]:
                 del self.active_connections[job_id]
+                producer = self._producers.pop(job_id, None)
+                if producer is not None and producer is not asyncio.current_task():
+                    producer.cancel()
+                self._frames.pop(job_id, None)
 
-    async def send_to_job_connections(self, job_id: str, message: dict):
-        if job_id in self.active_connections:
-            disconnected = set()
-            for websocket in self.active_connections[job_id]:
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except:
-                    disconnected.add(websocket)
-            
-            for ws in disconnected:
-                self.active_connections[job_id].discard(ws)
+    def disconnect(self, connection: WebSocketConnection):
+        metrics.open_streams.labels("websocket").dec()
+        for job_id in list(connection.jobs):
+            self.unsubscribe(connection, job_id)
+
+    def send_to_job_connections(self, job_id: str, message: dict, key: object = None, droppable: bool = False):
+        """Serialize a message once and queue it for every viewer of the job.
+
+        Frames with a key coalesce with the queued frame of the same key;
+        droppable ones may be discarded when a viewer's queue is full.
+        """
+        frame = json.dumps(message)
+        if key is not None:
+            self._frames.setdefault(job_id, {})[key] = (frame, droppable)
+
+        for connection in self.active_connections.get(job_id, ()):
+            self._offer(connection, frame, None if key is None else (job_id, key), droppable)
+
+    def close_job_connections(self, job_id: str, reason: str):
+        """Job is over: close per-job sockets, drop it from multiplexed ones"""
+        for connection in list(self.active_connections.get(job_id, ())):
+            self._job_finished(connection, job_id, reason)
+
+    def _job_finished(self, connection: WebSocketConnection, job_id: str, reason: str = "Job completed"):
+        if connection.multiplexed:
+            self.unsubscribe(connection, job_id)
+        else:
+            connection.put(_Close(1000, reason))
+
+    def send_control(self, connection: WebSocketConnection, message: dict):
+        """Queue a message for one connection only (acks and errors)"""
+        self._offer(connection, json.dumps(message))
+
+    def _offer(self, connection: WebSocketConnection, frame: str, key: Hashable = None, droppable: bool = False):
+        if key is None or key not in connection.pending:
+            if len(connection.pending) >= self.send_queue_size:
+                if self.slow_consumer_policy == "disconnect":
+                    connection.pending.clear()
+                    connection.put(_Close(1013, "Slow consumer"))
+                    return
+                # drop_oldest: discard the oldest in-progress frame, count what the viewer
+                # missed. Finished results and "done" are always delivered, even over the limit.
+                connection.drop_oldest()
+        connection.put(frame, key, droppable)
+
+    async def _produce(self, job_id: str):
+        """Single producer per job: turn store events into frames for all viewers"""
+        queue = job_store.subscribe(job_id)
+        try:
+            # Events up to here are reflected in the snapshot below
+            snapshot_seq = job_store.last_seq(job_id)
+            job = await job_store.get_job(job_id)
+            if not job:
+                self.send_to_job_connections(job_id, {"type": "error", "job_id": job_id, "error": "Job not found"})
+                self.close_job_connections(job_id, "Job not found")
+                return
+
+            def progress(data: dict):
+                self.send_to_job_connections(
+                    job_id,
+                    {"type": "progress", "job_id": job_id, "payload": data},
+                    key=data["index"],
+                    droppable=data["status"] not in FINISHED_RESULT_STATUSES,
+                )
+
+            def done(data: dict):
+                self.send_to_job_connections(job_id, {"type": "done", "job_id": job_id, "payload": data}, key="done")
+                self.close_job_connections(job_id, "Job completed")
+
+            # Catch up on results that started or finished before we subscribed
+            for i, result in enumerate(job.results):
+                if result.status != ResultStatus.RUNNING:
+                    progress(result_event_data(i, result))
+
+            if job.status in FINISHED_JOB_STATUSES:
+                done(done_event_data(job))
+                return
+
+            while True:
+                event = await queue.get()
+
+                if event.seq <= snapshot_seq:
+                    continue
+                if event.type == JobEventType.RESULT:
+                    progress(event.data)
+                elif event.type == JobEventType.DONE:
+                    done(event.data)
+                    return
+        finally:
+            job_store.unsubscribe(job_id, queue)
+            if self._producers.get(job_id) is asyncio.current_task():
+                del self._producers[job_id]
 
 
 ws_manager = WebSocketManager()
 
 
-async def verify_websocket_token(websocket: WebSocket, token: str = Query(...)):
-    """Verify WebSocket authentication token."""
+async def _wait_for_disconnect(websocket: WebSocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+async def websocket_job_stream(connection: WebSocketConnection):
+    """Stream job progress via WebSocket with same payload as SSE"""
+    sender = asyncio.create_task(connection.send_loop())
+    receiver = asyncio.create_task(_wait_for_disconnect(connection.websocket))
     try:
-        secret = config.AUTH_SECRET
-        payload = jwt.decode(token, secret, algorithms=["HS256"])
-        
-        exp_timestamp = payload.get('exp')
-        if exp_timestamp and exp_timestamp < jwt.datetime.datetime.now().timestamp():
-            await websocket.close(code=4001, reason="Token expired")
-            return False
-            
-        return True
-    except jwt.InvalidTokenError:
-        await websocket.close(code=4001, reason="Invalid token")
-        return False
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except WebSocketDisconnect:
+        pass
     except Exception as e:
-        await websocket.close(code=4000, reason=f"Authentication error: {str(e)}")
-        return False
+        await connection.websocket.close(code=1011, reason=f"Internal error: {str(e)}")
+    finally:
+        sender.cancel()
+        receiver.cancel()
 
 
-async def websocket_job_stream(websocket: WebSocket, job_id: str):
-    """Stream job progress via WebSocket with same payload as SSE"""
-  
-    reported_results = set()
-    
+async def _handle_subscriptions(connection: WebSocketConnection):
+    """Apply subscribe/unsubscribe messages from a multiplexed client"""
+    websocket = connection.websocket
+    while True:
+        try:
+            message = await websocket.receive_json()
+        except (ValueError, KeyError):
+            ws_manager.send_control(connection, {"type": "error", "error": "Messages must be JSON"})
+            continue
+
+        action = message.get("action") if isinstance(message, dict) else None
+        job_ids = message.get("job_ids") if isinstance(message, dict) else None
+        if action not in ("subscribe", "unsubscribe") or not isinstance(job_ids, list):
+            ws_manager.send_control(connection, {
+                "type": "error",
+                "error": 'Expected {"action": "subscribe" | "unsubscribe", "job_ids": [...]}'
+            })
+            continue
+
+        if action == "unsubscribe":
+            for job_id in job_ids:
+                ws_manager.unsubscribe(connection, job_id)
+            ws_manager.send_control(connection, {"type": "unsubscribed", "job_ids": job_ids})
+            continue
+
+        subscribed = []
+        for job_id in job_ids:
+            if len(connection.jobs | set(subscribed)) >= config.WS_MAX_SUBSCRIPTIONS:
+                ws_manager.send_control(connection, {
+                    "type": "error",
+                    "job_id": job_id,
+                    "error": f"Subscription limit of {config.WS_MAX_SUBSCRIPTIONS} reached"
+                })
+                continue
+            if not isinstance(job_id, str) or not await job_store.get_job(job_id):
+                ws_manager.send_control(connection, {"type": "error", "job_id": job_id, "error": "Job not found"})
+                continue
+            subscribed.append(job_id)
+
+        # Ack before subscribing so replayed frames arrive after the ack
+        ws_manager.send_control(connection, {"type": "subscribed", "job_ids": subscribed})
+        for job_id in subscribed:
+            ws_manager.subscribe(connection, job_id)
+
+
+async def websocket_multiplex_stream(connection: WebSocketConnection):
+    """Stream progress for every job the client subscribes to over one socket"""
+    sender = asyncio.create_task(connection.send_loop())
+    receiver = asyncio.create_task(_handle_subscriptions(connection))
     try:
-        while True:
-            job = await job_store.get_job(job_id)
-            if not job:
-                await websocket.close(code=1000, reason="Job not found")
-                break
-                
-            for i, result in enumerate(job.results):
-                if i not in reported_results and result.status != "running":
-                    progress_data = {
-                        "type": "progress",
-                        "payload": {
-                            "index": i,
-                            "status": result.status,
-                            "url": result.url,
-                            "error": result.error,
-                            "started_at": job.created_at.isoformat() if job.created_at else None,
-                            "finished_at": datetime.utcnow().isoformat()
-                        }
-                    }
-                    
-                    await websocket.send_text(json.dumps(progress_data))
-                    reported_results.add(i)
-            
-            if job.status in [JobStatus.COMPLETED, JobStatus.FAILED]:
-                done_data = {
-                    "type": "done",
-                    "payload": {
-                        "status": job.status,
-                        "total_ms": job.total_ms,
-                        "ttfi_ms": job.ttfi_ms,
-                        "completed_count": sum(1 for r in job.results if r.status == "completed"),
-                        "failed_count": sum(1 for r in job.results if r.status == "failed")
-                    }
-                }
-                
-                await websocket.send_text(json.dumps(done_data))
-                await websocket.close(code=1000, reason="Job completed")
-                break
-            
-            try:
-                await websocket.ping()
-            except:
-                break
-                
-            await asyncio.sleep(0.5)
-            
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        await websocket.close(code=1011, reason=f"Internal error: {str(e)}")
\ No newline at end of file
+        await connection.websocket.close(code=1011, reason=f"Internal error: {str(e)}")
+    finally:
+        sender.cancel()
+        receiver.cancel()
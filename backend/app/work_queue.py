@@ -0,0 +1,347 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from .config import config
+from .models import Job, ResultStatus
+from .scheduler import PRIORITY_WEIGHTS
+
+
+class LeasedItem:
+    """A work item claimed by a worker, with the job fields needed to run it"""
+
+    def __init__(self, item_id: int, job: Job, indices: List[int], enqueued_at: float, attempts: int):
+        self.id = item_id
+        self.job = job
+        self.indices = indices
+        self.enqueued_at = enqueued_at
+        self.attempts = attempts
+
+    @property
+    def queue_wait_ms(self) -> int:
+        # Wall clock rather than monotonic: the item was enqueued by another process
+        return max(int((time.time() - self.enqueued_at) * 1000), 0)
+
+
+class WorkQueue:
+    """Durable SQLite (WAL) queue of image work items shared by API and worker processes.
+
+    The API enqueues a job's work items; workers claim them under a lease and
+    keep it alive with heartbeats. An item whose lease runs out - its worker
+    died or hung - goes back to the queue, until it has been claimed
+    `max_attempts` times, after which its images fail. Claims go to the user
+    with the fewest items in flight, then to the user served least recently;
+    priority only orders that user's own items.
+
+    Workers report result changes into a table that the API process which
+    enqueued the job (its origin) reads and deletes as it applies them, so
+    each update is applied exactly once. API processes heartbeat as readers;
+    when one stops, a live one adopts its jobs and their unread updates.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS work_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            user TEXT NOT NULL,
+            weight INTEGER NOT NULL,
+            job TEXT NOT NULL,
+            indices TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'queued',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            origin TEXT
+        )""",
+        "CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state, user)",
+        "CREATE INDEX IF NOT EXISTS work_items_job ON work_items (job_id)",
+        """CREATE TABLE IF NOT EXISTS result_updates (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            origin TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS result_readers (
+            name TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL
+        )""",
+        # When each user was last given an item, so users take turns on ties
+        """CREATE TABLE IF NOT EXISTS user_turns (
+            user TEXT PRIMARY KEY,
+            turn INTEGER NOT NULL
+        )""",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = 60,
+        max_attempts: int = 3,
+        max_per_user: int = 0,
+    ):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.max_per_user = max_per_user
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self._connect)
+
+    async def close(self) -> None:
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            for table in ("work_items", "result_updates"):
+                # Queues from before updates were routed to their origin
+                if "origin" not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN origin TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS result_updates_origin ON result_updates (origin, seq)")
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn, *args):
+        """Run `fn(conn, *args)` in one immediate transaction on a worker thread"""
+        def transaction():
+            with self._db_lock:
+                conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = fn(conn, *args)
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+                return result
+        return await asyncio.to_thread(transaction)
+
+    # API side
+
+    async def enqueue(self, job: Job, batches: List[List[int]], origin: Optional[str] = None) -> None:
+        """Queue a job's images as work items (one per batch)"""
+        await self.enqueue_jobs([(job, batches)], origin)
+
+    async def enqueue_jobs(self, jobs: List[Tuple[Job, List[List[int]]]], origin: Optional[str] = None) -> None:
+        """Queue the work items of several jobs in one transaction; `origin` reads their result updates"""
+        now = time.time()
+        rows = []
+        for job, batches in jobs:
+            payload = job.model_dump_json(exclude={"results"})
+            user = job.owner or "anonymous"
+            rows.extend(
+                (job.id, user, PRIORITY_WEIGHTS[job.priority], payload, json.dumps(indices), now, origin)
+                for indices in batches
+            )
+
+        def insert(conn):
+            conn.executemany(
+                "INSERT INTO work_items (job_id, user, weight, job, indices, enqueued_at, origin) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        await self._run(insert)
+
+    async def cancel_job(self, job_id: str) -> None:
+        """Drop a job's queued items and flag its leased ones so their workers stop"""
+        def cancel(conn):
+            conn.execute("DELETE FROM work_items WHERE job_id = ? AND state = 'queued'", (job_id,))
+            conn.execute("UPDATE work_items SET state = 'cancelled' WHERE job_id = ? AND state = 'leased'", (job_id,))
+        await self._run(cancel)
+
+    async def heartbeat_reader(self, reader: str) -> int:
+        """Mark `reader` alive and adopt the jobs of readers silent for a lease; returns how many readers it took over"""
+        def beat(conn):
+            now = time.time()
+            conn.execute(
+                "INSERT INTO result_readers (name, seen_at) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET seen_at = excluded.seen_at",
+                (reader, now),
+            )
+            dead = [row[0] for row in conn.execute(
+                "SELECT name FROM result_readers WHERE seen_at < ? AND name != ?", (now - self.lease_seconds, reader)
+            )]
+            for name in dead:
+                conn.execute("UPDATE work_items SET origin = ? WHERE origin = ?", (reader, name))
+                conn.execute("UPDATE result_updates SET origin = ? WHERE origin = ?", (reader, name))
+                conn.execute("DELETE FROM result_readers WHERE name = ?", (name,))
+            # Updates with no origin (enqueued before routing, or their work item is gone) go to anyone
+            conn.execute("UPDATE result_updates SET origin = ? WHERE origin IS NULL", (reader,))
+            return len(dead)
+        return await self._run(beat)
+
+    async def remove_reader(self, reader: str) -> None:
+        """Hand a stopping reader's jobs to whichever reader heartbeats next"""
+        def remove(conn):
+            conn.execute("UPDATE result_readers SET seen_at = 0 WHERE name = ?", (reader,))
+        await self._run(remove)
+
+    async def read_results(self, reader: str, limit: int = 500) -> List[Tuple[int, str, int, dict, float]]:
+        """Unapplied result updates for `reader`'s jobs, oldest first"""
+        def read(conn):
+            return conn.execute(
+                "SELECT seq, job_id, idx, data, created_at FROM result_updates WHERE origin = ? ORDER BY seq LIMIT ?",
+                (reader, limit),
+            ).fetchall()
+        rows = await self._run(read)
+        return [(seq, job_id, index, json.loads(data), created_at) for seq, job_id, index, data, created_at in rows]
+
+    async def ack_results(self, reader: str, up_to_seq: int) -> None:
+        """Delete `reader`'s result updates up to and including `up_to_seq` once they are applied"""
+        await self._run(lambda conn: conn.execute(
+            "DELETE FROM result_updates WHERE origin = ? AND seq <= ?", (reader, up_to_seq)
+        ))
+
+    # Worker side
+
+    async def claim(self, worker: str) -> Optional[LeasedItem]:
+        """Lease the next work item to `worker`, or return None if nothing is eligible"""
+        return await self._run(self._claim, worker)
+
+    def _claim(self, conn: sqlite3.Connection, worker: str) -> Optional[LeasedItem]:
+        now = time.time()
+        self._reap_expired(conn, now)
+
+        # Pick the user first, so a self-declared priority never wins against other users
+        row = conn.execute(
+            """SELECT w.id, w.job, w.indices, w.enqueued_at, w.attempts, w.user
+               FROM work_items w
+               JOIN (
+                   SELECT q.user,
+                          MIN(q.id) AS oldest,
+                          (SELECT COUNT(*) FROM work_items l WHERE l.state = 'leased' AND l.user = q.user) AS in_flight,
+                          COALESCE((SELECT t.turn FROM user_turns t WHERE t.user = q.user), 0) AS turn
+                   FROM work_items q
+                   WHERE q.state = 'queued'
+                   GROUP BY q.user
+                   HAVING ? = 0 OR in_flight < ?
+                   ORDER BY in_flight, turn, oldest
+                   LIMIT 1
+               ) u ON u.user = w.user
+               WHERE w.state = 'queued'
+               ORDER BY w.weight DESC, w.id
+               LIMIT 1""",
+            (self.max_per_user, self.max_per_user),
+        ).fetchone()
+        if row is None:
+            return None
+
+        item_id, job, indices, enqueued_at, attempts, user = row
+        conn.execute(
+            "INSERT INTO user_turns (user, turn) VALUES (?, (SELECT COALESCE(MAX(turn), 0) + 1 FROM user_turns)) "
+            "ON CONFLICT (user) DO UPDATE SET turn = excluded.turn",
+            (user,),
+        )
+        conn.execute(
+            "UPDATE work_items SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+            (worker, now + self.lease_seconds, item_id),
+        )
+        return LeasedItem(item_id, Job.model_validate_json(job), json.loads(indices), enqueued_at, attempts + 1)
+
+    def _reap_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        """Requeue items whose worker stopped heartbeating; fail those out of attempts"""
+        expired = conn.execute(
+            "SELECT id, job_id, indices, state, attempts FROM work_items "
+            "WHERE state IN ('leased', 'cancelled') AND lease_expires < ?",
+            (now,),
+        ).fetchall()
+
+        for item_id, job_id, indices, state, attempts in expired:
+            if state == "leased" and attempts < self.max_attempts:
+                conn.execute("UPDATE work_items SET state = 'queued', worker = NULL WHERE id = ?", (item_id,))
+                continue
+
+            if state == "leased":
+                # Before the delete, so the updates find the item's origin
+                error = f"Worker lost the image after {attempts} attempts"
+                self._insert_results(conn, job_id, [
+                    (index, {"status": ResultStatus.FAILED.value, "error": error}) for index in json.loads(indices)
+                ])
+            conn.execute("DELETE FROM work_items WHERE id = ?", (item_id,))
+
+    async def heartbeat(self, worker: str, item_ids: List[int]) -> Set[int]:
+        """Extend the leases on `item_ids`; returns the ids this worker should stop working on"""
+        if not item_ids:
+            return set()
+
+        def beat(conn):
+            placeholders = ",".join("?" * len(item_ids))
+            conn.execute(
+                f"UPDATE work_items SET lease_expires = ? WHERE worker = ? AND state = 'leased' AND id IN ({placeholders})",
+                (time.time() + self.lease_seconds, worker, *item_ids),
+            )
+            held = conn.execute(
+                f"SELECT id FROM work_items WHERE worker = ? AND state = 'leased' AND id IN ({placeholders})",
+                (worker, *item_ids),
+            ).fetchall()
+            return set(item_ids) - {row[0] for row in held}
+        return await self._run(beat)
+
+    async def complete(self, item_id: int, worker: str) -> None:
+        await self._run(lambda conn: conn.execute(
+            "DELETE FROM work_items WHERE id = ? AND worker = ?", (item_id, worker)
+        ))
+
+    async def release(self, item_id: int, worker: str) -> None:
+        """Hand an unfinished item back to the queue (graceful shutdown); the claim doesn't count"""
+        await self._run(lambda conn: conn.execute(
+            "UPDATE work_items SET state = 'queued', worker = NULL, attempts = MAX(attempts - 1, 0) "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (item_id, worker),
+        ))
+
+    async def push_results(self, job_id: str, updates: List[Tuple[int, dict]]) -> None:
+        """Report result changes, as (index, fields) pairs, to the API processes"""
+        await self._run(self._insert_results, job_id, updates)
+
+    def _insert_results(self, conn: sqlite3.Connection, job_id: str, updates: List[Tuple[int, dict]]) -> None:
+        now = time.time()
+        origin = conn.execute("SELECT origin FROM work_items WHERE job_id = ? LIMIT 1", (job_id,)).fetchone()
+        conn.executemany(
+            "INSERT INTO result_updates (job_id, idx, data, created_at, origin) VALUES (?, ?, ?, ?, ?)",
+            [(job_id, index, json.dumps(data), now, origin[0] if origin else None) for index, data in updates],
+        )
+
+    async def stats(self) -> dict:
+        def read(conn):
+            states = dict(conn.execute("SELECT state, COUNT(*) FROM work_items GROUP BY state").fetchall())
+            workers = conn.execute(
+                "SELECT COUNT(DISTINCT worker) FROM work_items WHERE state = 'leased'"
+            ).fetchone()[0]
+            backlog = conn.execute("SELECT COUNT(*) FROM result_updates").fetchone()[0]
+            readers = conn.execute("SELECT COUNT(*) FROM result_readers").fetchone()[0]
+            return states, workers, backlog, readers
+        states, workers, backlog, readers = await self._run(read)
+        return {
+            "queued": states.get("queued", 0),
+            "leased": states.get("leased", 0),
+            "cancelling": states.get("cancelled", 0),
+            "busy_workers": workers,
+            "result_updates": backlog,
+            "api_readers": readers,
+            "lease_seconds": self.lease_seconds,
+            "max_attempts": self.max_attempts,
+        }
+
+
+work_queue = WorkQueue(
+    config.WORK_QUEUE_PATH,
+    lease_seconds=config.WORK_LEASE_SECONDS,
+    max_attempts=config.WORK_MAX_ATTEMPTS,
+    max_per_user=config.GEN_MAX_CONCURRENCY_PER_USER,
+)
@@ -0,0 +1,237 @@
+"""
+Worker process for RUNNER_MODE=queue: claims image work items from the shared
+work queue and generates them.
+
+Run from the backend directory, next to the API:
+    python -m app.worker --processes 4 --metrics-port 9101
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from datetime import datetime
+from typing import Dict, Optional
+
+from prometheus_client import start_http_server
+
+from .config import config
+from . import metrics
+from .limiter import AdaptiveLimiter, concurrency_limiter
+from .models import ImageResult, ResultStatus
+from .replicate_client import replicate_client
+from .runner import ImageProcessor
+from .work_queue import LeasedItem, WorkQueue, work_queue
+
+logger = logging.getLogger(__name__)
+
+
+class QueueWorker(ImageProcessor):
+    """Claims work items from the durable queue and generates their images.
+
+    Keeps up to the adaptive concurrency limit of items in flight. A heartbeat
+    loop extends their leases and cancels any item the queue no longer assigns
+    to this worker (its job was cancelled, or the lease lapsed and another
+    worker took over). Result changes go back to the API processes through the
+    queue. On stop the worker claims nothing new, lets in-flight items finish
+    for up to `drain_seconds`, then cancels the rest and hands them back.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue = None,
+        worker_id: str = None,
+        limiter: AdaptiveLimiter = None,
+        poll_interval: float = None,
+        heartbeat_interval: float = None,
+        drain_seconds: float = None,
+    ):
+        super().__init__()
+        if queue is None:
+            queue = work_queue
+        if worker_id is None:
+            worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        if limiter is None:
+            limiter = concurrency_limiter
+        if poll_interval is None:
+            poll_interval = config.WORK_POLL_INTERVAL
+        if heartbeat_interval is None:
+            heartbeat_interval = config.WORK_HEARTBEAT_SECONDS
+        if drain_seconds is None:
+            drain_seconds = config.WORKER_DRAIN_SECONDS
+
+        self.queue = queue
+        self.worker_id = worker_id
+        self.limiter = limiter
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.drain_seconds = drain_seconds
+        self._in_flight: Dict[int, asyncio.Task] = {}
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Claim and run work items until `stop` is set"""
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        try:
+            while not stop.is_set():
+                wait_for = self._claim_delay()
+                if wait_for is None:
+                    item = await self.queue.claim(self.worker_id)
+                    if item is not None:
+                        task = asyncio.create_task(self._run_item(item))
+                        self._in_flight[item.id] = task
+                        task.add_done_callback(lambda _, item_id=item.id: self._in_flight.pop(item_id, None))
+                        continue
+                    wait_for = self.poll_interval
+
+                await self._wait(stop, wait_for)
+            await self._drain()
+        finally:
+            heartbeat.cancel()
+
+    def _claim_delay(self) -> Optional[float]:
+        """None if a new item may be claimed now, else how long to wait before checking again"""
+        blocked_for = self.limiter.blocked_for()
+        if blocked_for > 0:
+            # Upstream asked us to back off (Retry-After)
+            return blocked_for
+        if len(self._in_flight) >= self.limiter.limit:
+            return self.poll_interval
+        return None
+
+    async def _wait(self, stop: asyncio.Event, timeout: float) -> None:
+        """Sleep up to `timeout`, waking early on stop or when an item finishes"""
+        waiters = [asyncio.ensure_future(stop.wait()), *self._in_flight.values()]
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        waiters[0].cancel()
+
+    async def _drain(self) -> None:
+        if self._in_flight:
+            await asyncio.wait(list(self._in_flight.values()), timeout=self.drain_seconds)
+
+        for item_id, task in list(self._in_flight.items()):
+            task.cancel()
+            await self.queue.release(item_id, self.worker_id)
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight.values(), return_exceptions=True)
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                lost = await self.queue.heartbeat(self.worker_id, list(self._in_flight))
+            except Exception:
+                logger.exception("Work queue heartbeat failed")
+                continue
+
+            for item_id in lost:
+                task = self._in_flight.get(item_id)
+                if task is not None:
+                    task.cancel()
+                # Clears items of cancelled jobs; a no-op if another worker now holds the lease
+                await self.queue.complete(item_id, self.worker_id)
+
+    async def _run_item(self, item: LeasedItem) -> None:
+        job = item.job
+        queue_wait_ms = item.queue_wait_ms
+        metrics.queue_wait_seconds.observe(queue_wait_ms / 1000)
+        queued_at = datetime.utcfromtimestamp(item.enqueued_at)
+        slot_acquired_at = datetime.utcnow()
+        for index in item.indices:
+            await self._annotate_result(
+                job.id, index, queue_wait_ms=queue_wait_ms,
+                queued_at=queued_at, slot_acquired_at=slot_acquired_at, attempts=1,
+            )
+
+        try:
+            await self._process_images(job, item.indices)
+        except asyncio.CancelledError:
+            # Cancelled job, lost lease or shutdown - the queue decides what happens to the item
+            raise
+        except Exception:
+            logger.exception("Work item %s failed", item.id)
+            await self.queue.push_results(job.id, [
+                (index, {"status": ResultStatus.FAILED.value, "error": "Worker error"}) for index in item.indices
+            ])
+        await self.queue.complete(item.id, self.worker_id)
+
+    async def _annotate_result(self, job_id: str, index: int, **fields):
+        encoded = ImageResult(**fields).model_dump(mode="json", include=set(fields))
+        await self.queue.push_results(job_id, [(index, {"annotate": encoded})])
+
+    async def _update_result_progress(
+        self, job_id: str, index: int, status: ResultStatus, progress: Optional[int], preview_url: Optional[str]
+    ):
+        await self.queue.push_results(job_id, [
+            (index, {"status": status.value, "progress": progress, "url": preview_url})
+        ])
+
+    async def _update_result_success(self, job_id: str, index: int, completion_time: datetime, image_url: str):
+        await self.queue.push_results(job_id, [(index, {"status": ResultStatus.COMPLETED.value, "url": image_url})])
+
+    async def _update_result_failure(self, job_id: str, index: int, error_msg: str):
+        await self.queue.push_results(job_id, [(index, {"status": ResultStatus.FAILED.value, "error": error_msg})])
+
+
+async def run_worker() -> None:
+    # Webhook callbacks reach the API process, not this one, so workers always poll
+    replicate_client.webhook_url = ""
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await work_queue.start()
+    await replicate_client.start()
+    loop_monitor = asyncio.create_task(metrics.monitor_event_loop())
+    try:
+        await QueueWorker().run(stop)
+    finally:
+        loop_monitor.cancel()
+        await replicate_client.close()
+        await work_queue.close()
+
+
+def _worker_process(metrics_port: Optional[int] = None) -> None:
+    logging.basicConfig(level=logging.INFO)
+    if metrics_port:
+        # Each process serves its own registry; Prometheus scrapes one port per process
+        start_http_server(metrics_port)
+        metrics.concurrency_limit.set_function(lambda: concurrency_limiter.limit)
+    asyncio.run(run_worker())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to run")
+    parser.add_argument(
+        "--metrics-port", type=int, default=0,
+        help="serve Prometheus metrics from this port (process N uses port + N)",
+    )
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        _worker_process(args.metrics_port)
+        return
+
+    processes = [
+        multiprocessing.Process(target=_worker_process, args=(args.metrics_port and args.metrics_port + n,))
+        for n in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    # Pass a stop request on to every worker so each drains its own items
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Children got the same SIGINT and are draining; wait for them
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
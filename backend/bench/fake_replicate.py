@@ -0,0 +1,185 @@
+"""
+Local stand-in for the Replicate predictions API, for load tests that
+shouldn't cost money.
+
+Predictions sit in "starting" for a queue delay, then "processing" (with
+tqdm-style progress in their logs) for a run time drawn from a lognormal
+distribution, then finish. Failure and 429 rates and slow status polls are
+configurable.
+
+Run from the backend directory:
+    python -m bench.fake_replicate --port 9100 --run-median 2 --failure-rate 0.05
+and start the API with REPLICATE_BASE_URL=http://127.0.0.1:9100/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import struct
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+
+class FakePrediction:
+    def __init__(self, num_outputs: int, queue_delay: float, run_time: float, fails: bool):
+        self.id = uuid.uuid4().hex
+        self.num_outputs = num_outputs
+        self.created = time.time()
+        self.started = self.created + queue_delay
+        self.finished = self.started + run_time
+        self.fails = fails
+        self.canceled_at: Optional[float] = None
+
+    def status(self, now: float) -> str:
+        if self.canceled_at is not None:
+            return "canceled"
+        if now >= self.finished:
+            return "failed" if self.fails else "succeeded"
+        return "processing" if now >= self.started else "starting"
+
+    def to_dict(self, base_url: str) -> dict:
+        now = time.time()
+        status = self.status(now)
+        prediction = {
+            "id": self.id,
+            "status": status,
+            "created_at": _timestamp(self.created),
+            "started_at": _timestamp(self.started) if now >= self.started else None,
+            "completed_at": None,
+            "logs": "",
+            "output": None,
+            "error": None,
+            "metrics": {},
+        }
+        if status == "processing":
+            percent = int((now - self.started) / (self.finished - self.started) * 100)
+            prediction["logs"] = f"{percent:3d}%|{'#' * (percent // 10):<10}| {percent}/100 [00:00<00:00]\n"
+        elif status in ("succeeded", "failed", "canceled"):
+            end = self.canceled_at or self.finished
+            prediction["completed_at"] = _timestamp(end)
+            prediction["metrics"] = {"predict_time": round(max(end - self.started, 0), 3)}
+            if status == "succeeded":
+                prediction["output"] = [f"{base_url}/files/{self.id}-{n}.png" for n in range(self.num_outputs)]
+            elif status == "failed":
+                prediction["error"] = "Fake model crashed"
+        return prediction
+
+
+def _timestamp(epoch: float) -> str:
+    return (datetime(1970, 1, 1) + timedelta(seconds=epoch)).isoformat() + "Z"
+
+
+def _png(name: str, size: int = 64) -> bytes:
+    """A solid-colour PNG whose colour depends on `name`"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixel = hashlib.sha256(name.encode()).digest()[:3]
+    rows = b"".join(b"\x00" + pixel * size for _ in range(size))
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def _lognormal(median: float, sigma: float) -> float:
+    return random.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Fake Replicate")
+    predictions: Dict[str, FakePrediction] = {}
+    counts = {"created": 0, "polls": 0, "rate_limited": 0, "canceled": 0}
+
+    def base_url(request: Request) -> str:
+        return str(request.base_url).rstrip("/")
+
+    @app.post("/v1/predictions")
+    async def create_prediction(request: Request):
+        await asyncio.sleep(_lognormal(args.create_median, args.sigma))
+        if random.random() < args.rate_limit_rate:
+            counts["rate_limited"] += 1
+            return JSONResponse(
+                {"detail": "Request was throttled"}, status_code=429, headers={"Retry-After": str(args.retry_after)}
+            )
+
+        body = await request.json()
+        prediction = FakePrediction(
+            num_outputs=max(int(body.get("input", {}).get("num_outputs", 1)), 1),
+            queue_delay=_lognormal(args.queue_median, args.sigma),
+            run_time=_lognormal(args.run_median, args.sigma),
+            fails=random.random() < args.failure_rate,
+        )
+        predictions[prediction.id] = prediction
+        counts["created"] += 1
+        return JSONResponse(prediction.to_dict(base_url(request)), status_code=201)
+
+    @app.get("/v1/predictions/{prediction_id}")
+    async def get_prediction(prediction_id: str, request: Request):
+        counts["polls"] += 1
+        if random.random() < args.slow_poll_rate:
+            await asyncio.sleep(args.slow_poll_seconds)
+        prediction = predictions.get(prediction_id)
+        if prediction is None:
+            raise HTTPException(status_code=404, detail="Prediction not found")
+        return prediction.to_dict(base_url(request))
+
+    @app.post("/v1/predictions/{prediction_id}/cancel")
+    async def cancel_prediction(prediction_id: str, request: Request):
+        prediction = predictions.get(prediction_id)
+        if prediction is None:
+            raise HTTPException(status_code=404, detail="Prediction not found")
+        if prediction.status(time.time()) in ("starting", "processing"):
+            prediction.canceled_at = time.time()
+            counts["canceled"] += 1
+        return prediction.to_dict(base_url(request))
+
+    @app.get("/v1/webhooks/default/secret")
+    async def webhook_secret():
+        return {"key": "whsec_ZmFrZS1yZXBsaWNhdGUtc2VjcmV0"}
+
+    @app.get("/files/{name}")
+    async def get_file(name: str):
+        return Response(_png(name), media_type="image/png")
+
+    @app.get("/stats")
+    async def stats():
+        return counts
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    return parser.parse_args(argv)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Fake upstream behaviour; shared with bench.load_test"""
+    parser.add_argument("--create-median", type=float, default=0.05, help="median create latency (s)")
+    parser.add_argument("--queue-median", type=float, default=0.5, help="median time in 'starting' (s)")
+    parser.add_argument("--run-median", type=float, default=2.0, help="median model run time (s)")
+    parser.add_argument("--sigma", type=float, default=0.4, help="lognormal spread of all latencies")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of predictions that fail")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of creates answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After on 429 responses (s)")
+    parser.add_argument("--slow-poll-rate", type=float, default=0.0, help="share of status polls that stall")
+    parser.add_argument("--slow-poll-seconds", type=float, default=2.0, help="how long a slow poll stalls (s)")
+
+
+def main() -> None:
+    args = parse_args()
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
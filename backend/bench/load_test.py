@@ -0,0 +1,324 @@
+"""
+End-to-end load test against a local fake Replicate server.
+
+Starts bench.fake_replicate and the real API (uvicorn) as subprocesses, then
+has many concurrent users submit jobs and hold an SSE or WebSocket stream on
+each until it finishes. Reports jobs/sec, TTFI and total_ms percentiles,
+event delivery lag (a result finishing until a client receives it), the API's
+event loop lag and RSS, and saves everything as JSON for comparing commits.
+
+Run from the backend directory:
+    python -m bench.load_test --users 50 --jobs-per-user 4 --transport mixed \\
+        --env GEN_MAX_CONCURRENCY=20 --run-median 1.5 --failure-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import jwt
+import websockets
+from prometheus_client.parser import text_string_to_metric_families
+
+from bench.fake_replicate import add_arguments as add_upstream_arguments
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)], 1)
+    return {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1], 1)}
+
+
+def _histogram_buckets(metrics_text: str, name: str) -> Dict[float, float]:
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name == name:
+            return {
+                float(sample.labels["le"]): sample.value
+                for sample in family.samples if sample.name == f"{name}_bucket"
+            }
+    return {}
+
+
+def _histogram_quantile(q: float, before: Dict[float, float], after: Dict[float, float]) -> Optional[float]:
+    """Estimate a quantile of the observations made between two scrapes of a histogram"""
+    bounds = sorted(after)
+    counts = [after[le] - before.get(le, 0) for le in bounds]
+    if not counts or counts[-1] <= 0:
+        return None
+
+    rank = q * counts[-1]
+    previous_bound, previous_count = 0.0, 0.0
+    for le, count in zip(bounds, counts):
+        if count >= rank:
+            if le == float("inf"):
+                return previous_bound
+            share = (rank - previous_count) / (count - previous_count) if count > previous_count else 1
+            return previous_bound + (le - previous_bound) * share
+        previous_bound, previous_count = le, count
+    return previous_bound
+
+
+def _gauge(metrics_text: str, name: str) -> Optional[float]:
+    for family in text_string_to_metric_families(metrics_text):
+        for sample in family.samples:
+            if sample.name == name:
+                return sample.value
+    return None
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.api_url = ""
+        self.auth_secret = uuid.uuid4().hex
+        self.processes: List[subprocess.Popen] = []
+        self.outcomes: Dict[str, int] = {"completed": 0, "failed": 0, "cancelled": 0, "errors": 0}
+        self.images = 0
+        self.ttfi_ms: List[float] = []
+        self.total_ms: List[float] = []
+        self.client_ms: List[float] = []
+        self.event_lag_ms: List[float] = []
+        self.rss_bytes: List[float] = []
+
+    def start_servers(self) -> str:
+        upstream_port, api_port = _free_port(), _free_port()
+        upstream = [
+            f"--{name.replace('_', '-')}={getattr(self.args, name)}"
+            for name in ("create_median", "queue_median", "run_median", "sigma", "failure_rate",
+                         "rate_limit_rate", "retry_after", "slow_poll_rate", "slow_poll_seconds")
+        ]
+        self._spawn([sys.executable, "-m", "bench.fake_replicate", f"--port={upstream_port}", *upstream], {})
+
+        env = {
+            "REPLICATE_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+            "REPLICATE_API_TOKEN": "bench",
+            "REPLICATE_WEBHOOK_URL": "",
+            "AUTH_SECRET": self.auth_secret,
+            "HTTP2_ENABLED": "false",
+        }
+        for override in self.args.env:
+            key, _, value = override.partition("=")
+            env[key] = value
+        self._spawn(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(api_port), "--log-level", "warning"], env
+        )
+        self.api_url = f"http://127.0.0.1:{api_port}"
+        return f"http://127.0.0.1:{upstream_port}"
+
+    def _spawn(self, command: List[str], env: dict) -> None:
+        self.processes.append(subprocess.Popen(command, cwd=BACKEND_DIR, env={**os.environ, **env}))
+
+    def stop_servers(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    async def wait_ready(self, client: httpx.AsyncClient, url: str) -> None:
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"{url} did not come up")
+
+    def token(self, user: int) -> str:
+        payload = {"sub": f"user{user}@bench.local", "exp": datetime.utcnow() + timedelta(hours=1), "type": "access"}
+        return jwt.encode(payload, self.auth_secret, algorithm="HS256")
+
+    async def run_user(self, client: httpx.AsyncClient, user: int) -> None:
+        token = self.token(user)
+        transport = self.args.transport
+        if transport == "mixed":
+            transport = "sse" if user % 2 else "ws"
+
+        for job in range(self.args.jobs_per_user):
+            started = time.monotonic()
+            try:
+                response = await client.post(
+                    f"{self.api_url}/api/generate",
+                    headers={"Authorization": f"Bearer {token}"},
+                    json={"prompt": f"bench user {user} job {job} {uuid.uuid4().hex[:8]}", "num_images": self.args.num_images},
+                )
+                response.raise_for_status()
+                job_id = response.json()["job_id"]
+                if transport == "sse":
+                    done = await self._follow_sse(client, job_id, token)
+                else:
+                    done = await self._follow_websocket(job_id, token)
+            except Exception as e:
+                self.outcomes["errors"] += 1
+                print(f"user {user}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+
+            self.client_ms.append((time.monotonic() - started) * 1000)
+            self.outcomes[done["status"]] = self.outcomes.get(done["status"], 0) + 1
+            self.images += done.get("completed_count", 0)
+            if done.get("ttfi_ms") is not None:
+                self.ttfi_ms.append(done["ttfi_ms"])
+            if done.get("total_ms") is not None:
+                self.total_ms.append(done["total_ms"])
+            if self.args.think_time:
+                await asyncio.sleep(self.args.think_time)
+
+    def _record_progress(self, data: dict) -> None:
+        if data.get("finished_at"):
+            finished = datetime.fromisoformat(data["finished_at"])
+            self.event_lag_ms.append((datetime.utcnow() - finished).total_seconds() * 1000)
+
+    async def _follow_sse(self, client: httpx.AsyncClient, job_id: str, token: str) -> dict:
+        url = f"{self.api_url}/api/generate/{job_id}/stream"
+        async with client.stream("GET", url, headers={"Authorization": f"Bearer {token}"}) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "done":
+                        return data
+                    self._record_progress(data)
+        raise RuntimeError("SSE stream ended without a done event")
+
+    async def _follow_websocket(self, job_id: str, token: str) -> dict:
+        url = f"{self.api_url.replace('http', 'ws', 1)}/api/generate/{job_id}?token={token}"
+        async with websockets.connect(url) as ws:
+            async for frame in ws:
+                message = json.loads(frame)
+                if message["type"] == "done":
+                    return message["payload"]
+                if message["type"] == "progress":
+                    self._record_progress(message["payload"])
+        raise RuntimeError("WebSocket closed without a done event")
+
+    async def sample(self, client: httpx.AsyncClient, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            text = (await client.get(f"{self.api_url}/metrics")).text
+            rss = _gauge(text, "process_resident_memory_bytes")
+            if rss is not None:
+                self.rss_bytes.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self) -> dict:
+        upstream_url = self.start_servers()
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        try:
+            async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(60, read=None)) as client:
+                await self.wait_ready(client, f"{upstream_url}/stats")
+                await self.wait_ready(client, f"{self.api_url}/health")
+                lag_name = "process_event_loop_lag_seconds"
+                lag_before = _histogram_buckets((await client.get(f"{self.api_url}/metrics")).text, lag_name)
+
+                stop = asyncio.Event()
+                sampler = asyncio.create_task(self.sample(client, stop))
+                started = time.monotonic()
+                await asyncio.gather(*(self.run_user(client, user) for user in range(self.args.users)))
+                elapsed = time.monotonic() - started
+                stop.set()
+                await sampler
+
+                metrics_text = (await client.get(f"{self.api_url}/metrics")).text
+                lag_after = _histogram_buckets(metrics_text, lag_name)
+                upstream_stats = (await client.get(f"{upstream_url}/stats")).json()
+        finally:
+            self.stop_servers()
+
+        finished_jobs = sum(count for outcome, count in self.outcomes.items() if outcome != "errors")
+        loop_lag = {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (
+                ("p50", _histogram_quantile(0.5, lag_before, lag_after)),
+                ("p99", _histogram_quantile(0.99, lag_before, lag_after)),
+            )
+        }
+        return {
+            "timestamp": datetime.utcnow().isoformat(),
+            "commit": _git_commit(),
+            "args": vars(self.args),
+            "duration_s": round(elapsed, 2),
+            "jobs": self.outcomes,
+            "jobs_per_sec": round(finished_jobs / elapsed, 2),
+            "images_per_sec": round(self.images / elapsed, 2),
+            "ttfi_ms": _percentiles(self.ttfi_ms),
+            "total_ms": _percentiles(self.total_ms),
+            "client_job_ms": _percentiles(self.client_ms),
+            "event_lag_ms": _percentiles(self.event_lag_ms),
+            "event_loop_lag_ms": loop_lag,
+            "rss_mb": {
+                "start": round(self.rss_bytes[0] / 2**20, 1) if self.rss_bytes else None,
+                "peak": round(max(self.rss_bytes) / 2**20, 1) if self.rss_bytes else None,
+                "end": round(self.rss_bytes[-1] / 2**20, 1) if self.rss_bytes else None,
+            },
+            "upstream": upstream_stats,
+        }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="concurrent users")
+    parser.add_argument("--jobs-per-user", type=int, default=3, help="jobs each user submits, one after another")
+    parser.add_argument("--num-images", type=int, default=5, help="images per job")
+    parser.add_argument("--transport", choices=("sse", "ws", "mixed"), default="mixed", help="how users follow jobs")
+    parser.add_argument("--think-time", type=float, default=0.0, help="pause between a user's jobs (s)")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE", help="extra API setting (repeatable)"
+    )
+    parser.add_argument("--output", help="results file (default: bench/results/load-<commit>-<time>.json)")
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(LoadTest(args).run())
+    output = Path(args.output) if args.output else (
+        BACKEND_DIR / "bench" / "results" / f"load-{result['commit'] or 'local'}-{int(time.time())}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+
+    summary = {key: result[key] for key in ("jobs", "jobs_per_sec", "ttfi_ms", "total_ms", "event_lag_ms",
+                                            "event_loop_lag_ms", "rss_mb")}
+    print(json.dumps(summary, indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
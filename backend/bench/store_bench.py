@@ -0,0 +1,103 @@
+"""
+Micro-benchmark for JobStore operations under many concurrent jobs and viewers.
+
+Compares the current store against the store as it was before per-job
+locking: a dict behind one global asyncio.Lock, with result writes done the
+way the runner did them then (get the job, change the result, put it back).
+
+Run from the backend directory:
+    python -m bench.store_bench --jobs 1000 --viewers 10 --duration 5
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, Optional
+
+from app.models import Job, ResultStatus
+from app.store import InMemoryJobStore
+
+
+class BaselineJobStore:
+    """The original JobStore: every operation serialized through a single lock"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._lock = asyncio.Lock()
+
+    async def create_job(self, job: Job) -> Job:
+        async with self._lock:
+            self._jobs[job.id] = job
+            return job
+
+    async def get_job(self, job_id: str) -> Optional[Job]:
+        async with self._lock:
+            return self._jobs.get(job_id)
+
+    async def update_job(self, job: Job) -> Job:
+        async with self._lock:
+            self._jobs[job.id] = job
+            return job
+
+    async def update_result(self, job_id, index, status, url=None, error=None):
+        # What the runner's _update_result_success/_update_result_failure did
+        job = await self.get_job(job_id)
+        if job and index < len(job.results):
+            job.results[index].status = status
+            job.results[index].url = url
+            job.results[index].error = error
+            await self.update_job(job)
+        return job
+
+
+async def run(store, jobs: int, viewers: int, duration: float) -> dict:
+    job_ids = []
+    for _ in range(jobs):
+        job = await store.create_job(Job(prompt="benchmark", num_images=20))
+        job_ids.append(job.id)
+
+    counts = {"reads": 0, "writes": 0}
+    deadline = time.perf_counter() + duration
+
+    async def viewer(job_id: str):
+        # What a stream viewer does per wake-up: fetch the job and look at its results
+        while time.perf_counter() < deadline:
+            job = await store.get_job(job_id)
+            sum(1 for r in job.results if r.status != ResultStatus.RUNNING)
+            counts["reads"] += 1
+            await asyncio.sleep(0)
+
+    async def writer(job_id: str):
+        index = 0
+        while time.perf_counter() < deadline:
+            await store.update_result(job_id, index % 20, ResultStatus.COMPLETED, url="https://example.com/x.png")
+            counts["writes"] += 1
+            index += 1
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    tasks = [viewer(job_id) for job_id in job_ids for _ in range(viewers)]
+    tasks += [writer(job_id) for job_id in job_ids]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "reads_per_sec": round(counts["reads"] / elapsed),
+        "writes_per_sec": round(counts["writes"] / elapsed),
+        "ops_per_sec": round((counts["reads"] + counts["writes"]) / elapsed),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=1000)
+    parser.add_argument("--viewers", type=int, default=10, help="viewers per job")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    args = parser.parse_args()
+
+    for name, store in (("baseline (before)", BaselineJobStore()), ("per-job locks (after)", InMemoryJobStore())):
+        result = await run(store, args.jobs, args.viewers, args.duration)
+        print(f"{name:<24} {result}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+import os
+
+# Settings are read when app.config is imported; keep tests off the network and the disk
+os.environ.setdefault("JOB_STORE_BACKEND", "memory")
+os.environ.setdefault("RUNNER_MODE", "local")
+os.environ.setdefault("IMAGE_MIRROR_ENABLED", "false")
+os.environ.setdefault("REPLICATE_API_TOKEN", "test-token")
+
+import pytest
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def api_store(monkeypatch):
+    """A fresh in-memory job store behind the API"""
+    from app import main
+    from app.store import InMemoryJobStore
+
+    store = InMemoryJobStore()
+    monkeypatch.setattr(main, "job_store", store)
+    return store
+
+
+@pytest.fixture
+async def api(api_store):
+    """HTTP client for the app, logged in as the demo user"""
+    import httpx
+
+    from app import main
+
+    token, _ = main.auth_service.create_access_token(main.auth_service.demo_email)
+    transport = httpx.ASGITransport(app=main.app)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=headers) as client:
+        yield client
@@ -0,0 +1,104 @@
+import time
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app import main
+from app.auth import AuthService, TokenCache
+
+
+@pytest.fixture
+def auth(monkeypatch):
+    service = AuthService()
+    monkeypatch.setattr(main, "auth_service", service)
+    return service
+
+
+def _token(service: AuthService, **claims) -> str:
+    payload = {"sub": "test@example.com", "type": "access", "exp": datetime.utcnow() + timedelta(minutes=5)}
+    payload.update(claims)
+    return jwt.encode(payload, service.secret, algorithm=service.algorithm)
+
+
+def test_verified_token_is_served_from_cache(auth):
+    token, _ = auth.create_access_token("test@example.com")
+
+    assert auth.verify_token(token) == "test@example.com"
+    assert auth.verify_token(token) == "test@example.com"
+
+    assert auth.verifications == 1
+    assert auth.token_cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("claims", [
+    {"type": "refresh"},
+    {"exp": datetime.utcnow() - timedelta(seconds=1)},
+    {"sub": None},
+])
+def test_rejected_tokens_are_never_cached(auth, claims):
+    token = _token(auth, **claims)
+
+    assert auth.verify_token(token) is None
+    assert auth.verify_token(token) is None
+    assert auth.verifications == 2
+    assert auth.token_cache.stats()["entries"] == 0
+
+
+def test_tampered_token_is_rejected(auth):
+    token = _token(auth)
+    assert auth.verify_token(token[:-2] + "xx") is None
+
+
+def test_entry_expires_with_the_token(monkeypatch):
+    cache = TokenCache(ttl_seconds=300)
+    key = TokenCache.make_key("token")
+    cache.put(key, "test@example.com", exp=time.time() + 10)
+    assert cache.get(key) == "test@example.com"
+
+    later = time.time() + 11
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get(key) is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_entry_expires_after_ttl_even_if_token_lives_longer(monkeypatch):
+    cache = TokenCache(ttl_seconds=60)
+    key = TokenCache.make_key("token")
+    cache.put(key, "test@example.com", exp=time.time() + 3600)
+
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert cache.get(key) is None
+
+
+def test_least_recently_used_token_is_evicted():
+    cache = TokenCache(max_entries=2)
+    a, b, c = (TokenCache.make_key(token) for token in "abc")
+    cache.put(a, "a", None)
+    cache.put(b, "b", None)
+    cache.get(a)
+    cache.put(c, "c", None)
+
+    assert cache.get(b) is None
+    assert cache.get(a) == "a"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_websocket_uses_the_same_token_cache(auth):
+    token, _ = auth.create_access_token("test@example.com")
+    auth.verify_token(token)
+    client = TestClient(main.app)
+
+    with client.websocket_connect(f"/api/ws?token={token}") as ws:
+        ws.send_json({"action": "subscribe", "job_ids": []})
+        assert ws.receive_json() == {"type": "subscribed", "job_ids": []}
+    assert auth.verifications == 1
+    assert auth.token_cache.stats()["hits"] == 1
+
+    with pytest.raises(WebSocketDisconnect) as closed:
+        with client.websocket_connect("/api/ws?token=bad") as ws:
+            ws.receive_json()
+    assert closed.value.code == 1008
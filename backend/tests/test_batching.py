@@ -0,0 +1,198 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app import runner
+from app.cache import PromptCache
+from app.circuit_breaker import CircuitBreaker
+from app.models import Job, JobStatus, ResultStatus
+from app.replicate_client import PermanentError, ReplicateClient, TransientError
+from app.store import InMemoryJobStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    sleep = asyncio.sleep
+
+    async def fast_sleep(delay, *args, **kwargs):
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, "sleep", fast_sleep)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemoryJobStore()
+    monkeypatch.setattr(runner, "job_store", store)
+    monkeypatch.setattr(runner, "prompt_cache", PromptCache())
+    monkeypatch.setattr(runner, "circuit_breaker", CircuitBreaker())
+    return store
+
+
+class StubReplicate:
+    """Plays back one scripted prediction per call: (output URLs, error raised after them)"""
+
+    model = "stub/model"
+    model_version = ""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+
+    async def generate_images(self, prompt, num_outputs, seed=None, on_image=None, on_progress=None, on_prediction=None):
+        self.calls.append(num_outputs)
+        urls, error = self.script.pop(0)
+        for position, url in enumerate(urls[:num_outputs]):
+            await on_image(position, url)
+        if error is not None:
+            raise error
+        return urls[:num_outputs]
+
+    async def generate_image(self, prompt, seed=None, on_progress=None, on_prediction=None):
+        self.calls.append(("single", seed))
+        urls, error = self.script.pop(0) if self.script else ([f"https://img/seed-{seed}.png"], None)
+        if error is not None:
+            raise error
+        return urls[0]
+
+
+async def _run(store, monkeypatch, stub: StubReplicate, job: Job, indices) -> Job:
+    monkeypatch.setattr(runner, "replicate_client", stub)
+    await store.create_job(job)
+    processor = runner.ImageProcessor(max_retries=3, max_outputs_per_prediction=4)
+    await processor._process_images(job, list(indices))
+    return await store.get_job(job.id)
+
+
+def _outcomes(job: Job) -> list:
+    return [(result.status, result.url) for result in job.results]
+
+
+async def test_short_output_retries_only_the_missing_images(store, monkeypatch, no_sleep):
+    stub = StubReplicate(
+        (["https://img/a.png", "https://img/b.png"], None),
+        (["https://img/c.png", "https://img/d.png"], None),
+    )
+    job = await _run(store, monkeypatch, stub, Job(prompt="short", num_images=4, status=JobStatus.RUNNING), range(4))
+
+    assert stub.calls == [4, 2]
+    assert _outcomes(job) == [(ResultStatus.COMPLETED, f"https://img/{name}.png") for name in "abcd"]
+    # The first attempt is recorded by the runner when the item gets a slot
+    assert [result.attempts for result in job.results][2:] == [2, 2]
+
+
+async def test_failed_batch_keeps_its_delivered_images(store, monkeypatch, no_sleep):
+    stub = StubReplicate(
+        (["https://img/a.png"], TransientError("GPU fell over")),
+        (["https://img/b.png", "https://img/c.png"], None),
+    )
+    job = await _run(store, monkeypatch, stub, Job(prompt="flaky", num_images=3, status=JobStatus.RUNNING), range(3))
+
+    assert stub.calls == [3, 2]
+    assert _outcomes(job) == [(ResultStatus.COMPLETED, f"https://img/{name}.png") for name in "abc"]
+
+
+async def test_permanent_failure_fails_only_the_missing_images(store, monkeypatch, no_sleep):
+    stub = StubReplicate((["https://img/a.png"], PermanentError("NSFW content detected")))
+    job = await _run(store, monkeypatch, stub, Job(prompt="nope", num_images=3, status=JobStatus.RUNNING), range(3))
+
+    assert stub.calls == [3]
+    assert [result.status for result in job.results] == [
+        ResultStatus.COMPLETED, ResultStatus.FAILED, ResultStatus.FAILED,
+    ]
+    assert job.results[1].error == "NSFW content detected"
+
+
+async def test_batch_of_later_indices_maps_outputs_in_order(store, monkeypatch, no_sleep):
+    stub = StubReplicate((["https://img/x.png", "https://img/y.png"], None))
+    job = await _run(store, monkeypatch, stub, Job(prompt="tail", num_images=6, status=JobStatus.RUNNING), [4, 5])
+
+    assert _outcomes(job)[4:] == [
+        (ResultStatus.COMPLETED, "https://img/x.png"), (ResultStatus.COMPLETED, "https://img/y.png"),
+    ]
+    assert all(result.status == ResultStatus.RUNNING for result in job.results[:4])
+
+
+async def test_seeded_jobs_use_one_prediction_per_image(store, monkeypatch):
+    processor = runner.ImageProcessor(max_outputs_per_prediction=4)
+    assert processor.batch_size(Job(prompt="x", num_images=4)) == 4
+    assert processor.batch_size(Job(prompt="x", num_images=4, seed=7)) == 1
+
+    queued = runner.QueuedJobRunner(max_outputs_per_prediction=4)
+    assert queued._batches(Job(prompt="x", num_images=3, seed=7)) == [[0], [1], [2]]
+    assert queued._batches(Job(prompt="x", num_images=5)) == [[0, 1, 2, 3], [4]]
+
+    stub = StubReplicate()
+    job = await _run(store, monkeypatch, stub, Job(prompt="seeded", num_images=3, seed=7, status=JobStatus.RUNNING), [2])
+    assert stub.calls == [("single", 9)]
+    assert job.results[2].url == "https://img/seed-9.png"
+
+
+async def test_outputs_are_delivered_while_the_prediction_runs(no_sleep):
+    outputs = [[], ["https://img/a.png"], ["https://img/a.png", "https://img/b.png"]]
+    polls = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal polls
+        if request.method == "POST":
+            return httpx.Response(201, json={"id": "p1", "status": "starting"})
+        polls += 1
+        if polls <= len(outputs):
+            return httpx.Response(200, json={"id": "p1", "status": "processing", "output": outputs[polls - 1]})
+        # The model capped its outputs at three
+        final = ["https://img/a.png", "https://img/b.png", "https://img/c.png", "not a url"]
+        return httpx.Response(200, json={"id": "p1", "status": "succeeded", "output": final})
+
+    client = ReplicateClient()
+    client.api_token = "test-token"
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    delivered = []
+
+    async def on_image(position: int, url: str) -> None:
+        delivered.append((position, url, polls))
+
+    try:
+        urls = await client.generate_images("a cat", 4, on_image=on_image)
+    finally:
+        await client.close()
+
+    assert urls == ["https://img/a.png", "https://img/b.png", "https://img/c.png"]
+    assert delivered == [
+        (0, "https://img/a.png", 2),
+        (1, "https://img/b.png", 3),
+        (2, "https://img/c.png", 4),
+    ]
+
+
+async def test_cancel_during_create_cancels_the_prediction_it_made():
+    created = asyncio.Event()
+    release = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/cancel"):
+            assert request.url.path.endswith("/predictions/p1/cancel")
+            cancelled.set()
+            return httpx.Response(200, json={"id": "p1", "status": "canceled"})
+        created.set()
+        await release.wait()
+        return httpx.Response(201, json={"id": "p1", "status": "starting"})
+
+    client = ReplicateClient()
+    client.api_token = "test-token"
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    try:
+        task = asyncio.create_task(client.generate_images("a cat", 1))
+        await asyncio.wait_for(created.wait(), 1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # The create still lands upstream after the caller gave up
+        release.set()
+        await asyncio.wait_for(cancelled.wait(), 1)
+    finally:
+        await client.close()
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from app.cache import PromptCache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_identical_requests_share_one_generation():
+    cache = PromptCache()
+    calls = 0
+    release = asyncio.Event()
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "https://replicate.delivery/a.png"
+
+    waiters = [asyncio.create_task(cache.get_or_generate("k", generate)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == ["https://replicate.delivery/a.png"] * 5
+    assert calls == 1
+    assert (cache.misses, cache.coalesced) == (1, 4)
+
+    assert await cache.get_or_generate("k", generate) == "https://replicate.delivery/a.png"
+    assert calls == 1
+    assert cache.hits == 1
+
+
+async def test_failure_reaches_every_waiter_and_is_not_cached():
+    cache = PromptCache()
+    release = asyncio.Event()
+
+    async def generate():
+        await release.wait()
+        raise RuntimeError("upstream failed")
+
+    waiters = [asyncio.create_task(cache.get_or_generate("k", generate)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["in_flight"] == 0
+
+
+async def test_follower_retries_when_leader_is_cancelled():
+    cache = PromptCache()
+    calls = 0
+
+    async def generate():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return f"https://replicate.delivery/{calls}.png"
+
+    leader = asyncio.create_task(cache.get_or_generate("k", generate))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(cache.get_or_generate("k", generate))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    assert await asyncio.wait_for(follower, 1) == "https://replicate.delivery/2.png"
+    assert calls == 2
+
+
+async def test_bypass_skips_lookup_but_refreshes_entry():
+    cache = PromptCache()
+    cache.put("k", "https://replicate.delivery/old.png")
+
+    async def generate():
+        return "https://replicate.delivery/new.png"
+
+    assert await cache.get_or_generate("k", generate, bypass=True) == "https://replicate.delivery/new.png"
+    assert cache.get("k") == "https://replicate.delivery/new.png"
+
+
+def test_entries_expire_with_their_url():
+    cache = PromptCache(url_ttl_seconds=3600, min_remaining_seconds=300)
+    cache.put("soon", f"https://replicate.delivery/a.png?Expires={int(time.time()) + 60}")
+    cache.put("later", f"https://replicate.delivery/b.png?Expires={int(time.time()) + 3600}")
+
+    assert cache.get("soon") is None
+    assert cache.get("later") is not None
+    assert cache.expired == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PromptCache(max_entries=2)
+    cache.put("a", "https://replicate.delivery/a.png")
+    cache.put("b", "https://replicate.delivery/b.png")
+    cache.get("a")
+    cache.put("c", "https://replicate.delivery/c.png")
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.evictions == 1
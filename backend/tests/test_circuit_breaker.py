@@ -0,0 +1,77 @@
+import time
+
+from app.circuit_breaker import CircuitBreaker
+
+
+def _tripped() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4, open_seconds=30, half_open_trials=2)
+    for _ in range(4):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def _later(monkeypatch, seconds: float) -> None:
+    now = time.monotonic() + seconds
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+
+
+def test_stays_closed_below_min_calls_or_failure_rate():
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4)
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    for _ in range(5):
+        breaker.record_success()
+    # 4 failures out of 9 calls
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_open_rejects_until_timeout(monkeypatch):
+    breaker = _tripped()
+
+    assert not breaker.allow_request()
+    assert breaker.rejected == 1
+    assert breaker.times_opened == 1
+
+
+def test_half_open_trials_close_the_breaker(monkeypatch):
+    breaker = _tripped()
+    _later(monkeypatch, 31)
+
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    # Only half_open_trials calls go through at once
+    assert not breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_half_open_failure_reopens(monkeypatch):
+    breaker = _tripped()
+    _later(monkeypatch, 31)
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.times_opened == 2
+    assert not breaker.allow_request()
+
+
+def test_released_trial_frees_its_slot(monkeypatch):
+    breaker = _tripped()
+    _later(monkeypatch, 31)
+
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+    breaker.release()
+    assert breaker.allow_request()
@@ -0,0 +1,112 @@
+import hashlib
+import io
+
+import httpx
+import pytest
+from starlette.requests import Request
+
+from app import image_mirror as mirror_module
+from app.image_mirror import ImageMirror, image_response
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402
+
+pytestmark = pytest.mark.anyio
+
+
+def _png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+async def mirror(tmp_path, monkeypatch):
+    mirror = ImageMirror(str(tmp_path), max_bytes=10 * 1024 * 1024, thumbnail_size=16)
+    await mirror.start()
+    monkeypatch.setattr(mirror_module, "image_mirror", mirror)
+    yield mirror
+    await mirror.close()
+
+
+def _serve(mirror: ImageMirror, body: bytes) -> None:
+    mirror._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=body)))
+
+
+def _request(path: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": path, "headers": []})
+
+
+async def test_mirrors_image_with_thumbnail(mirror):
+    body = _png()
+    _serve(mirror, body)
+
+    digest = await mirror._download("https://replicate.test/out.png")
+
+    assert digest == hashlib.sha256(body).hexdigest()
+    response = await image_response(_request(f"/api/images/{digest}/thumbnail"), digest, thumbnail=True)
+    assert response.headers["ETag"] == f'"{digest}-thumb"'
+    assert response.media_type == "image/webp"
+
+
+@pytest.mark.parametrize("error", [Image.DecompressionBombError, ValueError, SyntaxError])
+async def test_undecodable_image_is_kept_without_thumbnail(mirror, monkeypatch, error):
+    _serve(mirror, _png())
+
+    def explode(image, path, *args, **kwargs):
+        # Fail halfway through writing the thumbnail
+        with open(path, "wb") as f:
+            f.write(b"RIFF")
+        raise error("bad image")
+
+    monkeypatch.setattr(Image.Image, "save", explode)
+
+    digest = await mirror._download("https://replicate.test/out.png")
+
+    assert not mirror.path(digest, thumbnail=True).exists()
+    assert not list((mirror.root / "tmp").iterdir())
+    response = await image_response(_request(f"/api/images/{digest}/thumbnail"), digest, thumbnail=True)
+    assert response.headers["ETag"] == f'"{digest}"'
+    assert response.media_type == "image/png"
+
+
+async def test_unknown_or_deleted_image_is_not_found(mirror):
+    body = _png()
+    _serve(mirror, body)
+    digest = await mirror._download("https://replicate.test/out.png")
+    mirror.path(digest).unlink()
+    mirror.path(digest, thumbnail=True).unlink()
+
+    assert await image_response(_request("/"), digest) is None
+    assert await image_response(_request("/"), "0" * 64) is None
+
+
+async def test_download_writes_off_the_event_loop(mirror, monkeypatch):
+    import threading
+
+    body = _png() * 4
+    _serve(mirror, body)
+    loop_thread = threading.get_ident()
+    writers = set()
+    real_open = open
+
+    class Recording:
+        def __init__(self, f):
+            self.f = f
+
+        def write(self, chunk):
+            writers.add(threading.get_ident())
+            return self.f.write(chunk)
+
+        def close(self):
+            self.f.close()
+
+    def recording_open(path, mode="r", *args, **kwargs):
+        f = real_open(path, mode, *args, **kwargs)
+        return Recording(f) if "w" in mode and "tmp" in str(path) else f
+
+    monkeypatch.setattr("builtins.open", recording_open)
+    digest = await mirror._download("https://replicate.test/out.png")
+
+    assert writers and loop_thread not in writers
+    assert mirror.path(digest).read_bytes() == body
@@ -0,0 +1,134 @@
+import asyncio
+import base64
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.models import Job, JobStatus, ResultStatus
+
+pytestmark = pytest.mark.anyio
+
+OWNER = "test@example.com"
+
+
+async def _create_jobs(store, count: int, owner: str = OWNER, created_at: datetime = None) -> list:
+    jobs = []
+    for i in range(count):
+        job = Job(prompt=f"job {i}", num_images=1, owner=owner, status=JobStatus.COMPLETED)
+        if created_at is not None:
+            job.created_at = created_at
+        jobs.append(job)
+    await store.create_jobs(jobs)
+    return jobs
+
+
+async def _pages(api, limit: int, cursor: str = None):
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    response = await api.get("/api/jobs", params=params)
+    assert response.status_code == 200
+    body = response.json()
+    return [job["id"] for job in body["jobs"]], body["next_cursor"]
+
+
+async def test_cursor_pages_are_stable_while_new_jobs_arrive(api, api_store):
+    # Half of the jobs share a timestamp, so ties are broken by id
+    same_time = datetime.utcnow() - timedelta(minutes=5)
+    older = await _create_jobs(api_store, 12, created_at=same_time)
+    newer = await _create_jobs(api_store, 13)
+    await _create_jobs(api_store, 3, owner="someone@else.com")
+
+    seen, cursor = await _pages(api, 10)
+    await _create_jobs(api_store, 5)
+    while cursor:
+        page, cursor = await _pages(api, 10, cursor)
+        seen += page
+
+    assert len(seen) == len(set(seen)) == 25
+    assert set(seen) == {job.id for job in older + newer}
+
+
+async def test_timezone_aware_cursor_is_rejected(api, api_store):
+    await _create_jobs(api_store, 3)
+    aware = datetime.now(timezone.utc).isoformat()
+    cursor = base64.urlsafe_b64encode(f"{aware}|some-id".encode()).decode().rstrip("=")
+
+    response = await api.get("/api/jobs", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", base64.urlsafe_b64encode(b"no separator").decode()])
+async def test_malformed_cursor_is_rejected(api, cursor):
+    response = await api.get("/api/jobs", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+async def _running_job(store, num_images: int = 3) -> Job:
+    job = Job(prompt="a cat", num_images=num_images, owner=OWNER, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    return job
+
+
+async def test_unchanged_job_answers_304(api, api_store):
+    job = await _running_job(api_store)
+
+    first = await api.get(f"/api/generate/{job.id}")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, no-cache"
+
+    again = await api.get(f"/api/generate/{job.id}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    assert again.content == b""
+
+    await api_store.update_result(job.id, 1, ResultStatus.COMPLETED, url="https://x/1.png")
+    changed = await api.get(f"/api/generate/{job.id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["progress"] == {"completed": 1, "failed": 0, "running": 2, "total": 3}
+
+
+async def test_long_poll_wakes_on_change(api, api_store):
+    job = await _running_job(api_store)
+    version = (await api.get(f"/api/generate/{job.id}")).json()["version"]
+
+    async def finish_later():
+        await asyncio.sleep(0.1)
+        await api_store.update_result(job.id, 2, ResultStatus.COMPLETED, url="https://x/2.png")
+
+    updater = asyncio.create_task(finish_later())
+    started = time.monotonic()
+    response = await api.get(f"/api/generate/{job.id}", params={"wait": 5, "since_version": version})
+    await updater
+
+    assert time.monotonic() - started < 2
+    body = response.json()
+    assert response.headers["Cache-Control"] == "no-store"
+    assert body["version"] > version
+    assert [(result["index"], result["status"]) for result in body["results"]] == [(2, "completed")]
+
+
+async def test_long_poll_times_out_with_nothing_new(api, api_store):
+    job = await _running_job(api_store)
+    version = (await api.get(f"/api/generate/{job.id}")).json()["version"]
+
+    started = time.monotonic()
+    response = await api.get(f"/api/generate/{job.id}", params={"wait": 0.2, "since_version": version})
+
+    assert 0.15 < time.monotonic() - started < 2
+    assert response.json()["version"] == version
+    assert response.json()["results"] == []
+
+
+async def test_long_poll_returns_at_once_when_behind(api, api_store):
+    job = await _running_job(api_store)
+    await api_store.update_result(job.id, 0, ResultStatus.FAILED, error="boom")
+
+    started = time.monotonic()
+    response = await api.get(f"/api/generate/{job.id}", params={"wait": 5, "since_version": 0})
+
+    assert time.monotonic() - started < 1
+    assert [result["index"] for result in response.json()["results"]] == [0]
@@ -0,0 +1,107 @@
+import time
+
+import httpx
+import pytest
+
+from app import replicate_client as replicate_module
+from app.limiter import AdaptiveLimiter, parse_retry_after
+from app.replicate_client import ReplicateClient
+
+
+def _limiter(**kwargs) -> AdaptiveLimiter:
+    options = {"initial": 4, "min_limit": 1, "max_limit": 10, "cooldown": 0}
+    options.update(kwargs)
+    return AdaptiveLimiter(**options)
+
+
+def test_grows_about_one_slot_per_round_of_healthy_responses():
+    limiter = _limiter()
+    for _ in range(5):
+        limiter.record_response("POST", 201, 0.1)
+    assert limiter.limit == 5
+
+    for _ in range(200):
+        limiter.record_response("POST", 201, 0.1)
+    assert limiter.limit == 10
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_overload_responses_cut_the_limit(status):
+    limiter = _limiter(initial=8)
+    limiter.record_response("POST", status, 0.1)
+    assert limiter.limit == 4
+    assert limiter.history[-1]["reason"] == f"http {status}"
+
+
+def test_never_drops_below_the_minimum():
+    limiter = _limiter(initial=2, min_limit=2)
+    limiter.record_error("ConnectTimeout")
+    assert limiter.limit == 2
+
+
+def test_client_errors_are_ignored():
+    limiter = _limiter()
+    limiter.record_response("POST", 422, 0.1)
+    assert limiter._limit == 4
+
+
+def test_latency_spike_cuts_the_limit():
+    limiter = _limiter(initial=8, latency_spike_factor=3)
+    limiter.record_response("POST", 201, 0.1)
+    limiter.record_response("POST", 201, 1.0)
+    assert limiter.limit == 4
+
+
+def test_cooldown_counts_a_burst_of_errors_once():
+    limiter = _limiter(initial=8, cooldown=60)
+    for _ in range(5):
+        limiter.record_error("ReadTimeout")
+    assert limiter.limit == 4
+
+
+def test_retry_after_pauses_new_work():
+    limiter = _limiter()
+    limiter.record_response("POST", 429, 0.1, retry_after="2")
+    assert 1.5 < limiter.blocked_for() <= 2
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    http_date = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))
+    assert 25 < parse_retry_after(http_date) <= 30
+
+
+def test_disabled_limiter_stays_fixed():
+    limiter = _limiter(enabled=False)
+    limiter.record_response("POST", 201, 0.1)
+    limiter.record_response("POST", 503, 0.1)
+    assert limiter.limit == 4
+
+
+@pytest.mark.anyio
+async def test_only_failed_status_polls_reach_the_limiter(monkeypatch):
+    limiter = _limiter(initial=4)
+    monkeypatch.setattr(replicate_module, "concurrency_limiter", limiter)
+    statuses = iter([200] * 50 + [503])
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(next(statuses), json={"status": "processing"})
+
+    client = ReplicateClient()
+    client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    try:
+        for _ in range(50):
+            await client._request("GET", "https://replicate.test/v1/predictions/p1")
+        assert limiter._limit == 4
+
+        await client._request("GET", "https://replicate.test/v1/predictions/p1")
+        assert limiter.limit == 2
+    finally:
+        await client.close()
+
+
+def test_keepalive_pool_covers_the_limiter_ceiling():
+    client = ReplicateClient()
+    assert client.limits.max_keepalive_connections == client.limits.max_connections
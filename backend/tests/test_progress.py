@@ -0,0 +1,123 @@
+import pytest
+
+from app import runner
+from app.cache import PromptCache
+from app.circuit_breaker import CircuitBreaker
+from app.models import Job, JobStatus, ResultStatus
+from app.replicate_client import ReplicateClient
+from app.store import InMemoryJobStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("logs, percent", [
+    (None, None),
+    ("Loading weights", None),
+    (" 10%|█         | 5/50 [00:01<00:09]\n 46%|████▌     | 23/50 [00:02<00:02]", 46),
+    ("step 12/48 [00:03<00:09]", 25),
+    ("100%|██████████| 50/50 [00:05<00:00]\nsaving", 100),
+    ("0/0 [00:00]", None),
+])
+def test_parse_progress(logs, percent):
+    assert ReplicateClient()._parse_progress(logs) == percent
+
+
+def test_progress_is_throttled_to_the_step():
+    processor = runner.ImageProcessor(progress_step=10)
+    processing = ResultStatus.PROCESSING
+
+    assert processor._progress_changed(None, (processing, 3, None))
+    assert not processor._progress_changed((processing, 3, None), (processing, 12, None))
+    assert processor._progress_changed((processing, 3, None), (processing, 13, None))
+    assert processor._progress_changed((processing, 95, None), (processing, 100, None))
+    assert not processor._progress_changed((processing, 40, None), (processing, None, None))
+    # A new status or preview always goes out
+    assert processor._progress_changed((ResultStatus.STARTING, None, None), (processing, None, None))
+    assert processor._progress_changed((processing, 40, None), (processing, 41, "https://img/preview.png"))
+
+
+class ProgressingReplicate:
+    model = "stub/model"
+    model_version = ""
+
+    def __init__(self, updates):
+        self.updates = updates
+
+    async def generate_image(self, prompt, seed=None, on_progress=None, on_prediction=None):
+        for update in self.updates:
+            await on_progress(*update)
+        return "https://img/final.png"
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemoryJobStore()
+    monkeypatch.setattr(runner, "job_store", store)
+    monkeypatch.setattr(runner, "prompt_cache", PromptCache())
+    monkeypatch.setattr(runner, "circuit_breaker", CircuitBreaker())
+    return store
+
+
+async def test_result_moves_from_running_to_starting_to_processing(store, monkeypatch):
+    monkeypatch.setattr(runner, "replicate_client", ProgressingReplicate([
+        ("starting", None, None),
+        ("processing", 5, None),
+        ("processing", 9, None),
+        ("processing", 30, "https://img/preview.png"),
+        ("processing", 35, "https://img/preview.png"),
+        ("processing", 60, "https://img/preview.png"),
+    ]))
+    job = Job(prompt="a cat", num_images=1, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    events = store.subscribe(job.id)
+
+    await runner.ImageProcessor(progress_step=10)._process_images(job, [0])
+
+    published = []
+    while not events.empty():
+        data = events.get_nowait().data
+        published.append((data["status"], data["progress"], data["url"]))
+    assert published == [
+        (ResultStatus.STARTING, None, None),
+        (ResultStatus.PROCESSING, 5, None),
+        (ResultStatus.PROCESSING, 30, "https://img/preview.png"),
+        (ResultStatus.PROCESSING, 60, "https://img/preview.png"),
+        (ResultStatus.COMPLETED, 100, "https://img/final.png"),
+    ]
+
+
+@pytest.mark.parametrize("final", [ResultStatus.COMPLETED, ResultStatus.FAILED, ResultStatus.CANCELLED])
+async def test_finished_result_never_goes_back_to_an_intermediate_state(final):
+    store = InMemoryJobStore()
+    job = Job(prompt="a cat", num_images=2, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    await store.update_result(job.id, 0, final, url="https://img/0.png" if final == ResultStatus.COMPLETED else None)
+    version = (await store.get_job(job.id)).version
+    events = store.subscribe(job.id)
+
+    # A late poll that was in flight when the result finished
+    await store.update_result(job.id, 0, ResultStatus.PROCESSING, progress=80)
+    await store.update_result(job.id, 0, ResultStatus.STARTING)
+
+    job = await store.get_job(job.id)
+    assert job.results[0].status == final
+    assert job.version == version
+    assert events.empty()
+    counts = {
+        ResultStatus.COMPLETED: job.completed_count,
+        ResultStatus.FAILED: job.failed_count,
+        ResultStatus.CANCELLED: job.cancelled_count,
+    }
+    assert counts[final] == 1
+    assert job.running_count == 1
+
+
+async def test_finished_result_can_still_change_its_final_state():
+    store = InMemoryJobStore()
+    job = Job(prompt="a cat", num_images=1, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    await store.update_result(job.id, 0, ResultStatus.FAILED, error="boom")
+    await store.update_result(job.id, 0, ResultStatus.COMPLETED, url="https://img/0.png")
+
+    job = await store.get_job(job.id)
+    assert (job.results[0].status, job.completed_count, job.failed_count) == (ResultStatus.COMPLETED, 1, 0)
@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app import runner
+from app.models import Job, JobStatus, ResultStatus
+from app.store import SQLiteJobStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def stores(tmp_path):
+    """Two SQLite stores on one database, like two API processes"""
+    path = str(tmp_path / "jobs.db")
+    first, second = SQLiteJobStore(path), SQLiteJobStore(path)
+    await first.start()
+    await second.start()
+    yield first, second
+    await first.close()
+    await second.close()
+
+
+async def test_cancel_job_not_in_cache(stores, monkeypatch):
+    first, second = stores
+    job = Job(prompt="a cat", num_images=5, status=JobStatus.RUNNING)
+    await first.create_job(job)
+    await first.update_result(job.id, 0, ResultStatus.COMPLETED, url="https://example.com/0.png")
+
+    # The second process has never seen the job
+    monkeypatch.setattr(runner, "job_store", second)
+    await asyncio.wait_for(runner._close_job(job.id, datetime.utcnow(), None, cancelled=True), timeout=5)
+
+    cached = await second.get_job(job.id)
+    assert cached.status == JobStatus.CANCELLED
+    assert [r.status for r in cached.results] == [ResultStatus.COMPLETED] + [ResultStatus.CANCELLED] * 4
+    assert (cached.completed_count, cached.cancelled_count) == (1, 4)
+
+    third = SQLiteJobStore(second.path)
+    reloaded = await third.get_job(job.id)
+    await third.close()
+    assert reloaded.status == JobStatus.CANCELLED
+    assert reloaded.cancelled_count == 4
+
+
+async def test_close_job_leaves_finished_job_alone(stores, monkeypatch):
+    first, _ = stores
+    job = Job(prompt="a cat", num_images=5, status=JobStatus.COMPLETED)
+    await first.create_job(job)
+
+    monkeypatch.setattr(runner, "job_store", first)
+    await asyncio.wait_for(runner._close_job(job.id, datetime.utcnow(), None, cancelled=True), timeout=5)
+
+    assert (await first.get_job(job.id)).status == JobStatus.COMPLETED
@@ -0,0 +1,83 @@
+from collections import Counter
+
+from app.models import Priority
+from app.scheduler import FairScheduler
+
+
+def _drain(scheduler: FairScheduler, count: int) -> list:
+    items = []
+    for _ in range(count):
+        item = scheduler.next_item()
+        if item is None:
+            break
+        items.append(item)
+        scheduler.release(item)
+    return items
+
+
+def test_users_take_turns_regardless_of_queue_length():
+    scheduler = FairScheduler()
+    scheduler.enqueue_job("big", "alice", Priority.NORMAL, range(20))
+    scheduler.enqueue_job("small", "bob", Priority.NORMAL, range(3))
+
+    first = [item.user for item in _drain(scheduler, 6)]
+
+    assert Counter(first) == {"alice": 3, "bob": 3}
+    assert [item.user for item in _drain(scheduler, 20)] == ["alice"] * 17
+
+
+def test_jobs_of_one_user_share_by_priority_weight():
+    scheduler = FairScheduler()
+    scheduler.enqueue_job("low", "alice", Priority.LOW, range(10))
+    scheduler.enqueue_job("high", "alice", Priority.HIGH, range(10))
+
+    first = Counter(item.job_id for item in _drain(scheduler, 10))
+
+    assert first == {"high": 8, "low": 2}
+
+
+def test_late_user_joins_at_current_virtual_time():
+    scheduler = FairScheduler()
+    scheduler.enqueue_job("a", "alice", Priority.NORMAL, range(10))
+    _drain(scheduler, 6)
+    scheduler.enqueue_job("b", "bob", Priority.NORMAL, range(10))
+
+    # No banked credit for the time bob was idle
+    assert Counter(item.user for item in _drain(scheduler, 4)) == {"alice": 2, "bob": 2}
+
+
+def test_per_user_cap_skips_busy_users():
+    scheduler = FairScheduler(max_per_user=2)
+    scheduler.enqueue_job("a", "alice", Priority.NORMAL, range(5))
+    scheduler.enqueue_job("b", "bob", Priority.NORMAL, range(1))
+
+    held = [scheduler.next_item() for _ in range(3)]
+    assert Counter(item.user for item in held) == {"alice": 2, "bob": 1}
+    # Alice is at her cap and Bob has nothing left
+    assert scheduler.next_item() is None
+
+    scheduler.release(held[0])
+    assert scheduler.next_item().user == "alice"
+    assert scheduler.stats()["users"]["alice"]["in_flight"] == 2
+
+
+def test_batches_and_removal():
+    scheduler = FairScheduler()
+    scheduler.enqueue_job("a", "alice", Priority.NORMAL, range(5), batch_size=2)
+    assert scheduler.queued == 3
+
+    item = scheduler.next_item()
+    assert item.indices == [0, 1]
+    removed = scheduler.remove_job("a", "alice")
+    assert [item.indices for item in removed] == [[2, 3], [4]]
+    assert scheduler.queued == 0
+    assert scheduler.next_item() is None
+
+
+def test_high_priority_does_not_buy_a_bigger_share_against_other_users():
+    scheduler = FairScheduler()
+    for job in range(3):
+        scheduler.enqueue_job(f"alice-{job}", "alice", Priority.HIGH, range(10))
+    scheduler.enqueue_job("bob", "bob", Priority.NORMAL, range(10))
+
+    assert Counter(item.user for item in _drain(scheduler, 10)) == {"alice": 5, "bob": 5}
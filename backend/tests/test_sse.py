@@ -0,0 +1,116 @@
+import asyncio
+import json
+
+import pytest
+
+from app import sse
+from app.models import Job, JobStatus, ResultStatus
+from app.store import SQLiteJobStore
+
+pytestmark = pytest.mark.anyio
+
+
+async def _collect(stream) -> list:
+    frames = []
+    async for frame in stream:
+        frames.append(frame.decode())
+    return frames
+
+
+@pytest.fixture
+async def store(tmp_path, monkeypatch):
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    await store.start()
+    monkeypatch.setattr(sse, "job_store", store)
+    yield store
+    await store.close()
+
+
+async def _finished_job(store) -> Job:
+    job = Job(prompt="a cat", num_images=5, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    for index in range(5):
+        await store.update_result(job.id, index, ResultStatus.COMPLETED, url=f"https://example.com/{index}.png")
+    job.status = JobStatus.COMPLETED
+    await store.update_job(job)
+    return job
+
+
+async def test_evicted_finished_job_gets_snapshot_and_done(store):
+    job = await _finished_job(store)
+    store._evict(job.id, "expired")
+
+    frames = await asyncio.wait_for(_collect(sse.job_progress_stream(job.id)), timeout=5)
+
+    events = [line for frame in frames for line in frame.split("\n") if line.startswith("event: ")]
+    assert events == ["event: progress"] * 5 + ["event: done"]
+
+
+async def test_new_client_gets_snapshot_of_cached_job(store):
+    job = await _finished_job(store)
+
+    frames = await asyncio.wait_for(_collect(sse.job_progress_stream(job.id)), timeout=5)
+
+    assert frames[-1].startswith("id: 6\nevent: done")
+    assert sum("event: progress" in frame for frame in frames) == 5
+
+
+async def test_resume_after_done_ends_immediately(store):
+    job = await _finished_job(store)
+
+    frames = await asyncio.wait_for(_collect(sse.job_progress_stream(job.id, last_event_id=6)), timeout=5)
+
+    assert len(frames) == 1 and "event: done" in frames[0]
+
+
+async def test_resume_replays_only_missed_events(store):
+    job = await _finished_job(store)
+
+    frames = await asyncio.wait_for(_collect(sse.job_progress_stream(job.id, last_event_id=3)), timeout=5)
+
+    assert [frame.split("\n")[0] for frame in frames] == ["id: 4", "id: 5", "id: 6"]
+
+
+def _last_event_id(frames: list, previous=None):
+    for frame in frames:
+        if frame.startswith("id: "):
+            previous = int(frame.split("\n", 1)[0][4:])
+    return previous
+
+
+async def test_client_cut_off_mid_snapshot_gets_it_again(store):
+    job = await _finished_job(store)
+    store._evict(job.id, "expired")
+
+    stream = sse.job_progress_stream(job.id)
+    received = [(await stream.__anext__()).decode() for _ in range(3)]
+    await stream.aclose()
+    assert _last_event_id(received) is None
+
+    # EventSource reconnects without a Last-Event-ID, since none was set
+    frames = await asyncio.wait_for(_collect(sse.job_progress_stream(job.id, _last_event_id(received))), timeout=5)
+
+    indices = {json.loads(frame.split("data: ", 1)[1])["index"] for frame in frames if "event: progress" in frame}
+    assert indices == set(range(5))
+    assert "event: done" in frames[-1]
+
+
+async def test_running_job_snapshot_resumes_from_its_last_event(store):
+    job = Job(prompt="a cat", num_images=3, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    await store.update_result(job.id, 0, ResultStatus.COMPLETED, url="https://example.com/0.png")
+    await store.update_result(job.id, 1, ResultStatus.PROCESSING, progress=40)
+    store._event_logs.pop(job.id)
+
+    stream = sse.job_progress_stream(job.id)
+    first = (await stream.__anext__()).decode()
+    second = (await stream.__anext__()).decode()
+    await stream.aclose()
+    assert not first.startswith("id:")
+    assert second.startswith(f"id: {store.last_seq(job.id)}\n")
+
+    await store.update_result(job.id, 2, ResultStatus.COMPLETED, url="https://example.com/2.png")
+    resumed = sse.job_progress_stream(job.id, _last_event_id([first, second]))
+    frame = (await asyncio.wait_for(resumed.__anext__(), timeout=5)).decode()
+    await resumed.aclose()
+    assert '"index": 2' in frame
@@ -0,0 +1,197 @@
+import asyncio
+import time
+
+import pytest
+
+from app.models import Job, JobStatus, ResultStatus
+from app.store import InMemoryJobStore, SQLiteJobStore
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def store(tmp_path):
+    # A long window makes any needless wait obvious
+    store = SQLiteJobStore(str(tmp_path / "jobs.db"), batch_window_ms=500)
+    await store.start()
+    yield store
+    await store.close()
+
+
+def _count_commits(store, monkeypatch) -> list:
+    batches = []
+    commit = store._commit
+
+    def counting_commit(statements):
+        batches.append(len(statements))
+        commit(statements)
+
+    monkeypatch.setattr(store, "_commit", counting_commit)
+    return batches
+
+
+async def test_lone_write_commits_without_waiting(store, monkeypatch):
+    batches = _count_commits(store, monkeypatch)
+
+    started = time.monotonic()
+    await store.create_job(Job(prompt="a cat", num_images=1))
+
+    assert time.monotonic() - started < 0.25
+    assert len(batches) == 1
+
+
+async def test_concurrent_writes_share_a_transaction(store, monkeypatch, tmp_path):
+    batches = _count_commits(store, monkeypatch)
+
+    jobs = [Job(prompt=f"cat {i}", num_images=1, status=JobStatus.RUNNING) for i in range(10)]
+    await asyncio.gather(*(store.create_job(job) for job in jobs))
+
+    assert len(batches) == 1
+    reader = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    await reader.start()
+    try:
+        for job in jobs:
+            assert (await reader.get_job(job.id)).prompt == job.prompt
+    finally:
+        await reader.close()
+
+
+async def test_a_held_job_lock_only_blocks_its_own_job():
+    store = InMemoryJobStore()
+    busy = Job(prompt="busy", num_images=1, status=JobStatus.RUNNING)
+    other = Job(prompt="other", num_images=1, status=JobStatus.RUNNING)
+    await store.create_job(busy)
+    await store.create_job(other)
+
+    async with store.job_lock(busy.id):
+        # Reads and writes of other jobs never wait on it, nor do reads of the locked job
+        await asyncio.wait_for(store.update_result(other.id, 0, ResultStatus.COMPLETED, url="https://x/1.png"), 1)
+        assert (await asyncio.wait_for(store.get_job(busy.id), 1)).status == JobStatus.RUNNING
+
+        waiting = asyncio.create_task(store.job_lock(busy.id).acquire())
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+    await asyncio.wait_for(waiting, 1)
+    store.job_lock(busy.id).release()
+
+
+async def test_concurrent_writers_load_an_uncached_job_once(store, tmp_path):
+    job = Job(prompt="a cat", num_images=5, status=JobStatus.RUNNING)
+    await store.create_job(job)
+
+    other = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    await other.start()
+    try:
+        await asyncio.gather(*(
+            other.update_result(job.id, index, ResultStatus.COMPLETED, url=f"https://x/{index}.png")
+            for index in range(5)
+        ))
+        assert (await other.get_job(job.id)).completed_count == 5
+    finally:
+        await other.close()
+
+    reloaded = SQLiteJobStore(str(tmp_path / "jobs.db"))
+    await reloaded.start()
+    try:
+        saved = await reloaded.get_job(job.id)
+        assert [result.status for result in saved.results] == [ResultStatus.COMPLETED] * 5
+    finally:
+        await reloaded.close()
+
+
+async def _finished(store, prompt: str = "a cat") -> Job:
+    job = Job(prompt=prompt, num_images=1, status=JobStatus.RUNNING)
+    await store.create_job(job)
+    await store.update_result(job.id, 0, ResultStatus.COMPLETED, url="https://x/0.png")
+    job.status = JobStatus.COMPLETED
+    await store.update_job(job)
+    return job
+
+
+def _retaining(**limits) -> InMemoryJobStore:
+    store = InMemoryJobStore()
+    store.retention_seconds = limits.get("retention_seconds", 0)
+    store.max_finished_jobs = limits.get("max_finished_jobs", 0)
+    store.max_finished_bytes = limits.get("max_finished_bytes", 0)
+    return store
+
+
+async def test_oldest_finished_jobs_are_evicted_past_max_finished():
+    store = _retaining(max_finished_jobs=2)
+    first, second, third = [await _finished(store) for _ in range(3)]
+
+    assert await store.get_job(first.id) is None
+    assert await store.get_job(second.id) is not None
+    assert await store.get_job(third.id) is not None
+    assert store.stats()["evictions"]["max_jobs"] == 1
+
+
+async def test_reading_a_job_makes_it_recently_used():
+    store = _retaining(max_finished_jobs=2)
+    first = await _finished(store)
+    second = await _finished(store)
+    await store.get_job(first.id)
+    await _finished(store)
+
+    assert await store.get_job(first.id) is not None
+    assert await store.get_job(second.id) is None
+
+
+async def test_finished_jobs_are_evicted_past_max_bytes():
+    store = _retaining()
+    await _finished(store)
+    one_job = store.stats()["finished_bytes"]
+
+    store = _retaining(max_finished_bytes=int(one_job * 2.5))
+    jobs = [await _finished(store) for _ in range(4)]
+
+    assert [await store.get_job(job.id) is not None for job in jobs] == [False, False, True, True]
+    assert store.stats()["evictions"]["max_bytes"] == 2
+    assert store.stats()["finished_bytes"] <= one_job * 2.5
+
+
+async def test_sweep_evicts_jobs_past_the_retention_age(monkeypatch):
+    store = _retaining(retention_seconds=60)
+    old = await _finished(store)
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 30)
+    recent = await _finished(store)
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    await store.sweep()
+
+    assert await store.get_job(old.id) is None
+    assert await store.get_job(recent.id) is not None
+    assert store.stats()["evictions"]["expired"] == 1
+
+
+async def test_running_jobs_are_never_evicted(monkeypatch):
+    store = _retaining(retention_seconds=1, max_finished_jobs=1, max_finished_bytes=1)
+    running = [Job(prompt="busy", num_images=1, status=JobStatus.RUNNING) for _ in range(3)]
+    for job in running:
+        await store.create_job(job)
+    await _finished(store)
+    await _finished(store)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 3600)
+    await store.sweep()
+
+    for job in running:
+        assert await store.get_job(job.id) is not None
+    assert store.stats()["running_jobs"] == 3
+    assert store.stats()["finished_jobs"] == 0
+
+
+async def test_store_stats_endpoint_reports_retention(api, api_store):
+    api_store.max_finished_jobs = 1
+    await _finished(api_store)
+    await _finished(api_store)
+    await api_store.create_job(Job(prompt="busy", num_images=1, status=JobStatus.RUNNING))
+
+    stats = (await api.get("/api/stats/store")).json()
+
+    assert (stats["jobs"], stats["running_jobs"], stats["finished_jobs"]) == (2, 1, 1)
+    assert stats["evictions"]["max_jobs"] == 1
+    assert stats["limits"]["max_finished_jobs"] == 1
+    assert stats["finished_bytes"] > 0
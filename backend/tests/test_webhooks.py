@@ -0,0 +1,93 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+
+import httpx
+import pytest
+
+from app import main
+from app.webhooks import WebhookRegistry
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "whsec_" + base64.b64encode(b"test-signing-key").decode()
+
+
+def _signed_headers(body: bytes, timestamp: int = None, webhook_id: str = "msg_1") -> dict:
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+    signature = base64.b64encode(
+        hmac.new(b"test-signing-key", signed_content, hashlib.sha256).digest()
+    ).decode()
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": str(timestamp),
+        "webhook-signature": f"v1,bogus v1,{signature}",
+    }
+
+
+def test_signature_verification():
+    registry = WebhookRegistry(secret=SECRET)
+    body = b'{"id": "p1", "status": "succeeded"}'
+
+    assert registry.verify_signature(_signed_headers(body), body)
+    assert not registry.verify_signature(_signed_headers(body), body + b" ")
+    assert not registry.verify_signature(_signed_headers(body, timestamp=int(time.time()) - 3600), body)
+    assert not registry.verify_signature({}, body)
+    assert not WebhookRegistry().verify_signature(_signed_headers(body), body)
+
+
+async def test_callback_resolves_waiter():
+    registry = WebhookRegistry(secret=SECRET)
+    future = registry.register("p1")
+
+    assert not registry.resolve({"id": "p1", "status": "processing"})
+    assert registry.resolve({"id": "p1", "status": "succeeded", "output": ["x.png"]})
+    assert (await asyncio.wait_for(future, 1))["output"] == ["x.png"]
+
+
+async def test_early_callbacks_expire():
+    registry = WebhookRegistry(secret=SECRET, early_ttl_seconds=0.05)
+    registry.resolve({"id": "p1", "status": "succeeded"})
+    assert (await registry.register("p1"))["status"] == "succeeded"
+
+    registry.resolve({"id": "p2", "status": "failed"})
+    await asyncio.sleep(0.1)
+    registry.resolve({"id": "p3", "status": "failed"})
+    assert list(registry._early) == ["p3"]
+    assert not registry.register("p2").done()
+
+
+@pytest.fixture
+async def client(monkeypatch):
+    monkeypatch.setattr(main, "webhook_registry", WebhookRegistry(secret=SECRET))
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+async def test_endpoint_wakes_waiting_prediction(client):
+    future = main.webhook_registry.register("p1")
+    body = json.dumps({"id": "p1", "status": "succeeded", "output": ["x.png"]}).encode()
+
+    response = await client.post("/api/webhooks/replicate", content=body, headers=_signed_headers(body))
+
+    assert response.status_code == 200
+    assert (await asyncio.wait_for(future, 1))["status"] == "succeeded"
+
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b'"text"', b"not json"])
+async def test_endpoint_rejects_payloads_that_are_not_objects(client, body):
+    response = await client.post("/api/webhooks/replicate", content=body, headers=_signed_headers(body))
+    assert response.status_code == 400
+
+
+async def test_endpoint_rejects_bad_signature(client):
+    body = b'{"id": "p1", "status": "succeeded"}'
+    headers = _signed_headers(body)
+    headers["webhook-signature"] = "v1,bogus"
+    response = await client.post("/api/webhooks/replicate", content=body, headers=headers)
+    assert response.status_code == 401
@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+from app.models import FINISHED_RESULT_STATUSES, ResultStatus
+from app.websocket import WebSocketConnection, WebSocketManager, _Close
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int, reason: str):
+        self.closed = (code, reason)
+
+
+def _viewer(manager: WebSocketManager, job_id: str) -> WebSocketConnection:
+    connection = WebSocketConnection(FakeWebSocket())
+    manager.active_connections.setdefault(job_id, set()).add(connection)
+    connection.jobs.add(job_id)
+    return connection
+
+
+def _progress(manager: WebSocketManager, job_id: str, index: int, status: ResultStatus, progress: int = None):
+    data = {"index": index, "status": status, "progress": progress}
+    manager.send_to_job_connections(
+        job_id,
+        {"type": "progress", "job_id": job_id, "payload": data},
+        key=index,
+        droppable=status not in FINISHED_RESULT_STATUSES,
+    )
+
+
+async def _drain(connection: WebSocketConnection) -> list:
+    connection.put(_Close(1000, "test over"))
+    await connection.send_loop()
+    return connection.websocket.sent
+
+
+async def test_queued_frames_coalesce_per_result():
+    manager = WebSocketManager(send_queue_size=8)
+    connection = _viewer(manager, "job")
+
+    for percent in range(0, 100, 10):
+        _progress(manager, "job", 0, ResultStatus.PROCESSING, percent)
+    _progress(manager, "job", 1, ResultStatus.PROCESSING, 5)
+    _progress(manager, "job", 0, ResultStatus.COMPLETED)
+
+    sent = await _drain(connection)
+    assert [(f["payload"]["index"], f["payload"]["status"]) for f in sent] == [(0, "completed"), (1, "processing")]
+    assert connection.dropped == 0
+
+
+async def test_full_queue_drops_unfinished_frames_but_keeps_terminal_and_done():
+    manager = WebSocketManager(send_queue_size=3, slow_consumer_policy="drop_oldest")
+    connection = _viewer(manager, "job")
+
+    _progress(manager, "job", 0, ResultStatus.COMPLETED)
+    _progress(manager, "job", 1, ResultStatus.FAILED)
+    _progress(manager, "job", 2, ResultStatus.PROCESSING, 50)
+    _progress(manager, "job", 3, ResultStatus.PROCESSING, 10)
+    _progress(manager, "job", 4, ResultStatus.COMPLETED)
+    manager.send_to_job_connections("job", {"type": "done", "job_id": "job"}, key="done")
+
+    sent = await _drain(connection)
+    assert [f["payload"]["index"] for f in sent if f["type"] == "progress"] == [0, 1, 4]
+    assert sent[-1]["type"] == "done"
+    assert connection.dropped == 2
+
+
+async def test_disconnect_policy_closes_slow_viewer():
+    manager = WebSocketManager(send_queue_size=2, slow_consumer_policy="disconnect")
+    connection = _viewer(manager, "job")
+
+    for index in range(3):
+        _progress(manager, "job", index, ResultStatus.PROCESSING, 1)
+
+    await connection.send_loop()
+    assert connection.websocket.sent == []
+    assert connection.websocket.closed == (1013, "Slow consumer")
+
+
+@pytest.fixture
+def ws_app(monkeypatch):
+    from starlette.testclient import TestClient
+
+    from app import main, websocket
+    from app.config import config
+    from app.store import InMemoryJobStore
+
+    store = InMemoryJobStore()
+    monkeypatch.setattr(main, "job_store", store)
+    monkeypatch.setattr(websocket, "job_store", store)
+    monkeypatch.setattr(config, "WS_MAX_SUBSCRIPTIONS", 2)
+    token, _ = main.auth_service.create_access_token(main.auth_service.demo_email)
+    with TestClient(main.app) as client:
+        yield client, store, token
+
+
+def _running_jobs(client, store, count: int) -> list:
+    from app.models import Job, JobStatus
+
+    jobs = [Job(prompt=f"job {i}", num_images=2, status=JobStatus.RUNNING) for i in range(count)]
+    for job in jobs:
+        client.portal.call(store.create_job, job)
+    return jobs
+
+
+def _finish(client, store, job):
+    from app.models import JobStatus
+
+    async def finish():
+        job.status = JobStatus.COMPLETED
+        await store.update_job(job)
+
+    client.portal.call(finish)
+
+
+def test_multiplexed_socket_follows_jobs_until_they_finish(ws_app):
+    client, store, token = ws_app
+    first, second, third = _running_jobs(client, store, 3)
+
+    with client.websocket_connect(f"/api/ws?token={token}") as ws:
+        ws.send_json({"action": "subscribe", "job_ids": [first.id, second.id, third.id]})
+        assert ws.receive_json() == {
+            "type": "error", "job_id": third.id, "error": "Subscription limit of 2 reached",
+        }
+        assert ws.receive_json() == {"type": "subscribed", "job_ids": [first.id, second.id]}
+
+        client.portal.call(store.update_result, first.id, 1, ResultStatus.COMPLETED, None, None, None)
+        frame = ws.receive_json()
+        assert (frame["type"], frame["job_id"], frame["payload"]["index"]) == ("progress", first.id, 1)
+
+        _finish(client, store, first)
+        frame = ws.receive_json()
+        assert (frame["type"], frame["job_id"]) == ("done", first.id)
+
+        # The socket stays open, and the finished job no longer counts toward the limit
+        ws.send_json({"action": "subscribe", "job_ids": [third.id]})
+        assert ws.receive_json() == {"type": "subscribed", "job_ids": [third.id]}
+
+        ws.send_json({"action": "unsubscribe", "job_ids": [second.id]})
+        assert ws.receive_json() == {"type": "unsubscribed", "job_ids": [second.id]}
+        client.portal.call(store.update_result, second.id, 0, ResultStatus.FAILED, None, "boom", None)
+        client.portal.call(store.update_result, third.id, 0, ResultStatus.PROCESSING, None, None, 50)
+        frame = ws.receive_json()
+        assert (frame["job_id"], frame["payload"]["progress"]) == (third.id, 50)
+
+
+def test_multiplexed_socket_rejects_bad_messages(ws_app):
+    client, store, token = ws_app
+
+    with client.websocket_connect(f"/api/ws?token={token}") as ws:
+        ws.send_text("not json")
+        assert ws.receive_json() == {"type": "error", "error": "Messages must be JSON"}
+        ws.send_json({"action": "watch", "job_ids": []})
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"action": "subscribe", "job_ids": ["missing"]})
+        assert ws.receive_json() == {"type": "error", "job_id": "missing", "error": "Job not found"}
+        assert ws.receive_json() == {"type": "subscribed", "job_ids": []}
@@ -0,0 +1,158 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import runner
+from app.models import Job, JobStatus, Priority
+from app.store import InMemoryJobStore
+from app.work_queue import WorkQueue
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.db"), lease_seconds=0.2, max_attempts=2)
+    await queue.start()
+    yield queue
+    await queue.close()
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemoryJobStore()
+    monkeypatch.setattr(runner, "job_store", store)
+    return store
+
+
+def _runner(queue: WorkQueue) -> runner.QueuedJobRunner:
+    job_runner = runner.QueuedJobRunner(queue=queue, max_outputs_per_prediction=1, poll_interval=0.01)
+    job_runner.heartbeat_interval = 0
+    return job_runner
+
+
+async def test_expired_lease_is_reclaimed_then_failed(queue):
+    job = Job(prompt="a cat", num_images=5)
+    await queue.enqueue(job, [[0]], origin="api")
+
+    first = await queue.claim("worker-1")
+    assert first.attempts == 1
+    assert await queue.claim("worker-2") is None
+
+    await asyncio.sleep(0.3)
+    second = await queue.claim("worker-2")
+    assert (second.id, second.attempts) == (first.id, 2)
+    # The first worker learns on its next heartbeat that it lost the item
+    assert await queue.heartbeat("worker-1", [first.id]) == {first.id}
+    assert await queue.heartbeat("worker-2", [second.id]) == set()
+
+    await asyncio.sleep(0.3)
+    assert await queue.claim("worker-3") is None
+    updates = await queue.read_results("api")
+    assert [(job_id, index, data["status"]) for _, job_id, index, data, _ in updates] == [(job.id, 0, "failed")]
+
+
+async def test_heartbeat_keeps_the_lease(queue):
+    await queue.enqueue(Job(prompt="a cat", num_images=5), [[0]])
+    item = await queue.claim("worker-1")
+    for _ in range(3):
+        await asyncio.sleep(0.1)
+        assert await queue.heartbeat("worker-1", [item.id]) == set()
+    assert await queue.claim("worker-2") is None
+
+
+async def test_each_update_is_applied_once_by_its_origin(queue, store):
+    first, second = _runner(queue), _runner(queue)
+    await queue.heartbeat_reader(first.reader_id)
+    await queue.heartbeat_reader(second.reader_id)
+
+    job = Job(prompt="a cat", num_images=5)
+    await store.create_job(job)
+    await first.start_jobs([job.id])
+    await queue.push_results(job.id, [(0, {"status": "completed", "url": "https://example.com/0.png"})])
+
+    assert await second._pump_once() == 0
+    assert await first._pump_once() == 1
+    assert await first._pump_once() == 0
+    assert job.completed_count == 1
+    assert (await queue.stats())["result_updates"] == 0
+
+
+async def test_stopped_reader_jobs_are_adopted(queue, store):
+    first, second = _runner(queue), _runner(queue)
+    job = Job(prompt="a cat", num_images=5)
+    await store.create_job(job)
+    await first.start_jobs([job.id])
+    await queue.push_results(job.id, [(0, {"status": "completed", "url": "https://example.com/0.png"})])
+
+    await queue.heartbeat_reader(first.reader_id)
+    await queue.remove_reader(first.reader_id)
+    assert await second._pump_once() == 1
+    assert job.completed_count == 1
+
+
+async def test_failing_update_is_skipped_after_retries(queue, store, monkeypatch):
+    job_runner = _runner(queue)
+    job = Job(prompt="a cat", num_images=5)
+    await store.create_job(job)
+    await job_runner.start_jobs([job.id])
+    await queue.push_results(job.id, [(0, {"status": "bogus"}), (1, {"status": "completed", "url": "u"})])
+
+    for _ in range(job_runner.max_apply_attempts - 1):
+        with pytest.raises(ValueError):
+            await job_runner._pump_once()
+        assert job.completed_count == 0
+    await job_runner._pump_once()
+
+    assert job.completed_count == 1
+    assert (await queue.stats())["result_updates"] == 0
+
+
+async def test_pump_backs_off_on_errors(queue, store, monkeypatch):
+    job_runner = _runner(queue)
+    calls = 0
+
+    async def broken(reader, limit=500):
+        nonlocal calls
+        calls += 1
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(queue, "read_results", broken)
+    pump = asyncio.create_task(job_runner._pump_loop())
+    await asyncio.sleep(0.3)
+    pump.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await pump
+    # Doubling from 10ms: a handful of attempts, not a busy loop
+    assert 3 <= calls <= 6
+
+
+async def test_total_time_counts_from_start_not_creation(queue, store):
+    job_runner = _runner(queue)
+    job = Job(prompt="a cat", num_images=5, created_at=datetime.utcnow() - timedelta(hours=1))
+    await store.create_job(job)
+    await job_runner.start_jobs([job.id])
+
+    await queue.push_results(job.id, [(i, {"status": "completed", "url": f"u{i}"}) for i in range(5)])
+    await job_runner._pump_once()
+
+    assert job.status == JobStatus.COMPLETED
+    assert 0 <= job.total_ms < 60_000
+
+
+async def test_claims_alternate_users_whatever_their_priority(queue):
+    normal = Job(prompt="a dog", num_images=4, owner="bob")
+    await queue.enqueue(normal, [[index] for index in range(4)])
+    for job in range(2):
+        urgent = Job(prompt="a cat", num_images=4, owner="alice", priority=Priority.HIGH)
+        await queue.enqueue(urgent, [[index] for index in range(4)])
+
+    users = []
+    for _ in range(6):
+        item = await queue.claim("worker-1")
+        users.append(item.job.owner)
+        await queue.complete(item.id, "worker-1")
+
+    assert users.count("alice") == users.count("bob") == 3
+    assert users[:2] in (["alice", "bob"], ["bob", "alice"])
@@ -18,12 +18,8 @@ export const useGetJobStatus = (jobId: string) => {
     queryFn: async () => {
       const data = await getJobStatus(jobId);
 
-      const completedCount = data?.results.filter(
-        (r) => r.status === "completed"
-      ).length;
-      const failedCount = data?.results.filter(
-        (r) => r.status === "failed"
-      ).length;
+      const completedCount = data?.progress?.completed ?? 0;
+      const failedCount = data?.progress?.failed ?? 0;
 
       if (data?.status === "completed") {
         toast({
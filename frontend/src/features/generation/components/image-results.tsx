@@ -11,9 +11,16 @@ interface ImageResultProps {
 export function ImageResult({ item, index, className }: ImageResultProps) {
   const statusColors = {
     running: "bg-blue-500",
+    starting: "bg-blue-500",
+    processing: "bg-blue-500",
     completed: "bg-green-500",
     failed: "bg-red-500",
+    cancelled: "bg-gray-500",
   };
+  const isInProgress =
+    item.status === "running" ||
+    item.status === "starting" ||
+    item.status === "processing";
 
   return (
     <Card className={className}>
@@ -30,9 +37,19 @@ export function ImageResult({ item, index, className }: ImageResultProps) {
           </Badge>
         </div>
 
-        {item.status === "running" && (
+        {isInProgress && item.url && (
+          <div className="aspect-square bg-gray-100 rounded-lg overflow-hidden">
+            <img
+              src={item.url}
+              alt={`Preview of image ${index + 1} while it is generated`}
+              className="w-full h-full object-cover opacity-60"
+            />
+          </div>
+        )}
+
+        {isInProgress && !item.url && (
           <div
-            className="aspect-square bg-gray-100 rounded-lg flex items-center justify-center"
+            className="aspect-square bg-gray-100 rounded-lg flex flex-col items-center justify-center gap-2"
             aria-label={`Image ${index + 1} is currently being generated`}
             role="img"
           >
@@ -40,6 +57,9 @@ export function ImageResult({ item, index, className }: ImageResultProps) {
               className="animate-spin h-8 w-8 border-2 border-blue-500 border-t-transparent rounded-full"
               aria-hidden="true"
             ></div>
+            {item.progress != null && (
+              <span className="text-xs text-gray-500">{item.progress}%</span>
+            )}
             <span className="sr-only">Loading image {index + 1}</span>
           </div>
         )}
@@ -47,7 +67,7 @@ export function ImageResult({ item, index, className }: ImageResultProps) {
         {item.status === "completed" && item.url && (
           <div className="aspect-square bg-gray-100 rounded-lg overflow-hidden">
             <img
-              src={item.url}
+              src={item.thumbnail_url ?? item.url}
               alt={`Generated image ${index + 1} from the prompt`}
               className="w-full h-full object-cover focus:outline-none focus:ring-2 focus:ring-blue-500 focus:ring-offset-2"
               loading="lazy"
@@ -9,21 +9,58 @@ export interface GenerateResponse {
 }
 
 export interface JobItem {
+  // Position in the job; set by the polling endpoint, whose long-poll mode returns only changed results
+  index?: number;
   id: string;
-  status: "running" | "completed" | "failed";
+  status: "running" | "starting" | "processing" | "completed" | "failed" | "cancelled";
   url?: string;
   error?: string;
+  progress?: number;
+  started_at?: string;
+  finished_at?: string;
+  mirror_url?: string;
+  thumbnail_url?: string;
+}
+
+export interface ImageTimeline {
+  queued_at?: string;
+  slot_acquired_at?: string;
+  prediction_created_at?: string;
+  prediction_started_at?: string;
+  completed_at?: string;
+  attempts: number;
+  prediction_id?: string;
+  predict_time?: number;
+}
+
+export interface StageBreakdown {
+  queue_ms?: number;
+  submit_ms?: number;
+  upstream_queue_ms?: number;
+  predict_ms?: number;
+  end_to_end_ms?: number;
+  retried_images: number;
 }
 
 export interface JobStatus {
   id: string;
   prompt: string;
   num_images: number;
-  status: "pending" | "running" | "completed" | "failed";
+  status: "pending" | "running" | "completed" | "failed" | "cancelled";
   created_at: string;
   results: JobItem[];
   total_ms?: number;
   ttfi_ms?: number;
+  // Set by the polling endpoint; bumped on every change to the job
+  version?: number;
+  progress?: JobProgressCounts;
+}
+
+export interface JobProgressCounts {
+  completed: number;
+  failed: number;
+  running: number;
+  total: number;
 }
 
 export interface JobMetrics {
@@ -34,4 +71,6 @@ export interface JobMetrics {
   completed_count: number;
   failed_count: number;
   total_count: number;
+  stages: StageBreakdown;
+  images: ImageTimeline[];
 }